@@ -0,0 +1,186 @@
+"""Moves old, settled expenses out of `expenses` and `splits`.
+
+An expense is archived once it is older than the cutoff and the people it
+is between are settled with each other. For a group expense that means
+every member of the group has a zero net position in it. For an expense
+outside a group, it means each creditor / debtor pair it created is even.
+The expense and its splits move to `expenses_archive` and `splits_archive`
+with the same expense_id. The sum of the archived splits per
+(creditor, debtor, group) is added to `balances_carried`, so `ledger
+rebuild` and `ledger verify` still arrive at the same totals. `balances`
+is not touched.
+
+Each batch of at most `--batch-size` expenses is moved in its own short
+transaction, and the job pauses between batches, so live writes never wait
+long on its locks. Run it from cron in every database:
+
+    python archive.py run --older-than-days 365
+    python archive.py status
+"""
+import argparse
+import sys
+import time
+from collections import defaultdict
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+import ledger
+import models
+import versions
+
+# Net positions closer to zero than this count as settled.
+TOLERANCE = 0.005
+
+_EXPENSE_COLUMNS = ["expense_id", "created_by", "group_id", "description", "amount", "created_at"]
+_SPLIT_COLUMNS = ["expense_id", "user_id", "amount", "created_at"]
+
+
+def unsettled(db: Session):
+    """Finds who is not yet even, from the ledger.
+
+    Returns:
+        tuple[set[int], set[tuple[int, int]]]: Ids of groups where some
+        member's net position is not zero, and the (lower, higher) user id
+        pairs that owe each other outside any group.
+    """
+    net = defaultdict(float)
+    others = models.Balances.creditor_id != models.Balances.debtor_id
+    for group_id, user_id, amount in db.query(
+        models.Balances.group_id, models.Balances.creditor_id, func.sum(models.Balances.amount)
+    ).filter(models.Balances.group_id != ledger.NO_GROUP, others).group_by(models.Balances.group_id, models.Balances.creditor_id):
+        net[(group_id, user_id)] += amount
+    for group_id, user_id, amount in db.query(
+        models.Balances.group_id, models.Balances.debtor_id, func.sum(models.Balances.amount)
+    ).filter(models.Balances.group_id != ledger.NO_GROUP, others).group_by(models.Balances.group_id, models.Balances.debtor_id):
+        net[(group_id, user_id)] -= amount
+    groups = {group_id for (group_id, _), amount in net.items() if abs(amount) > TOLERANCE}
+
+    owed = defaultdict(float)
+    for creditor_id, debtor_id, amount in db.query(
+        models.Balances.creditor_id, models.Balances.debtor_id, models.Balances.amount
+    ).filter(models.Balances.group_id == ledger.NO_GROUP, others):
+        if creditor_id < debtor_id:
+            owed[(creditor_id, debtor_id)] += amount
+        else:
+            owed[(debtor_id, creditor_id)] -= amount
+    pairs = {pair for pair, amount in owed.items() if abs(amount) > TOLERANCE}
+    return groups, pairs
+
+
+def archive_batch(db: Session, cutoff, after, batch_size, unsettled_groups, unsettled_pairs, versions_db=None):
+    """Archives the eligible expenses among the next `batch_size` older than `cutoff`.
+
+    Args:
+        db (Session): The SQLAlchemy session.
+        cutoff (datetime): Naive UTC; only expenses created before it qualify.
+        after (int): Scan expense ids greater than this.
+        batch_size (int): Most expenses looked at, and moved, in one transaction.
+        unsettled_groups (set[int]), unsettled_pairs (set[tuple[int, int]]):
+            From `unsettled`.
+        versions_db (Session | None): Session on the global database, where
+            the batch bumps the versions of the users and groups it touches;
+            `db` itself when None.
+
+    Returns:
+        tuple[int | None, int]: The last expense id looked at (None when
+        nothing is left to scan) and how many expenses were archived.
+    """
+    candidates = db.query(models.Expenses.expense_id, models.Expenses.created_by, models.Expenses.group_id).filter(
+        models.Expenses.created_at < cutoff,
+        models.Expenses.expense_id > after,
+    ).order_by(models.Expenses.expense_id).limit(batch_size).all()
+    if not candidates:
+        return None, 0
+
+    splits = defaultdict(list)
+    for expense_id, user_id, amount in db.query(models.Splits.expense_id, models.Splits.user_id, models.Splits.amount).filter(
+        models.Splits.expense_id.in_([row.expense_id for row in candidates])
+    ):
+        splits[expense_id].append((user_id, amount))
+
+    eligible = []
+    deltas = defaultdict(float)
+    for expense_id, creditor_id, group_id in candidates:
+        if group_id is not None:
+            if group_id in unsettled_groups:
+                continue
+        elif any((min(creditor_id, user_id), max(creditor_id, user_id)) in unsettled_pairs for user_id, _ in splits[expense_id]):
+            continue
+        eligible.append(expense_id)
+        ledger.merge_deltas(deltas, ledger.expense_deltas(creditor_id, group_id, splits[expense_id]))
+
+    if eligible:
+        try:
+            db.execute(insert(models.ExpenseArchive).from_select(
+                _EXPENSE_COLUMNS,
+                select(*(getattr(models.Expenses, name) for name in _EXPENSE_COLUMNS)).where(models.Expenses.expense_id.in_(eligible)),
+            ))
+            db.execute(insert(models.SplitArchive).from_select(
+                _SPLIT_COLUMNS,
+                select(*(getattr(models.Splits, name) for name in _SPLIT_COLUMNS)).where(models.Splits.expense_id.in_(eligible)),
+            ))
+            ledger.apply(db, deltas, models.CarriedBalance)
+            db.execute(delete(models.Splits).where(models.Splits.expense_id.in_(eligible)))
+            db.execute(delete(models.Expenses).where(models.Expenses.expense_id.in_(eligible)))
+            versions.commit(
+                versions_db or db,
+                db,
+                {user_id for creditor_id, debtor_id, _ in deltas for user_id in (creditor_id, debtor_id)},
+                {group_id for _, _, group_id in deltas},
+            )
+        except Exception:
+            db.rollback()
+            raise
+    return candidates[-1].expense_id, len(eligible)
+
+
+def run(db: Session, cutoff, batch_size=500, pause=0.1, versions_db=None):
+    """Archives every eligible expense created before `cutoff`, one batch per transaction.
+
+    `versions_db` is passed on to `archive_batch`.
+
+    Returns:
+        int: The number of expenses archived.
+    """
+    unsettled_groups, unsettled_pairs = unsettled(db)
+    after = 0
+    archived = 0
+    while True:
+        after, moved = archive_batch(db, cutoff, after, batch_size, unsettled_groups, unsettled_pairs, versions_db)
+        if after is None:
+            return archived
+        archived += moved
+        if pause:
+            time.sleep(pause)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old, settled expenses.")
+    parser.add_argument("command", choices=["run", "status"])
+    parser.add_argument("--older-than-days", type=float, default=365)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.1, help="seconds to sleep between batches")
+    args = parser.parse_args(argv)
+
+    import database
+    import sharding
+
+    cutoff = datetime.now(UTC).replace(tzinfo=None) - timedelta(days=args.older_than_days)
+    for shard in sharding.all_shards():
+        label = "global" if shard is None else f"shard {shard}"
+        with sharding.shard_session(shard) as db, database.SessionLocal() as global_db:
+            if args.command == "run":
+                # a shard's batches bump versions in the global database as well
+                versions_db = None if shard is None else global_db
+                print(f"{label}: archived {run(db, cutoff, args.batch_size, args.pause, versions_db)} expenses")
+                continue
+            live = db.query(func.count(models.Expenses.expense_id)).scalar()
+            archived = db.query(func.count(models.ExpenseArchive.expense_id)).scalar()
+            print(f"{label}: {live} live expenses, {archived} archived")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
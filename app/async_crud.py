@@ -0,0 +1,282 @@
+"""Async counterparts of the functions in `crud`, for an `AsyncSession`.
+
+They issue the same statements as `crud` and share the user cache and the
+balance ledger, so both modes can serve the same database side by side.
+"""
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+import ledger
+import models
+import schema
+import sharding
+import snapshots
+import versions
+from cache import user_cache
+from exceptions import WriteRejectedException
+
+USER_COLUMNS = (models.User.user_id, models.User.first_name, models.User.email)
+
+
+async def create_user(db: AsyncSession, user: schema.UserCreate):
+    db_user = models.User(first_name=user.first_name, last_name=user.last_name, email=user.email)
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    user_cache.invalidate(email=db_user.email, user_id=db_user.user_id)
+    crud.users_changed([db_user.user_id])
+    return db_user
+
+
+async def add_friend(db: AsyncSession, friend: schema.FriendAdd):
+    user_id = await get_user(db, friend.user_email)
+    friend_id = await get_user(db, friend.friend_email)
+    db_friend = models.Friends(user_id=user_id.user_id, friend_user_id=friend_id.user_id)
+    db.add(db_friend)
+    try:
+        user_versions = await db.run_sync(versions.bump, [user_id.user_id, friend_id.user_id])
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise WriteRejectedException({"error": f"{user_id.first_name} and {friend_id.first_name} are already friends"})
+    crud.friend_added(user_id.user_id, friend_id.user_id, user_versions)
+    await db.refresh(db_friend)
+    return db_friend
+
+
+async def create_group(db: AsyncSession, group: schema.GroupCreate):
+    try:
+        user = await get_user(db, group.created_by)
+        if not user:
+            raise WriteRejectedException({"error": f"User {group.created_by} does not exist"})
+        db_group = models.Groups(group_name=group.group_name, created_by=user.user_id)
+        db.add(db_group)
+        await db.commit()
+        await db.refresh(db_group)
+        await add_user_to_group(db, schema.GroupMemberAdd(
+            groupmember_user_email=group.created_by,
+            groupmember_group_id=db_group.group_id,
+            added_by=group.created_by,
+        ), event="group_created")
+        return db_group
+    except Exception:
+        await db.rollback()
+        raise
+
+
+async def add_user_to_group(db: AsyncSession, group_member: schema.GroupMemberAdd, event="group_member_added"):
+    user = await get_user(db, group_member.groupmember_user_email)
+    group = await get_group(db, group_member.groupmember_group_id)
+    added_by = await get_user(db, group_member.added_by)
+    db_groupMember = models.GroupMembers(groupmember_group_id=group.group_id, groupmember_user_id=user.user_id, added_by=added_by.user_id)
+    db.add(db_groupMember)
+    try:
+        user_versions = await db.run_sync(versions.bump, [user.user_id])
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise WriteRejectedException({"error": f"{group_member.groupmember_user_email} is already in {group.group_name}"})
+    crud.member_added(user.user_id, group_member.groupmember_group_id, event, user_versions)
+    await db.refresh(db_groupMember)
+    db_groupMember.groupmember_user_email = user.email
+    return db_groupMember
+
+
+async def add_expense(db: AsyncSession, expense: schema.ExpenseCreate):
+    all_users = expense.users + [expense.created_by]
+    try:
+        user_ids = {email: user.user_id for email, user in (await get_users_by_email(db, all_users)).items()}
+        missing = [email for email in all_users if email not in user_ids]
+        if missing:
+            raise WriteRejectedException({"error": f"User {missing[0]} does not exist"})
+        group_id = None
+        if expense.group_id:
+            group = await get_group(db, int(expense.group_id))
+            if not group:
+                raise WriteRejectedException({"error": f"Group {expense.group_id} does not exist"})
+            group_id = group.group_id
+        # the allocator reserves its blocks on the sync engine, once per block
+        expense_id = (await run_in_threadpool(sharding.expense_ids, 1))[0]
+        db_expense = models.Expenses(expense_id=expense_id, amount=expense.amount, description=expense.description, created_by=user_ids[expense.created_by], group_id=group_id)
+        db.add(db_expense)
+        await db.flush()
+        each_split = expense.amount/len(all_users)
+        splits = [(user_ids[each_user], each_split) for each_user in all_users]
+        await db.execute(insert(models.Splits), [
+            {"expense_id": db_expense.expense_id, "user_id": user_id, "amount": amount}
+            for user_id, amount in splits
+        ])
+        await db.run_sync(ledger.apply, ledger.expense_deltas(db_expense.created_by, db_expense.group_id, splits))
+        user_versions = await db.run_sync(versions.bump, user_ids.values(), [group_id])
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    crud.expenses_committed(user_ids.values(), user_versions)
+    await db.refresh(db_expense)
+    return db_expense
+
+
+async def get_all_users(db: AsyncSession, limit=None, after=None, columns=None):
+    stmt = select(*(columns or [models.User])).order_by(models.User.user_id)
+    if after is not None:
+        stmt = stmt.where(models.User.user_id > after)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    if columns:
+        return (await db.execute(stmt)).all()
+    return (await db.scalars(stmt)).all()
+
+
+async def iter_users(db: AsyncSession, batch_size=1000):
+    """Streams every user in keyset chunks of `batch_size`, as `crud.iter_users` does."""
+    async for user in _keyset_chunks(lambda after: get_all_users(db, limit=batch_size, after=after), batch_size, "user_id"):
+        yield user
+
+
+async def _keyset_chunks(page, batch_size, key):
+    after = None
+    while True:
+        rows = await page(after)
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        after = getattr(rows[-1], key)
+
+
+async def get_all_expenses(db: AsyncSession, user_email, limit=None, after=None, columns=None, include_archived=False):
+    user = await get_user(db, user_email)
+    return await expense_page(db, user.user_id, limit=limit, after=after, columns=columns, include_archived=include_archived)
+
+
+async def expense_page(db: AsyncSession, user_id, limit=None, after=None, columns=None, include_archived=False):
+    if include_archived:
+        return (await db.execute(crud.expense_history(user_id, columns, after, limit))).all()
+    stmt = select(*(columns or [models.Expenses])).where(models.Expenses.created_by == user_id).order_by(models.Expenses.expense_id)
+    if after is not None:
+        stmt = stmt.where(models.Expenses.expense_id > after)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    if columns:
+        return (await db.execute(stmt)).all()
+    return (await db.scalars(stmt)).all()
+
+
+async def iter_expenses(db: AsyncSession, user_id, batch_size=1000, include_archived=False):
+    """Streams the expenses a user created in keyset chunks, as `crud.iter_expenses` does."""
+    async for expense in _keyset_chunks(
+        lambda after: expense_page(db, user_id, limit=batch_size, after=after, include_archived=include_archived),
+        batch_size, "expense_id",
+    ):
+        yield expense
+
+
+async def total_owed_by_the_user(db: AsyncSession, user_email, as_of=None):
+    user = await get_user(db, user_email)
+    source = snapshots.ledger_source(user.user_id, as_of)
+    owed = await db.scalar(select(func.coalesce(func.sum(source.amount), 0.0)).where(
+        source.debtor_id == user.user_id,
+        source.creditor_id != user.user_id,
+    ))
+    owes = await db.scalar(select(func.coalesce(func.sum(source.amount), 0.0)).where(
+        source.creditor_id == user.user_id,
+        source.debtor_id != user.user_id,
+    ))
+    total = owed - owes
+    if total < 0:
+        return {'result': f"You are owed {-1 * total!s}"}
+    else:
+        return {'result': f"You owe {total!s}"}
+
+
+async def owed_to_each_user(db: AsyncSession, user_email, by_id=False, as_of=None):
+    user = await get_user(db, user_email)
+    source = snapshots.ledger_source(user.user_id, as_of)
+    results = (await db.execute(
+        select(source.creditor_id, func.sum(source.amount).label('total_amount'))
+        .where(source.debtor_id == user.user_id, source.creditor_id != user.user_id)
+        .group_by(source.creditor_id)
+    )).all()
+    if by_id:
+        return {row[0]: row[1] for row in results}
+    users = await get_users_by_id(db, [row[0] for row in results])
+    return {users[row[0]].first_name: row[1] for row in results}
+
+
+async def owed_in_each_group(db: AsyncSession, user_email, as_of=None):
+    user = await get_user(db, user_email)
+    source = snapshots.ledger_source(user.user_id, as_of)
+    results = (await db.execute(
+        select(models.Groups.group_name, func.sum(source.amount).label('total_amount'))
+        .join(models.Groups, models.Groups.group_id == source.group_id)
+        .where(source.group_id != ledger.NO_GROUP, source.debtor_id == user.user_id)
+        .group_by(models.Groups.group_name)
+    )).all()
+    return {row[0]: row[1] for row in results}
+
+
+async def user_all_groups(db: AsyncSession, user_email, as_of=None):
+    user = await get_user(db, user_email)
+    as_of_filter = [models.GroupMembers.added_at <= as_of] if as_of is not None else []
+    results = (await db.execute(
+        select(models.Groups.group_name)
+        .join(models.GroupMembers, models.GroupMembers.groupmember_group_id == models.Groups.group_id)
+        .where(models.GroupMembers.groupmember_user_id == user.user_id, *as_of_filter)
+        .distinct()
+    )).all()
+    return [row[0] for row in results]
+
+
+async def get_user(db: AsyncSession, user_email):
+    cached = user_cache.by_email.get(user_email)
+    if cached is not None:
+        return cached
+    user = (await db.execute(select(*USER_COLUMNS).where(models.User.email == user_email))).first()
+    return user_cache.store(user) if user else None
+
+
+async def get_user_by_id(db: AsyncSession, user_id):
+    cached = user_cache.by_id.get(user_id)
+    if cached is not None:
+        return cached
+    user = (await db.execute(select(*USER_COLUMNS).where(models.User.user_id == user_id))).first()
+    return user_cache.store(user) if user else None
+
+
+async def get_users_by_email(db: AsyncSession, user_emails):
+    found = {}
+    missing = set()
+    for email in set(user_emails):
+        cached = user_cache.by_email.get(email)
+        if cached is not None:
+            found[email] = cached
+        else:
+            missing.add(email)
+    if missing:
+        for row in await db.execute(select(*USER_COLUMNS).where(models.User.email.in_(missing))):
+            found[row.email] = user_cache.store(row)
+    return found
+
+
+async def get_users_by_id(db: AsyncSession, user_ids):
+    """Async stand-in for `loaders.UserLoader.load_many`: cache first, then one IN query."""
+    found = {}
+    missing = set()
+    for user_id in set(user_ids):
+        cached = user_cache.by_id.get(user_id)
+        if cached is not None:
+            found[user_id] = cached
+        else:
+            missing.add(user_id)
+    if missing:
+        for row in await db.execute(select(*USER_COLUMNS).where(models.User.user_id.in_(missing))):
+            found[row.user_id] = user_cache.store(row)
+    return found
+
+
+async def get_group(db: AsyncSession, group_id):
+    return await db.scalar(select(models.Groups).where(models.Groups.group_id == group_id))
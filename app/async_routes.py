@@ -0,0 +1,116 @@
+"""Async versions of the routes in `main`, served when DB_ASYNC is set.
+
+Each handler awaits an `AsyncSession` instead of holding a threadpool
+thread while MySQL works, so one process can keep many more requests in
+flight.
+"""
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import async_crud
+import async_services
+import fastjson
+import models
+import schema
+import snapshots
+import versions
+from database import AsyncSessionLocal
+from exceptions import UserNotFoundException
+from streaming import ndjson_line, next_page_headers
+
+router = APIRouter()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def ndjson_stream(rows, model):
+    """Async counterpart of `main.ndjson_stream`; `rows` is an async generator function."""
+    async def generate():
+        async with AsyncSessionLocal() as db:
+            async for row in rows(db):
+                yield ndjson_line(row, model)
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@router.post("/users/", response_model=schema.User)
+async def create_user(user: schema.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    return await async_services.create_user_service(db, user)
+
+@router.post("/addfriend/", response_model=schema.Friend)
+async def add_friend(friend: schema.FriendAdd, db: AsyncSession = Depends(get_async_db)):
+    return await async_services.add_friend_service(db, friend)
+
+@router.post("/groups/", response_model=schema.Group)
+async def create_group(group: schema.GroupCreate, db: AsyncSession = Depends(get_async_db)):
+    return await async_services.create_group_service(db, group)
+
+@router.post("/addmembertogroup/", response_model=schema.GroupMember)
+async def add_user_to_group(group_member: schema.GroupMemberAdd, db: AsyncSession = Depends(get_async_db)):
+    return await async_services.add_member_to_group_service(db, group_member)
+
+@router.post("/addexpense", response_model=schema.Expense)
+async def add_expense(expense: schema.ExpenseCreate, db: AsyncSession = Depends(get_async_db)):
+    return await async_crud.add_expense(db, expense)
+
+@router.get("/users/", response_model=list[schema.User])
+async def get_users(response: Response, limit: int | None = Query(None, ge=1), after: int | None = None, stream: bool = False, db: AsyncSession = Depends(get_async_db)):
+    if stream:
+        return ndjson_stream(async_crud.iter_users, schema.User)
+    if fastjson.ENABLED:
+        users = await async_crud.get_all_users(db, limit=limit, after=after, columns=fastjson.columns(models.User, schema.User))
+        return fastjson.response(schema.User, users, headers=next_page_headers(users, limit, "user_id"))
+    users = await async_crud.get_all_users(db, limit=limit, after=after)
+    response.headers.update(next_page_headers(users, limit, "user_id"))
+    return users
+
+@router.get("/user_expenses/", response_model=list[schema.Expense])
+async def get_user_expenses(user_email: str, response: Response, limit: int | None = Query(None, ge=1), after: int | None = None, stream: bool = False, include_archived: bool = False, db: AsyncSession = Depends(get_async_db)):
+    user_id = (await get_user_or_404(db, user_email)).user_id
+    if stream:
+        return ndjson_stream(lambda stream_db: async_crud.iter_expenses(stream_db, user_id, include_archived=include_archived), schema.Expense)
+    if fastjson.ENABLED:
+        expenses = await async_crud.expense_page(db, user_id, limit=limit, after=after, columns=fastjson.columns(models.Expenses, schema.Expense), include_archived=include_archived)
+        return fastjson.response(schema.Expense, expenses, headers=next_page_headers(expenses, limit, "expense_id"))
+    expenses = await async_crud.expense_page(db, user_id, limit=limit, after=after, include_archived=include_archived)
+    response.headers.update(next_page_headers(expenses, limit, "expense_id"))
+    return expenses
+
+async def get_user_or_404(db: AsyncSession, user_email):
+    user = await async_crud.get_user(db, user_email)
+    if not user:
+        raise UserNotFoundException()
+    return user
+
+@router.get("/amount_owed/")
+async def get_amount_owed(user_email: str, request: Request, as_of: datetime | None = None, db: AsyncSession = Depends(get_async_db)):
+    user = await get_user_or_404(db, user_email)
+    as_of = snapshots.naive_utc(as_of)
+    return await versions.conditional_get_async(request, db, snapshots.cache_key("amount_owed", as_of), user.user_id,
+                                                lambda: async_crud.total_owed_by_the_user(db, user_email, as_of=as_of))
+
+@router.get("/amount_owed_to_each_user/")
+async def get_amount_owed_to_each_user(user_email: str, request: Request, by_id: bool = False, as_of: datetime | None = None, db: AsyncSession = Depends(get_async_db)):
+    user = await get_user_or_404(db, user_email)
+    as_of = snapshots.naive_utc(as_of)
+    return await versions.conditional_get_async(request, db, snapshots.cache_key(f"amount_owed_to_each_user:{int(by_id)}", as_of), user.user_id,
+                                                lambda: async_crud.owed_to_each_user(db, user_email, by_id=by_id, as_of=as_of))
+
+@router.get("/amount_owed_in_each_group/")
+async def get_amount_owed_to_each_group(user_email: str, request: Request, as_of: datetime | None = None, db: AsyncSession = Depends(get_async_db)):
+    user = await get_user_or_404(db, user_email)
+    as_of = snapshots.naive_utc(as_of)
+    return await versions.conditional_get_async(request, db, snapshots.cache_key("amount_owed_in_each_group", as_of), user.user_id,
+                                                lambda: async_crud.owed_in_each_group(db, user_email, as_of=as_of))
+
+@router.get("/all_user_groups")
+async def get_user_all_groups(user_email: str, request: Request, as_of: datetime | None = None, db: AsyncSession = Depends(get_async_db)):
+    user = await get_user_or_404(db, user_email)
+    as_of = snapshots.naive_utc(as_of)
+    return await versions.conditional_get_async(request, db, snapshots.cache_key("all_user_groups", as_of), user.user_id,
+                                                lambda: async_crud.user_all_groups(db, user_email, as_of=as_of))
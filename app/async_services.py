@@ -0,0 +1,64 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import async_crud
+import schema
+from exceptions import (
+    GroupNotFoundException,
+    UserAlreadyExistsException,
+    UserNotFoundException,
+)
+
+
+async def create_user_service(db: AsyncSession, user: schema.UserCreate):
+    """Async counterpart of `services.create_user_service`.
+
+    Raises:
+        UserAlreadyExistsException: If a user with the same email already exists.
+    """
+    existing_user = await async_crud.get_user(db, user_email=user.email)
+    if existing_user:
+        raise UserAlreadyExistsException()
+    return await async_crud.create_user(db, user)
+
+async def create_group_service(db: AsyncSession, group: schema.GroupCreate):
+    """Async counterpart of `services.create_group_service`.
+
+    Raises:
+        UserNotFoundException: If the user who created the group does not exist.
+    """
+    existing_user = await async_crud.get_user(db, user_email=group.created_by)
+    if not existing_user:
+        raise UserNotFoundException()
+    return await async_crud.create_group(db, group)
+
+async def add_friend_service(db: AsyncSession, friend: schema.FriendAdd):
+    """Async counterpart of `services.add_friend_service`.
+
+    Raises:
+        UserNotFoundException: If either user does not exist in the system.
+    """
+    existing_user = await async_crud.get_user(db, user_email=friend.user_email)
+    if not existing_user:
+        raise UserNotFoundException()
+    existing_friend = await async_crud.get_user(db, user_email=friend.friend_email)
+    if not existing_friend:
+        raise UserNotFoundException()
+    return await async_crud.add_friend(db, friend)
+
+async def add_member_to_group_service(db: AsyncSession, group_member: schema.GroupMemberAdd):
+    """Async counterpart of `services.add_member_to_group_service`.
+
+    Raises:
+        UserNotFoundException: If either user does not exist in the system.
+        GroupNotFoundException: If the specified group does not exist.
+    """
+    existing_user = await async_crud.get_user(db, user_email=group_member.added_by)
+    if not existing_user:
+        raise UserNotFoundException()
+    existing_group_member = await async_crud.get_user(db, user_email=group_member.groupmember_user_email)
+    if not existing_group_member:
+        raise UserNotFoundException()
+    existing_group = await async_crud.get_group(db, group_member.groupmember_group_id)
+    if not existing_group:
+        raise GroupNotFoundException()
+    return await async_crud.add_user_to_group(db, group_member)
@@ -0,0 +1,7 @@
+"""End-to-end benchmarks for the API.
+
+`python -m benchmarks` seeds a local SQLite database with synthetic data,
+drives every route in `main.app` in-process through FastAPI's TestClient and
+writes latency percentiles, throughput and SQL statements per request as
+JSON so runs can be compared across commits. Run it from the `app` directory.
+"""
@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import UTC, datetime
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmark every API route against a seeded SQLite database.")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--friends-per-user", type=int, default=5)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--expenses", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per route")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", help="SQLite file to use (default: a fresh temporary file)")
+    parser.add_argument("--out", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="yas-bench-"), "bench.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    # must be set before database.py creates its engine
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    import database
+    import main as api
+    from benchmarks import datagen, driver
+
+    api.create_schema()
+    db = database.SessionLocal()
+    try:
+        dataset = datagen.generate(
+            db,
+            users=args.users,
+            friends_per_user=args.friends_per_user,
+            groups=args.groups,
+            expenses=args.expenses,
+            seed=args.seed,
+        )
+    finally:
+        db.close()
+
+    routes = driver.run(api.app, [database.engine], dataset, requests_per_route=args.requests, seed=args.seed)
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(UTC).isoformat(),
+        "python": platform.python_version(),
+        "database": "sqlite",
+        "dataset": {
+            "users": len(dataset.emails),
+            "friendships": len(dataset.friendships),
+            "groups": len(dataset.groups),
+            "expenses": dataset.expenses,
+            "splits": dataset.splits,
+            "seed": args.seed,
+        },
+        "routes": routes,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, stats in routes.items():
+        if "skipped" in stats:
+            print(f"{name:40} skipped")
+            continue
+        latency = stats["latency_ms"]
+        print(f"{name:40} p50={latency['p50']:7.2f}ms p95={latency['p95']:7.2f}ms p99={latency['p99']:7.2f}ms "
+              f"{stats['throughput_rps']:8.1f} req/s {stats['sql_statements']['mean']:5.1f} sql/req errors={stats['errors']}")
+    print(f"wrote {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""Statement budget check for every route in `main.app`.
+
+Runs each route's scenario against a fresh SQLite database at several
+input sizes and counts the statements each request executes. In-process
+caches are cleared before every counted request, so a cached lookup
+cannot hide a per-row query. A route fails when:
+
+- a request runs more statements than its `@query_budget`,
+- the count differs between input sizes, which is how an N+1 query shows,
+- or the request itself fails.
+
+Routes without a budget are listed and, with `--strict`, fail too.
+`tests/test_budgets.py` runs the strict check with the test suite. Run it
+by hand from the `app` directory to see the counts:
+
+    python -m benchmarks.budgets
+    python -m benchmarks.budgets --sizes 1 4 16 --out budgets.json
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+from collections import namedtuple
+
+# (label, "METHOD path" of the route, build(size) -> request kwargs). `build`
+# sets up whatever the request needs through the API before it is counted.
+Scenario = namedtuple("Scenario", ["label", "route", "build"])
+
+
+class Fixture:
+    """Creates users, groups and expenses through the API for the scenarios."""
+
+    def __init__(self, client):
+        self.client = client
+        self._ids = itertools.count(1)
+
+    def post(self, path, **kwargs):
+        response = self.client.post(path, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f"setup request POST {path} failed: {response.status_code} {response.text}")
+        return response
+
+    def user(self):
+        n = next(self._ids)
+        email = f"budget{n}@budget.test"
+        self.post("/users/", json={"first_name": f"Budget{n}", "last_name": "User", "email": email})
+        return email
+
+    def users(self, count):
+        return [self.user() for _ in range(count)]
+
+    def group(self, creator, members=()):
+        group_id = self.post("/groups/", json={"group_name": "Budget group", "created_by": creator}).json()["group_id"]
+        for member in members:
+            self.post("/addmembertogroup/", json={"groupmember_user_email": member, "groupmember_group_id": group_id, "added_by": creator})
+        return group_id
+
+    def expense(self, creator, users, group_id=None, amount=10.0):
+        return self.post("/addexpense", json={
+            "description": "Budget expense",
+            "amount": amount,
+            "group_id": "" if group_id is None else str(group_id),
+            "created_by": creator,
+            "users": users,
+        }).json()
+
+
+def scenarios(fixture):
+    """One or more scenarios per route; `size` is the input that must not change the count."""
+
+    def create_user(size):
+        n = next(fixture._ids)
+        return {"json": {"first_name": f"Budget{n}", "last_name": "User", "email": f"budget{n}@budget.test"}}
+
+    def add_friend(size):
+        user, friend = fixture.users(2)
+        return {"json": {"user_email": user, "friend_email": friend}}
+
+    def create_group(size):
+        return {"json": {"group_name": "Budget group", "created_by": fixture.user()}}
+
+    def add_member(size):
+        # a group that already has `size` members
+        creator, *members = fixture.users(size + 1)
+        group_id = fixture.group(creator, members[:-1])
+        return {"json": {"groupmember_user_email": members[-1], "groupmember_group_id": group_id, "added_by": creator}}
+
+    def add_expense(size):
+        # `size` participants besides the creator
+        creator, *participants = fixture.users(size + 1)
+        group_id = fixture.group(creator, participants)
+        return {"json": {"description": "Budget expense", "amount": 12.0, "group_id": str(group_id),
+                         "created_by": creator, "users": participants}}
+
+    def bulk_expenses(size):
+        # `size` expenses in one batch
+        creator, friend = fixture.users(2)
+        lines = [json.dumps({"description": f"Bulk {i}", "amount": 5.0, "group_id": "", "created_by": creator, "users": [friend]}) for i in range(size)]
+        return {"content": "\n".join(lines), "headers": {"content-type": "application/x-ndjson"}}
+
+    def list_users(size):
+        fixture.users(size)
+        return {"params": {"limit": size}}
+
+    def with_expenses(size, **params):
+        # a user who created `size` expenses
+        creator, friend = fixture.users(2)
+        for _ in range(size):
+            fixture.expense(creator, [friend])
+        return {"params": {"user_email": creator, **params}}
+
+    def with_creditors(size, **params):
+        # a user who owes `size` other users, in as many groups
+        debtor = fixture.user()
+        for creditor in fixture.users(size):
+            group_id = fixture.group(creditor, [debtor])
+            fixture.expense(creditor, [debtor], group_id)
+        return {"params": {"user_email": debtor, **params}}
+
+    def with_groups(size):
+        # a member of `size` groups
+        user = fixture.user()
+        creator = fixture.user()
+        for _ in range(size):
+            fixture.group(creator, [user])
+        return {"params": {"user_email": user}}
+
+    def settle_up(size):
+        # a group of `size` + 1 members who all owe its creator
+        creator, *members = fixture.users(size + 1)
+        group_id = fixture.group(creator, members)
+        fixture.expense(creator, members, group_id, amount=10.0 * (size + 1))
+        return {"params": {"group_id": group_id}}
+
+    def with_friends(size):
+        # a user with `size` friends, half of them added from the other side
+        user, *friends = fixture.users(size + 1)
+        for i, friend in enumerate(friends):
+            pair = (user, friend) if i % 2 else (friend, user)
+            fixture.post("/addfriend/", json={"user_email": pair[0], "friend_email": pair[1]})
+        return {"params": {"user_email": user}}
+
+    def with_mutual_friends(size):
+        # two users with `size` friends in common
+        user, other, *common = fixture.users(size + 2)
+        for friend in common:
+            fixture.post("/addfriend/", json={"user_email": user, "friend_email": friend})
+            fixture.post("/addfriend/", json={"user_email": friend, "friend_email": other})
+        return {"params": {"user_email": user, "other_email": other}}
+
+    def with_suggestions(size):
+        # a user whose friend has `size` other friends, some sharing a group with the user
+        user, friend, *candidates = fixture.users(size + 2)
+        fixture.post("/addfriend/", json={"user_email": user, "friend_email": friend})
+        for candidate in candidates:
+            fixture.post("/addfriend/", json={"user_email": friend, "friend_email": candidate})
+        fixture.group(user, candidates[::2])
+        return {"params": {"user_email": user}}
+
+    def poll(size):
+        return {"params": {"user_email": fixture.user(), "timeout": 0}}
+
+    return [
+        Scenario("POST /users/", "POST /users/", create_user),
+        Scenario("POST /addfriend/", "POST /addfriend/", add_friend),
+        Scenario("POST /groups/", "POST /groups/", create_group),
+        Scenario("POST /addmembertogroup/ (group members)", "POST /addmembertogroup/", add_member),
+        Scenario("POST /addexpense (splits)", "POST /addexpense", add_expense),
+        Scenario("POST /expenses/bulk (expenses)", "POST /expenses/bulk", bulk_expenses),
+        Scenario("GET /users/ (page size)", "GET /users/", list_users),
+        Scenario("GET /user_expenses/ (expenses)", "GET /user_expenses/", with_expenses),
+        Scenario("GET /user_expenses/?stream (expenses)", "GET /user_expenses/", lambda size: with_expenses(size, stream=True)),
+        Scenario("GET /user_expenses/?include_archived (expenses)", "GET /user_expenses/", lambda size: with_expenses(size, include_archived=True)),
+        Scenario("GET /amount_owed/ (creditors)", "GET /amount_owed/", with_creditors),
+        Scenario("GET /amount_owed_to_each_user/ (creditors)", "GET /amount_owed_to_each_user/", with_creditors),
+        Scenario("GET /amount_owed_in_each_group/ (groups)", "GET /amount_owed_in_each_group/", with_creditors),
+        Scenario("GET /amount_owed/?as_of (creditors)", "GET /amount_owed/", lambda size: with_creditors(size, as_of="2999-01-01T00:00:00")),
+        Scenario("GET /all_user_groups (groups)", "GET /all_user_groups", with_groups),
+        Scenario("GET /friends/ (friends)", "GET /friends/", with_friends),
+        Scenario("GET /friends/?limit (friends)", "GET /friends/", lambda size: {"params": {**with_friends(size)["params"], "limit": 2}}),
+        Scenario("GET /mutual_friends/ (mutual friends)", "GET /mutual_friends/", with_mutual_friends),
+        Scenario("GET /friend_suggestions/ (candidates)", "GET /friend_suggestions/", with_suggestions),
+        Scenario("GET /dashboard (creditors)", "GET /dashboard", with_creditors),
+        Scenario("GET /settle_up/ (members)", "GET /settle_up/", settle_up),
+        Scenario("GET /events/poll", "GET /events/poll", poll),
+        Scenario("GET /metrics", "GET /metrics", lambda size: {}),
+    ]
+
+
+def clear_caches():
+    import settle
+    import versions
+    from cache import user_cache
+
+    user_cache.clear()
+    versions.response_cache.clear()
+    settle.plan_cache.clear()
+
+
+def run(app, engines, sizes):
+    """Counts every scenario's statements at each of `sizes` and checks them against the budgets.
+
+    Returns:
+        dict: {"scenarios": [...], "unbudgeted": ["METHOD path", ...]}
+    """
+    from fastapi.testclient import TestClient
+
+    import budgets
+    from benchmarks.driver import StatementCounter, api_routes
+
+    routes = {}
+    for route in api_routes(app.routes):
+        for method in route.methods:
+            routes.setdefault(f"{method} {route.path}", route)
+
+    results = []
+    # entering the client runs the lifespan, so startup work such as loading
+    # the friend graph happens before counting, as it does in production
+    with TestClient(app, raise_server_exceptions=False) as client, StatementCounter(engines) as counter:
+        fixture = Fixture(client)
+        # the first expense reserves a block of expense ids, a one-off cost
+        # no request should be charged for
+        creator, friend = fixture.users(2)
+        fixture.expense(creator, [friend])
+        for scenario in scenarios(fixture):
+            budget = budgets.budget_of(routes[scenario.route])
+            method, path = scenario.route.split(" ", 1)
+            counts = {}
+            errors = []
+            for size in sizes:
+                kwargs = scenario.build(size)
+                clear_caches()
+                before = counter.count
+                response = client.request(method, path, **kwargs)
+                counts[size] = counter.count - before
+                if response.status_code >= 400:
+                    errors.append(f"size {size}: HTTP {response.status_code} {response.text[:200]}")
+            problems = list(errors)
+            if budget is None:
+                problems.append("no @query_budget")
+            else:
+                over = [size for size, count in counts.items() if count > budget.statements]
+                if over:
+                    problems.append(f"over budget at size {over[0]}: {counts[over[0]]} > {budget.statements}")
+            if len(set(counts.values())) > 1:
+                problems.append("statement count grows with input size")
+            results.append({
+                "scenario": scenario.label,
+                "route": scenario.route,
+                "budget": budget.statements if budget else None,
+                "statements": counts,
+                "problems": problems,
+            })
+
+    unbudgeted = sorted(key for key, route in routes.items() if budgets.budget_of(route) is None)
+    return {"scenarios": results, "unbudgeted": unbudgeted}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.budgets", description="Check every route's SQL statement budget.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 3, 10], help="input sizes each scenario runs at")
+    parser.add_argument("--strict", action="store_true", help="also fail when a route declares no budget")
+    parser.add_argument("--out", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="yas-budgets-"), "budgets.db")
+    # must be set before database.py creates its engine
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    import database
+    import main as api
+
+    api.create_schema()
+    report = run(api.app, [database.engine], args.sizes)
+    failed = 0
+    for result in report["scenarios"]:
+        counts = " ".join(f"{size}:{count}" for size, count in result["statements"].items())
+        status = "ok" if not result["problems"] else "FAIL " + "; ".join(result["problems"])
+        failed += bool(result["problems"])
+        print(f"{result['scenario']:52} budget {result['budget']!s:>8}  statements {counts:20} {status}")
+    for route in report["unbudgeted"]:
+        print(f"{route:52} no @query_budget")
+    if args.strict:
+        failed += len(report["unbudgeted"])
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {args.out}")
+    print(f"{failed} failing" if failed else "all routes within budget")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""Seeded synthetic data written straight through the models."""
+import random
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import ledger
+import models
+
+CHUNK = 5000
+
+
+@dataclass
+class Dataset:
+    """What was generated, so load scenarios can build valid requests.
+
+    User ids are 1..len(emails) in the order of `emails`.
+    """
+    emails: list = field(default_factory=list)
+    friendships: set = field(default_factory=set)
+    groups: dict = field(default_factory=dict)
+    expenses: int = 0
+    splits: int = 0
+
+    def email(self, user_id):
+        return self.emails[user_id - 1]
+
+
+def _insert(db: Session, model, rows):
+    for start in range(0, len(rows), CHUNK):
+        db.execute(insert(model), rows[start:start + CHUNK])
+
+
+def generate(db: Session, users=1000, friends_per_user=5, groups=100, group_size=(3, 12),
+             expenses=5000, fanout=(1, 6), group_share=0.7, days=365, seed=42):
+    """Fills an empty database and rebuilds the balance ledger.
+
+    Args:
+        db (Session): Session on an empty schema.
+        users (int): Number of users.
+        friends_per_user (int): Outgoing friendships per user.
+        groups (int): Number of groups.
+        group_size (tuple[int, int]): Inclusive bounds on members per group.
+        expenses (int): Number of expenses.
+        fanout (tuple[int, int]): Inclusive bounds on participants per expense,
+            not counting the creator.
+        group_share (float): Fraction of expenses that belong to a group.
+        days (int): Expenses are spread uniformly over this many past days.
+        seed (int): Seed for the random generator.
+
+    Returns:
+        Dataset: What was written.
+    """
+    rng = random.Random(seed)
+    now = datetime.now(UTC)
+    dataset = Dataset()
+
+    user_rows = []
+    for user_id in range(1, users + 1):
+        email = f"user{user_id}@bench.test"
+        dataset.emails.append(email)
+        user_rows.append({"user_id": user_id, "first_name": f"First{user_id}", "last_name": f"Last{user_id}", "email": email})
+    _insert(db, models.User, user_rows)
+
+    friend_rows = []
+    for user_id in range(1, users + 1):
+        for friend_id in rng.sample(range(1, users + 1), min(friends_per_user + 1, users)):
+            if friend_id != user_id and (user_id, friend_id) not in dataset.friendships:
+                dataset.friendships.add((user_id, friend_id))
+                friend_rows.append({"user_id": user_id, "friend_user_id": friend_id})
+    _insert(db, models.Friends, friend_rows)
+
+    group_rows = []
+    member_rows = []
+    for group_id in range(1, groups + 1):
+        members = rng.sample(range(1, users + 1), min(rng.randint(*group_size), users))
+        dataset.groups[group_id] = members
+        group_rows.append({"group_id": group_id, "group_name": f"Group {group_id}", "created_by": members[0]})
+        member_rows.extend(
+            {"groupmember_group_id": group_id, "groupmember_user_id": member, "added_by": members[0]}
+            for member in members
+        )
+    _insert(db, models.Groups, group_rows)
+    _insert(db, models.GroupMembers, member_rows)
+
+    friends_of = {}
+    for user_id, friend_id in dataset.friendships:
+        friends_of.setdefault(user_id, []).append(friend_id)
+
+    expense_rows = []
+    split_rows = []
+    for expense_id in range(1, expenses + 1):
+        if dataset.groups and rng.random() < group_share:
+            group_id = rng.randint(1, groups)
+            members = dataset.groups[group_id]
+            creator = rng.choice(members)
+            pool = [member for member in members if member != creator]
+        else:
+            group_id = None
+            creator = rng.randint(1, users)
+            pool = friends_of.get(creator, [])
+        participants = rng.sample(pool, min(rng.randint(*fanout), len(pool)))
+        amount = round(rng.uniform(5, 500), 2)
+        created_at = now - timedelta(seconds=rng.uniform(0, days * 86400))
+        expense_rows.append({
+            "expense_id": expense_id,
+            "created_by": creator,
+            "group_id": group_id,
+            "description": f"Expense {expense_id}",
+            "amount": amount,
+            "created_at": created_at,
+        })
+        share = amount / (len(participants) + 1)
+        split_rows.extend(
+            {"expense_id": expense_id, "user_id": user_id, "amount": share, "created_at": created_at}
+            for user_id in participants + [creator]
+        )
+    _insert(db, models.Expenses, expense_rows)
+    _insert(db, models.Splits, split_rows)
+    db.commit()
+    dataset.expenses = len(expense_rows)
+    dataset.splits = len(split_rows)
+
+    ledger.rebuild(db)
+    return dataset
@@ -0,0 +1,176 @@
+"""In-process load driver for the routes in `main.app`."""
+import random
+import time
+from collections import namedtuple
+
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+Scenario = namedtuple("Scenario", ["method", "path", "build"])
+
+
+def api_routes(routes):
+    """Yields the `APIRoute`s in `routes`, descending into included routers.
+
+    Recent FastAPI keeps `include_router` routers as one entry in
+    `app.routes` instead of copying their routes. `main` includes its
+    routers without a prefix, so the paths are the routers' own.
+    """
+    for route in routes:
+        if isinstance(route, APIRoute):
+            yield route
+        elif hasattr(route, "original_router"):
+            yield from api_routes(route.original_router.routes)
+
+
+class StatementCounter:
+    """Counts statements executed on a set of engines."""
+
+    def __init__(self, engines):
+        self.engines = engines
+        self.count = 0
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        for engine in self.engines:
+            event.remove(engine, "before_cursor_execute", self._before_cursor_execute)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def scenarios(dataset, rng):
+    """Builds one request per call for each route, valid against `dataset`."""
+    new_users = iter(range(len(dataset.emails) + 1, 10 ** 9))
+    friendships = set(dataset.friendships)
+    groups = {group_id: set(members) for group_id, members in dataset.groups.items()}
+    next_group_id = iter(range(len(groups) + 1, 10 ** 9))
+    user_count = len(dataset.emails)
+
+    def any_email():
+        return dataset.email(rng.randint(1, user_count))
+
+    def create_user():
+        user_id = next(new_users)
+        return {"json": {"first_name": f"New{user_id}", "last_name": "User", "email": f"new{user_id}@bench.test"}}
+
+    def add_friend():
+        while True:
+            user_id, friend_id = rng.randint(1, user_count), rng.randint(1, user_count)
+            if user_id != friend_id and (user_id, friend_id) not in friendships:
+                friendships.add((user_id, friend_id))
+                return {"json": {"user_email": dataset.email(user_id), "friend_email": dataset.email(friend_id)}}
+
+    def create_group():
+        creator = rng.randint(1, user_count)
+        groups[next(next_group_id)] = {creator}
+        return {"json": {"group_name": "Bench group", "created_by": dataset.email(creator)}}
+
+    def add_member():
+        while True:
+            group_id = rng.choice(list(groups))
+            user_id = rng.randint(1, user_count)
+            if user_id not in groups[group_id]:
+                groups[group_id].add(user_id)
+                adder = next(iter(groups[group_id]))
+                return {"json": {
+                    "groupmember_user_email": dataset.email(user_id),
+                    "groupmember_group_id": group_id,
+                    "added_by": dataset.email(adder),
+                }}
+
+    def add_expense():
+        group_id = rng.choice(list(dataset.groups))
+        members = dataset.groups[group_id]
+        creator = rng.choice(members)
+        others = [member for member in members if member != creator]
+        participants = rng.sample(others, min(len(others), rng.randint(1, 6)))
+        return {"json": {
+            "description": "Bench expense",
+            "amount": round(rng.uniform(5, 500), 2),
+            "group_id": str(group_id),
+            "created_by": dataset.email(creator),
+            "users": [dataset.email(user_id) for user_id in participants],
+        }}
+
+    def by_user():
+        return {"params": {"user_email": any_email()}}
+
+    return [
+        Scenario("POST", "/users/", create_user),
+        Scenario("POST", "/addfriend/", add_friend),
+        Scenario("POST", "/groups/", create_group),
+        Scenario("POST", "/addmembertogroup/", add_member),
+        Scenario("POST", "/addexpense", add_expense),
+        Scenario("GET", "/users/", lambda: {"params": {"limit": 100, "after": rng.randint(0, user_count)}}),
+        Scenario("GET", "/user_expenses/", by_user),
+        Scenario("GET", "/amount_owed/", by_user),
+        Scenario("GET", "/amount_owed_to_each_user/", by_user),
+        Scenario("GET", "/amount_owed_in_each_group/", by_user),
+        Scenario("GET", "/all_user_groups", by_user),
+    ]
+
+
+def run(app, engines, dataset, requests_per_route=200, warmup=10, seed=7):
+    """Drives every route sequentially and reports per-route statistics.
+
+    Returns:
+        dict: {"METHOD path": stats} plus an entry for each route of the app
+        that has no scenario, marked as skipped.
+    """
+    rng = random.Random(seed)
+    client = TestClient(app, raise_server_exceptions=False)
+    results = {}
+    with StatementCounter(engines) as counter:
+        for scenario in scenarios(dataset, rng):
+            for _ in range(warmup):
+                client.request(scenario.method, scenario.path, **scenario.build())
+            latencies = []
+            statements = []
+            errors = 0
+            started = time.perf_counter()
+            for _ in range(requests_per_route):
+                kwargs = scenario.build()
+                before = counter.count
+                request_started = time.perf_counter()
+                response = client.request(scenario.method, scenario.path, **kwargs)
+                latencies.append((time.perf_counter() - request_started) * 1000)
+                statements.append(counter.count - before)
+                if response.status_code >= 400:
+                    errors += 1
+            elapsed = time.perf_counter() - started
+            latencies.sort()
+            results[f"{scenario.method} {scenario.path}"] = {
+                "requests": requests_per_route,
+                "errors": errors,
+                "throughput_rps": requests_per_route / elapsed if elapsed else None,
+                "latency_ms": {
+                    "p50": percentile(latencies, 0.50),
+                    "p95": percentile(latencies, 0.95),
+                    "p99": percentile(latencies, 0.99),
+                    "max": latencies[-1],
+                },
+                "sql_statements": {
+                    "mean": sum(statements) / len(statements),
+                    "max": max(statements),
+                },
+            }
+
+    for route in api_routes(app.routes):
+        for method in route.methods:
+            key = f"{method} {route.path}"
+            if key not in results:
+                results[key] = {"skipped": "no scenario"}
+    return results
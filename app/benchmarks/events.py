@@ -0,0 +1,91 @@
+"""Event fan-out benchmark: many concurrent subscribers on one process.
+
+Opens `--subscribers` subscriptions spread over `--users` users on one event
+loop, publishes `--events` events from a separate thread the way threadpool
+route handlers do, and reports delivery latency, throughput and events
+dropped by full buffers. Run from the `app` directory:
+
+    python -m benchmarks.events --subscribers 10000 --users 2000 --events 20000
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+
+from benchmarks.driver import percentile
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.events")
+    parser.add_argument("--subscribers", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--fanout", type=int, default=3, help="users each published write touches")
+    parser.add_argument("--buffer", type=int, default=100, help="per-subscriber buffer size")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="events_results.json")
+    args = parser.parse_args(argv)
+
+    import events
+
+    broker = events.Broker()
+    rng = random.Random(args.seed)
+    latencies = []
+    totals = {"delivered": 0, "dropped": 0}
+    done = asyncio.Event()
+
+    async def consume(subscription):
+        while not done.is_set():
+            batch, lost = await subscription.get(1.0)
+            now = time.perf_counter()
+            totals["dropped"] += lost
+            totals["delivered"] += len(batch)
+            latencies.extend(now - event["published_at"] for event in batch)
+        broker.unsubscribe(subscription)
+
+    def publish():
+        for _ in range(args.events):
+            broker.publish(rng.sample(range(1, args.users + 1), args.fanout), "expense_added", published_at=time.perf_counter())
+
+    async def run():
+        subscriptions = [broker.subscribe(rng.randint(1, args.users), args.buffer) for _ in range(args.subscribers)]
+        consumers = [asyncio.create_task(consume(subscription)) for subscription in subscriptions]
+        publisher = threading.Thread(target=publish)
+        started = time.perf_counter()
+        publisher.start()
+        await asyncio.get_running_loop().run_in_executor(None, publisher.join)
+        published_seconds = time.perf_counter() - started
+        # let the consumers drain what is still buffered
+        await asyncio.sleep(0.5)
+        done.set()
+        await asyncio.gather(*consumers)
+        return published_seconds
+
+    published_seconds = asyncio.run(run())
+    latencies.sort()
+    result = {
+        "subscribers": args.subscribers,
+        "users": args.users,
+        "events": args.events,
+        "fanout": args.fanout,
+        "publish_seconds": published_seconds,
+        "publishes_per_second": args.events / published_seconds,
+        "delivered": totals["delivered"],
+        "dropped": totals["dropped"],
+        "latency_p50_ms": percentile(latencies, 0.5) * 1000 if latencies else None,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+    }
+    print(f"{args.subscribers} subscribers, {args.events} writes x{args.fanout} users: "
+          f"{result['publishes_per_second']:.0f} writes/s, delivered {result['delivered']}, dropped {result['dropped']}, "
+          f"p50 {result['latency_p50_ms']:.2f}ms p99 {result['latency_p99_ms']:.2f}ms")
+    with open(args.out, "w") as f:
+        json.dump({"seed": args.seed, "result": result}, f, indent=2)
+    print(f"wrote {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Friend graph benchmark at a million friendships.
+
+Seeds a SQLite database with `--users` users who each add
+`--friends-per-user` friends (about a million `friends` rows by default).
+It then measures the following:
+
+- how long `FriendGraph.load` takes, and a `refresh` that finds no change,
+- the memory the index holds, compared with the same graph as sets,
+- friend list, mutual friend and suggestion latencies against the index,
+- friend list latency against SQL,
+- the cost of `add_friendship` on the loaded graph.
+
+It checks the index's friend lists against SQL for every sampled user. Run
+from the `app` directory:
+
+    python -m benchmarks.friend_graph --users 100000 --friends-per-user 9 --out friend_graph.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def _timed(fn, inputs):
+    """Calls `fn(*args)` for each of `inputs`; returns sorted latencies in microseconds."""
+    samples = []
+    for args in inputs:
+        started = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - started) * 1e6)
+    return sorted(samples)
+
+
+def _summary(samples):
+    from benchmarks.driver import percentile
+
+    return {"p50": percentile(samples, 0.50), "p95": percentile(samples, 0.95), "p99": percentile(samples, 0.99), "max": samples[-1]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.friend_graph")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--friends-per-user", type=int, default=9)
+    parser.add_argument("--groups", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=2000, help="sampled users per measurement")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="friend_graph_results.json")
+    args = parser.parse_args(argv)
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="yas-friends-"), "friends.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    from sqlalchemy import select, union_all
+
+    import database
+    import main as api
+    import models
+    from benchmarks import datagen
+    from friend_graph import FriendGraph
+
+    api.create_schema()
+    rng = random.Random(args.seed)
+    db = database.SessionLocal()
+    try:
+        started = time.perf_counter()
+        dataset = datagen.generate(db, users=args.users, friends_per_user=args.friends_per_user, groups=args.groups, expenses=0, seed=args.seed)
+        print(f"seeded {len(dataset.friendships)} friends rows in {time.perf_counter() - started:.1f}s")
+        rows = len(dataset.friendships)
+        del dataset
+
+        graph = FriendGraph()
+        started = time.perf_counter()
+        friendships, memberships = graph.load(db)
+        load_seconds = time.perf_counter() - started
+        print(f"loaded {friendships} friendships and {memberships} group memberships in {load_seconds:.2f}s")
+        started = time.perf_counter()
+        graph.refresh(db)
+        refresh_seconds = time.perf_counter() - started
+        print(f"refresh without changes took {refresh_seconds * 1000:.1f}ms")
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        measured = FriendGraph()
+        measured.load(db)
+        index_bytes = tracemalloc.get_traced_memory()[0] - baseline
+        # the same adjacency as a dict of sets, for comparison
+        baseline = tracemalloc.get_traced_memory()[0]
+        as_sets = {user_id: set(ids) for user_id, ids in measured._friends.items()}
+        sets_bytes = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        del measured, as_sets
+        print(f"index holds {index_bytes / 2**20:.1f} MiB; as sets of ints {sets_bytes / 2**20:.1f} MiB")
+
+        users = [rng.randint(1, args.users) for _ in range(args.queries)]
+        pairs = []
+        for user_id in users:
+            friends = graph.friends(user_id)
+            second = graph.friends(rng.choice(friends)) if friends else []
+            pairs.append((user_id, rng.choice(second) if second else rng.randint(1, args.users)))
+
+        def sql_friends(user_id):
+            return {row[0] for row in db.execute(union_all(
+                select(models.Friends.friend_user_id).where(models.Friends.user_id == user_id),
+                select(models.Friends.user_id).where(models.Friends.friend_user_id == user_id),
+            ))} - {user_id}
+
+        mismatched = [user_id for user_id in users if set(graph.friends(user_id)) != sql_friends(user_id)]
+        latencies = {
+            "friends": _summary(_timed(graph.friends, [(user_id,) for user_id in users])),
+            "friends_sql": _summary(_timed(sql_friends, [(user_id,) for user_id in users])),
+            "mutual_friends": _summary(_timed(graph.mutual_friends, pairs)),
+            "suggestions": _summary(_timed(graph.suggestions, [(user_id, 10) for user_id in users])),
+            "add_friendship": _summary(_timed(graph.add_friendship, [
+                (rng.randint(1, args.users), rng.randint(1, args.users)) for _ in range(args.queries)
+            ])),
+        }
+    finally:
+        db.close()
+
+    for name, summary in latencies.items():
+        print(f"{name:16} p50 {summary['p50']:9.1f}us  p95 {summary['p95']:9.1f}us  p99 {summary['p99']:9.1f}us  max {summary['max']:9.1f}us")
+    print(f"friend lists matching SQL: {len(users) - len(mismatched)}/{len(users)}")
+
+    with open(args.out, "w") as f:
+        json.dump({
+            "seed": args.seed,
+            "friends_rows": rows,
+            "friendships": friendships,
+            "group_memberships": memberships,
+            "load_seconds": load_seconds,
+            "refresh_seconds": refresh_seconds,
+            "index_bytes": index_bytes,
+            "sets_bytes": sets_bytes,
+            "latency_us": latencies,
+            "mismatched_users": mismatched[:20],
+        }, f, indent=2)
+    print(f"wrote {args.out}")
+    return 1 if mismatched else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
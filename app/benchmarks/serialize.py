@@ -0,0 +1,85 @@
+"""List serialization benchmark: the response_model path against `fastjson`.
+
+Seeds a SQLite database, then times unpaged `GET /users/` and the
+`GET /user_expenses/` of the busiest creator with FAST_LIST_RESPONSES off
+and on, checking that both paths return identical bytes. Run from the
+`app` directory:
+
+    python -m benchmarks.serialize --users 50000 --expenses 200000 --out serialize.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.serialize")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--expenses", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="serialize_results.json")
+    args = parser.parse_args(argv)
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="yas-serialize-"), "serialize.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import func
+
+    import database
+    import fastjson
+    import main as api
+    import models
+    from benchmarks import datagen
+
+    api.create_schema()
+    db = database.SessionLocal()
+    try:
+        dataset = datagen.generate(db, users=args.users, friends_per_user=1, groups=10, expenses=args.expenses, seed=args.seed)
+        creator, created = db.query(models.Expenses.created_by, func.count()).group_by(models.Expenses.created_by).order_by(func.count().desc()).first()
+    finally:
+        db.close()
+
+    client = TestClient(api.app)
+    requests = [
+        ("/users/", {}, args.users),
+        ("/user_expenses/", {"user_email": dataset.email(creator)}, created),
+    ]
+    results = []
+    for path, params, rows in requests:
+        timings = {}
+        bodies = {}
+        for mode, enabled in (("model", False), ("fast", True)):
+            fastjson.ENABLED = enabled
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                response = client.get(path, params=params)
+                samples.append((time.perf_counter() - started) * 1000)
+            bodies[mode] = response.content
+            timings[mode] = min(samples)
+        result = {
+            "route": path,
+            "rows": rows,
+            "bytes": len(bodies["model"]),
+            "identical": bodies["model"] == bodies["fast"],
+            "model_ms": timings["model"],
+            "fast_ms": timings["fast"],
+            "speedup": timings["model"] / timings["fast"],
+        }
+        results.append(result)
+        print(f"{path:16} {rows:8} rows {result['bytes']:10} bytes model {result['model_ms']:9.2f}ms "
+              f"fast {result['fast_ms']:9.2f}ms x{result['speedup']:.1f} identical={result['identical']}")
+
+    with open(args.out, "w") as f:
+        json.dump({"seed": args.seed, "orjson": fastjson.orjson is not None, "results": results}, f, indent=2)
+    print(f"wrote {args.out}")
+    return 0 if all(result["identical"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""Settle-up benchmark over synthetic groups of growing size.
+
+For each group size it seeds a SQLite ledger with `expenses_per_member`
+random expenses, then times reading the net positions from the ledger and
+computing the plan. Run from the `app` directory:
+
+    python -m benchmarks.settle --sizes 10 100 500 1000 --out settle.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.settle")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500, 1000])
+    parser.add_argument("--expenses-per-member", type=int, default=50)
+    parser.add_argument("--fanout", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="settle_results.json")
+    args = parser.parse_args(argv)
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="yas-settle-"), "settle.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    from sqlalchemy import insert
+
+    import database
+    import ledger
+    import models
+    import settle
+
+    models.Base.metadata.create_all(bind=database.engine)
+    rng = random.Random(args.seed)
+    results = []
+    db = database.SessionLocal()
+    try:
+        next_user = 1
+        for group_id, size in enumerate(args.sizes, start=1):
+            members = list(range(next_user, next_user + size))
+            next_user += size
+            db.execute(insert(models.User), [
+                {"user_id": user_id, "first_name": f"U{user_id}", "last_name": "Bench", "email": f"u{user_id}@settle.test"}
+                for user_id in members
+            ])
+            db.execute(insert(models.Groups), [{"group_id": group_id, "group_name": f"Group {size}", "created_by": members[0]}])
+
+            expenses = size * args.expenses_per_member
+            deltas = defaultdict(float)
+            for _ in range(expenses):
+                creator = rng.choice(members)
+                participants = rng.sample(members, min(args.fanout, size))
+                share = round(rng.uniform(5, 500), 2) / len(participants)
+                ledger.merge_deltas(deltas, ledger.expense_deltas(creator, group_id, [(user_id, share) for user_id in participants]))
+            ledger.apply(db, deltas)
+            db.commit()
+
+            timings = {"net_positions_ms": [], "minimize_transfers_ms": []}
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                net = settle.net_positions(db, group_id)
+                timings["net_positions_ms"].append((time.perf_counter() - started) * 1000)
+                started = time.perf_counter()
+                transfers = settle.minimize_transfers(net)
+                timings["minimize_transfers_ms"].append((time.perf_counter() - started) * 1000)
+
+            residual = sum(round(amount * 100) for amount in net.values())
+            result = {
+                "members": size,
+                "expenses": expenses,
+                "ledger_rows": len(deltas),
+                "transfers": len(transfers),
+                "residual_cents": residual,
+                "net_positions_ms": min(timings["net_positions_ms"]),
+                "minimize_transfers_ms": min(timings["minimize_transfers_ms"]),
+            }
+            results.append(result)
+            print(f"{size:6} members {expenses:8} expenses {len(deltas):8} ledger rows -> {len(transfers):6} transfers "
+                  f"net {result['net_positions_ms']:8.2f}ms plan {result['minimize_transfers_ms']:8.2f}ms")
+    finally:
+        db.close()
+
+    with open(args.out, "w") as f:
+        json.dump({"seed": args.seed, "results": results}, f, indent=2)
+    print(f"wrote {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
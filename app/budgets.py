@@ -0,0 +1,27 @@
+"""SQL statement budgets for the routes in `main`.
+
+Every route declares the most statements one request may run, with
+`@query_budget(n)` right under its route decorator. The count is taken
+with cold in-process caches, so it is what a request costs when nothing
+is cached. `python -m benchmarks.budgets`, which `tests/test_budgets.py`
+runs, checks each route against its budget on a seeded SQLite database. It
+also fails when the count changes with the size of the input, such as the
+splits of an expense or the creditors of a user. A growing count is what an
+N+1 query looks like.
+"""
+from collections import namedtuple
+
+Budget = namedtuple("Budget", ["statements"])
+
+
+def query_budget(statements):
+    """Declares that one request to the decorated route runs at most `statements` statements, whatever its input size."""
+    def decorate(endpoint):
+        endpoint.query_budget = Budget(statements)
+        return endpoint
+    return decorate
+
+
+def budget_of(route):
+    """The `Budget` declared on an `APIRoute`'s endpoint, or None."""
+    return getattr(route.endpoint, "query_budget", None)
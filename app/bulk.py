@@ -0,0 +1,241 @@
+"""Bulk expense ingestion from JSONL or CSV.
+
+Records use the `schema.ExpenseCreate` shape, one JSON object per line or
+one CSV record each. CSV files need a header with description, amount,
+group_id, created_by and users, where users is a ';'-separated list of
+emails; quoted fields may span lines. Input is parsed and validated in chunks
+and every chunk is written in one transaction per database it touches: its
+users and groups are resolved with one query each, expense ids come from
+`sharding.expense_ids` and its expenses and splits are each inserted with
+one executemany. A row that fails validation or lookup is rejected
+on its own. When the database rejects a chunk with an integrity error, the
+chunk is retried one row per transaction. Any other database error aborts
+the import; the chunks before it stay committed.
+
+Run as a script to import a file:
+
+    python bulk.py expenses.jsonl --batch-size 500
+"""
+import argparse
+import csv
+import json
+import sys
+from collections import defaultdict
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import crud
+import ledger
+import models
+import schema
+import sharding
+import versions
+
+DEFAULT_BATCH_SIZE = 500
+CSV_FIELDS = ("description", "amount", "group_id", "created_by", "users")
+
+
+def iter_records(lines, fmt="jsonl"):
+    """Parses an iterable of text lines into raw records.
+
+    CSV goes through `csv.DictReader` over the lines as they come, so quoted
+    fields may span lines. A CSV record is numbered by the line it ends on.
+
+    Yields:
+        tuple[int, dict | str]: (line number, record) pairs, where a string
+        record is the reason the input could not be parsed.
+    """
+    if fmt not in ("jsonl", "csv"):
+        raise ValueError(f"unsupported format {fmt!r}")
+    if fmt == "jsonl":
+        for line_no, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, f"invalid JSON: {e}"
+        return
+    reader = csv.DictReader(lines)
+    if reader.fieldnames is None:
+        return
+    reader.fieldnames = [name.strip() for name in reader.fieldnames]
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield reader.line_num, f"invalid CSV: {e}"
+            continue
+        record = {name: value for name, value in row.items() if name is not None}
+        record["users"] = [email.strip() for email in (record.get("users") or "").split(";") if email.strip()]
+        yield reader.line_num, record
+
+
+def _rejected(line_no, error):
+    return {"line": line_no, "status": "rejected", "error": error}
+
+
+def ingest_chunk(db: Session, records):
+    """Validates and writes one chunk of records in a single transaction.
+
+    Args:
+        db (Session): The SQLAlchemy session.
+        records (list[tuple[int, dict | str]]): Pairs from `iter_records`.
+
+    Returns:
+        list[dict]: One result per record, in input order, with status
+        "accepted" and the new expense_id, or "rejected" and an error.
+
+    Raises:
+        SQLAlchemyError: The database failed for a reason other than a
+            rejected row. Chunks written before stay committed.
+    """
+    results = {}
+    valid = []
+    for line_no, record in records:
+        if isinstance(record, str):
+            results[line_no] = _rejected(line_no, record)
+            continue
+        try:
+            expense = schema.ExpenseCreate(**record)
+            group_id = int(expense.group_id) if expense.group_id else None
+        except (ValidationError, TypeError, ValueError) as e:
+            results[line_no] = _rejected(line_no, str(e))
+            continue
+        valid.append((line_no, expense, group_id))
+
+    users = crud.get_users_by_email(db, {email for _, expense, _ in valid for email in expense.users + [expense.created_by]})
+    # with sharded group data each database gets its own transaction
+    shards = {group_id: sharding.shard_for(db, group_id) for _, _, group_id in valid if group_id is not None}
+    by_shard = defaultdict(list)
+    for line_no, expense, group_id in valid:
+        all_users = expense.users + [expense.created_by]
+        missing = [email for email in all_users if email not in users]
+        if missing:
+            results[line_no] = _rejected(line_no, f"User {missing[0]} does not exist")
+        else:
+            by_shard[shards.get(group_id)].append((line_no, expense, group_id, [users[email].user_id for email in all_users]))
+
+    for shard, part in by_shard.items():
+        with sharding.session_on(db, shard) as shard_db:
+            _write_part(db, shard_db, part, results)
+    return [results[line_no] for line_no, _ in records]
+
+
+def _write_part(db: Session, write_db: Session, part, results):
+    """Writes the records of one chunk that belong to `write_db`'s database in one transaction.
+
+    `db` is the global session, where the writes bump the users' versions.
+
+    When the database rejects the transaction with an integrity error, the
+    records are retried one per transaction so only the offending ones are
+    rejected. Other errors are raised.
+    """
+    group_ids = {group_id for _, _, group_id, _ in part if group_id is not None}
+    groups = set()
+    if group_ids:
+        groups = {row[0] for row in write_db.query(models.Groups.group_id).filter(models.Groups.group_id.in_(group_ids))}
+
+    writable = []
+    for record in part:
+        line_no, _, group_id, _ = record
+        if group_id is not None and group_id not in groups:
+            results[line_no] = _rejected(line_no, f"Group {group_id} does not exist")
+        else:
+            writable.append(record)
+    if not writable:
+        return
+
+    try:
+        _write_records(db, write_db, writable, results)
+        return
+    except IntegrityError as e:
+        if len(writable) == 1:
+            results[writable[0][0]] = _rejected(writable[0][0], f"rejected by the database: {e.orig}")
+            return
+    for record in writable:
+        try:
+            _write_records(db, write_db, [record], results)
+        except IntegrityError as e:
+            results[record[0]] = _rejected(record[0], f"rejected by the database: {e.orig}")
+
+
+def _write_records(db: Session, write_db: Session, records, results):
+    """Inserts `records` and their splits and ledger deltas into `write_db`, then commits
+    them with the version bumps in `db`; rolls back and raises on error.
+    """
+    # ids are allocated up front, so each table takes one executemany INSERT
+    # even where the dialect cannot return the ids of a batch
+    expense_ids = sharding.expense_ids(len(records))
+    expense_rows = []
+    split_rows = []
+    deltas = defaultdict(float)
+    for expense_id, (_, expense, group_id, participants) in zip(expense_ids, records):
+        # the creator is the last participant, as in crud.add_expense
+        expense_rows.append({"expense_id": expense_id, "amount": expense.amount, "description": expense.description,
+                             "created_by": participants[-1], "group_id": group_id})
+        each_split = expense.amount/len(participants)
+        splits = [(user_id, each_split) for user_id in participants]
+        split_rows.extend({"expense_id": expense_id, "user_id": user_id, "amount": amount} for user_id, amount in splits)
+        ledger.merge_deltas(deltas, ledger.expense_deltas(participants[-1], group_id, splits))
+    user_ids = {user_id for _, _, _, participants in records for user_id in participants}
+    try:
+        write_db.execute(insert(models.Expenses), expense_rows)
+        write_db.execute(insert(models.Splits), split_rows)
+        ledger.apply(write_db, deltas)
+        user_versions = versions.commit(db, write_db, user_ids, {group_id for _, _, group_id, _ in records})
+    except Exception:
+        write_db.rollback()
+        raise
+    crud.expenses_committed(user_ids, user_versions)
+    for expense_id, (line_no, _, _, _) in zip(expense_ids, records):
+        results[line_no] = {"line": line_no, "status": "accepted", "expense_id": expense_id}
+
+
+def ingest(db: Session, lines, fmt="jsonl", batch_size=DEFAULT_BATCH_SIZE):
+    """Streams the records in `lines` through `ingest_chunk`, `batch_size` records at a time.
+
+    Yields:
+        dict: One result per record, in input order.
+    """
+    chunk = []
+    for record in iter_records(lines, fmt):
+        chunk.append(record)
+        if len(chunk) >= batch_size:
+            yield from ingest_chunk(db, chunk)
+            chunk = []
+    if chunk:
+        yield from ingest_chunk(db, chunk)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import expenses from a JSONL or CSV file.")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "jsonl")
+
+    from database import SessionLocal
+
+    counts = {"accepted": 0, "rejected": 0}
+    db = SessionLocal()
+    try:
+        with open(args.path, newline="") as f:
+            for result in ingest(db, f, fmt=fmt, batch_size=args.batch_size):
+                counts[result["status"]] += 1
+                print(json.dumps(result))
+    finally:
+        db.close()
+    print(f"accepted {counts['accepted']}, rejected {counts['rejected']}", file=sys.stderr)
+    return 0 if counts["rejected"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Bounded in-process caches shared across requests."""
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+CachedUser = namedtuple("CachedUser", ["user_id", "first_name", "email"])
+
+
+class LRUCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    Args:
+        maxsize (int): Number of entries kept before the least recently used
+            one is evicted.
+        ttl (float): Seconds an entry stays valid after it was stored.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key, default=None):
+        """Returns a live entry without touching recency or the counters."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                return default
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class UserCache:
+    """Caches `CachedUser` entries by both email and user id."""
+
+    def __init__(self, maxsize=10000, ttl=300.0):
+        self.by_email = LRUCache(maxsize, ttl)
+        self.by_id = LRUCache(maxsize, ttl)
+
+    def store(self, user):
+        cached = CachedUser(user.user_id, user.first_name, user.email)
+        self.by_email.set(cached.email, cached)
+        self.by_id.set(cached.user_id, cached)
+        return cached
+
+    def invalidate(self, email=None, user_id=None):
+        if email is not None:
+            cached = self.by_email.peek(email)
+            self.by_email.invalidate(email)
+            if cached is not None:
+                self.by_id.invalidate(cached.user_id)
+        if user_id is not None:
+            self.by_id.invalidate(user_id)
+
+    def clear(self):
+        self.by_email.clear()
+        self.by_id.clear()
+
+    def stats(self):
+        return {"by_email": self.by_email.stats(), "by_id": self.by_id.stats()}
+
+
+user_cache = UserCache(
+    maxsize=int(os.environ.get("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("USER_CACHE_TTL", "300")),
+)
@@ -1,10 +1,21 @@
-from sqlalchemy.orm import Session
-from sqlalchemy.orm import aliased
+import heapq
+
+from sqlalchemy import func, insert, select, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+
+import database
+import events
+import ledger
 import models
 import schema
-from sqlalchemy import and_
-from sqlalchemy import distinct
-from sqlalchemy import func
+import sharding
+import snapshots
+import versions
+from cache import user_cache
+from exceptions import WriteRejectedException
+from friend_graph import graph as friend_graph
+from loaders import user_loader
 
 """
 Creates a new user in the database.
@@ -26,6 +37,8 @@ def create_user(db: Session, user: schema.UserCreate):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    user_cache.invalidate(email=db_user.email, user_id=db_user.user_id)
+    users_changed([db_user.user_id])
     return db_user
 
 """
@@ -40,22 +53,22 @@ Adds a new friend to the database if they don't already exist as friends.
 
  Notes:
     This function first checks if both users exist in the database. If they do not,
-    it raises an exception. Then, it queries the database to see if the two users
-    are already friends. If they are not, it creates a new friendship object and adds
-    it to the database.
+    it raises an exception. Then, it inserts the friendship and relies on the
+    primary key of the friends table to reject a pair that is already friends.
 """
 def add_friend(db: Session, friend: schema.FriendAdd):
-    user_id = db.query(models.User).filter(models.User.email == friend.user_email).first()
-    friend_id = db.query(models.User).filter(models.User.email == friend.friend_email).first()
-    results = db.query(models.Friends).filter(and_(models.Friends.user_id == user_id.user_id, models.Friends.friend_user_id == friend_id.user_id)).all()
-    if not results:
-        db_friend = models.Friends(user_id=user_id.user_id, friend_user_id=friend_id.user_id)
-        db.add(db_friend)
-        db.commit()
-        db.refresh(db_friend)
-        return db_friend
-    else:
-        raise Exception({"error": f"{user_id.first_name} and {friend_id.first_name} are already friends"})
+    user_id = get_user(db, friend.user_email)
+    friend_id = get_user(db, friend.friend_email)
+    db_friend = models.Friends(user_id=user_id.user_id, friend_user_id=friend_id.user_id)
+    db.add(db_friend)
+    try:
+        user_versions = versions.commit(db, db, [user_id.user_id, friend_id.user_id])
+    except IntegrityError:
+        db.rollback()
+        raise WriteRejectedException({"error": f"{user_id.first_name} and {friend_id.first_name} are already friends"})
+    friend_added(user_id.user_id, friend_id.user_id, user_versions)
+    db.refresh(db_friend)
+    return db_friend
 
 """
 Creates a new group in the database.
@@ -71,166 +84,423 @@ Creates a new group in the database.
  Notes:
     This function first checks if the user exists in the database. If they do not,
     it raises an exception. Then, it creates a new group object and adds it to the database.
-    It also adds the creator of the group as its member.
+    It also adds the creator of the group as its member. When group data is
+    sharded, the group id and shard come from the directory in `db`, and the
+    directory entry is deleted again if the group cannot be written to its shard.
 """
 def create_group(db: Session, group: schema.GroupCreate):
     try:
-        user = db.query(models.User).filter(models.User.email == group.created_by).first()
+        user = get_user(db, group.created_by)
         if not user:
-            raise Exception({"error": f"User {group.created_by} does not exist"})
-        db_group = models.Groups(group_name=group.group_name, created_by=user.user_id)
-        db.add(db_group)
-        db.commit()
-        db.refresh(db_group)
-        user_to_group = {
-                        "groupmember_user_email": group.created_by, 
-                        "groupmember_group_id": db_group.group_id, 
-                        "added_by": user.user_id
-        }
-        db_group_member = add_user_to_group(db, user_to_group)
-        print(db_group_member)
+            raise WriteRejectedException({"error": f"User {group.created_by} does not exist"})
+        group_id = sharding.allocate_group(db)
+        with sharding.group_session(db, group_id) as group_db:
+            try:
+                db_group = models.Groups(group_id=group_id, group_name=group.group_name, created_by=user.user_id)
+                group_db.add(db_group)
+                group_db.commit()
+                group_db.refresh(db_group)
+            except Exception:
+                group_db.rollback()
+                sharding.release_group(db, group_id)
+                raise
+        user_to_group = schema.GroupMemberAdd(
+                        groupmember_user_email=group.created_by,
+                        groupmember_group_id=db_group.group_id,
+                        added_by=group.created_by
+        )
+        add_user_to_group(db, user_to_group, event="group_created")
         return db_group
-    except Exception as e:
+    except Exception:
         db.rollback()
-        raise e
-
-def add_user_to_group(db: Session, group_member: schema.GroupMemberAdd):
-    user = db.query(models.User).filter(models.User.email == group_member.groupmember_user_email).first()
-    group = db.query(models.Groups).filter(models.Groups.group_id == group_member.groupmember_group_id).first()
-    added_by = db.query(models.User).filter(models.User.email == group_member.added_by).first()
-    results = db.query(models.GroupMembers).filter(and_(models.GroupMembers.groupmember_group_id == group.group_id, models.GroupMembers.groupmember_user_id == user.user_id)).all()
-    if not results:
+        raise
+
+def add_user_to_group(db: Session, group_member: schema.GroupMemberAdd, event="group_member_added"):
+    user = get_user(db, group_member.groupmember_user_email)
+    added_by = get_user(db, group_member.added_by)
+    with sharding.group_session(db, group_member.groupmember_group_id) as group_db:
+        group = get_group(group_db, group_member.groupmember_group_id)
         db_groupMember = models.GroupMembers(groupmember_group_id=group.group_id, groupmember_user_id=user.user_id, added_by=added_by.user_id)
-        db.add(db_groupMember)
-        db.commit()
-        db.refresh(db_groupMember)
-        return db_groupMember
-    else:
-        raise Exception({"error": f"{group_member.groupmember_user_email} is already in {group.group_name}"})
+        group_db.add(db_groupMember)
+        try:
+            user_versions = versions.commit(db, group_db, [user.user_id])
+        except IntegrityError:
+            # uq_groupmembers_group_user rejects a second membership of the same user
+            group_db.rollback()
+            raise WriteRejectedException({"error": f"{group_member.groupmember_user_email} is already in {group.group_name}"})
+        member_added(user.user_id, group_member.groupmember_group_id, event, user_versions)
+        group_db.refresh(db_groupMember)
+    # schema.GroupMember echoes the email; the row only has the user id
+    db_groupMember.groupmember_user_email = user.email
+    return db_groupMember
 
 def add_expense(db: Session, expense: schema.ExpenseCreate):
-    user = db.query(models.User).filter(models.User.email == expense.created_by).first()
-    if expense.group_id != '':
-        group = db.query(models.Groups).filter(models.Groups.group_id == int(expense.group_id)).first()
-        db_expense = models.Expenses(amount=expense.amount, description=expense.description, created_by=user.user_id, group_id=int(group.group_id))
-    else:
-        db_expense = models.Expenses(amount=expense.amount, description=expense.description, created_by=user.user_id)    
-    db.add(db_expense)
-    db.commit()
-    db.refresh(db_expense)
     all_users = expense.users + [expense.created_by]
-    each_split = expense.amount/len(all_users)
-    for each_user in all_users:
-        user  = db.query(models.User).filter(models.User.email == each_user).first()
-        db_expenseSplit = models.Splits(expense_id=db_expense.expense_id, user_id=user.user_id, amount=each_split)
-        db.add(db_expenseSplit)
-        db.commit()
-        db.refresh(db_expenseSplit)
+    try:
+        # resolve the creator and every participant with at most one IN query
+        user_ids = {email: user.user_id for email, user in get_users_by_email(db, all_users).items()}
+        missing = [email for email in all_users if email not in user_ids]
+        if missing:
+            raise WriteRejectedException({"error": f"User {missing[0]} does not exist"})
+    except Exception:
+        db.rollback()
+        raise
+    group_id = int(expense.group_id) if expense.group_id else None
+    with sharding.group_session(db, group_id) as group_db:
+        try:
+            if group_id is not None:
+                group = group_db.query(models.Groups).filter(models.Groups.group_id == group_id).first()
+                if not group:
+                    raise WriteRejectedException({"error": f"Group {expense.group_id} does not exist"})
+            expense_id = sharding.expense_ids(1)[0]
+            db_expense = models.Expenses(expense_id=expense_id, amount=expense.amount, description=expense.description, created_by=user_ids[expense.created_by], group_id=group_id)
+            group_db.add(db_expense)
+            # the expense row goes in before the splits that reference it
+            group_db.flush()
+            each_split = expense.amount/len(all_users)
+            splits = [(user_ids[each_user], each_split) for each_user in all_users]
+            group_db.execute(insert(models.Splits), [
+                {"expense_id": db_expense.expense_id, "user_id": user_id, "amount": amount}
+                for user_id, amount in splits
+            ])
+            ledger.apply(group_db, ledger.expense_deltas(db_expense.created_by, db_expense.group_id, splits))
+            user_versions = versions.commit(db, group_db, user_ids.values(), [group_id])
+        except Exception:
+            group_db.rollback()
+            raise
+        expenses_committed(user_ids.values(), user_versions)
+        group_db.refresh(db_expense)
     return db_expense
 
-def get_all_users(db: Session):
-    return db.query(models.User).all()
-
-def get_all_expenses(db: Session, user_email):
-    user = db.query(models.User).filter(models.User.email == user_email).first()
-    return db.query(models.Expenses).filter(models.Expenses.created_by == user.user_id)
-
-def total_owed_by_the_user(db: Session, user_email):
-    user = db.query(models.User).filter(models.User.email == user_email).first()
-    subquery = db.query(distinct(models.Expenses.expense_id)).filter(models.Expenses.created_by == user.user_id)
-
+def users_changed(user_ids, event=None, user_versions=None, **fields):
+    """Post-commit bookkeeping for every write: read-your-writes pins and, when
+    `event` is given, an `events` notification carrying `fields`.
+
+    `user_versions` is what `versions.commit` returned for the write; the
+    version bump itself happens inside the write's transaction.
+    """
+    user_ids = set(user_ids)
+    user_versions = user_versions or {}
+    database.pin_to_primary({user_id: user_versions.get(user_id, 0) for user_id in user_ids})
+    if event:
+        events.publish(user_ids, event, user_versions, **fields)
+
+def friend_added(user_id, friend_id, user_versions=None):
+    """Post-commit bookkeeping for a new friendship."""
+    friend_graph.add_friendship(user_id, friend_id)
+    users_changed([user_id, friend_id], event="friend_added", user_versions=user_versions)
+
+def member_added(user_id, group_id, event="group_member_added", user_versions=None):
+    """Post-commit bookkeeping for a new group membership."""
+    friend_graph.add_membership(user_id, group_id)
+    users_changed([user_id], event=event, user_versions=user_versions, group_id=group_id)
+
+def expenses_committed(user_ids, user_versions=None):
+    """Post-commit bookkeeping shared by every path that adds expenses."""
+    users_changed(user_ids, event="expense_added", user_versions=user_versions)
+
+def get_all_users(db: Session, limit=None, after=None, columns=None):
+    """Returns users ordered by id, one keyset page at a time.
+
+    Args:
+        db (Session): The SQLAlchemy session.
+        limit (int | None): Maximum number of users to return; all when None.
+        after (int | None): Only return users whose id is greater than this.
+        columns (list | None): Select these columns as tuples instead of
+            whole `models.User` entities.
+    """
+    query = db.query(*(columns or [models.User])).order_by(models.User.user_id)
+    if after is not None:
+        query = query.filter(models.User.user_id > after)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+def iter_users(db: Session, batch_size=1000):
+    """Streams every user in keyset chunks of `batch_size`, one query per chunk.
+
+    The default mysqlconnector driver buffers a whole result set on the
+    client, so one query with `yield_per` would still load every row before
+    the first is sent. Each chunk is a separate, bounded query instead.
+    """
+    return _keyset_chunks(lambda after: get_all_users(db, limit=batch_size, after=after), batch_size, "user_id")
+
+def _keyset_chunks(page, batch_size, key):
+    """Yields the rows of `page(after)` chunk by chunk until a chunk comes back short."""
+    after = None
+    while True:
+        rows = page(after)
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after = getattr(rows[-1], key)
+
+def get_all_expenses(db: Session, user_email, limit=None, after=None, columns=None, include_archived=False):
+    """Returns the expenses a user created, ordered by id, one keyset page at a time.
+
+    With sharded group data every database returns its own page and the
+    pages are merged by expense id, which is unique across databases.
+    `columns`, as in `get_all_users`, selects tuples instead of entities;
+    it must include expense_id. With `include_archived`, archived expenses
+    are merged in as rows (see `expense_history`).
+    """
+    user = get_user(db, user_email)
+    return expense_page(db, user.user_id, limit=limit, after=after, columns=columns, include_archived=include_archived)
+
+def expense_page(db: Session, user_id, limit=None, after=None, columns=None, include_archived=False):
+    """`get_all_expenses` for a user id that is already resolved."""
+    def page(session):
+        if include_archived:
+            return session.execute(expense_history(user_id, columns, after, limit)).all()
+        query = session.query(*(columns or [models.Expenses])).filter(models.Expenses.created_by == user_id).order_by(models.Expenses.expense_id)
+        if after is not None:
+            query = query.filter(models.Expenses.expense_id > after)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+    pages = sharding.fan_out(db, page)
+    if len(pages) == 1:
+        return pages[0]
+    return list(heapq.merge(*pages, key=lambda expense: expense.expense_id))[:limit]
+
+def expense_history(user_id, columns=None, after=None, limit=None):
+    """Selects a user's live and archived expenses together, ordered by id.
+
+    Args:
+        user_id (int): The creator of the expenses.
+        columns (list | None): `models.Expenses` attributes to select; every
+            column when None. The archive is read through the same names.
+        after (int | None), limit (int | None): Keyset page bounds, applied
+            to both tables before they are merged.
+    """
+    names = [column.key for column in (columns or models.Expenses.__table__.columns)]
+    pages = []
+    for table in (models.Expenses, models.ExpenseArchive):
+        page = select(*(getattr(table, name) for name in names)).where(table.created_by == user_id).order_by(table.expense_id)
+        if after is not None:
+            page = page.where(table.expense_id > after)
+        if limit is not None:
+            page = page.limit(limit)
+        pages.append(select(page.subquery()))
+    merged = union_all(*pages).subquery()
+    history = select(merged).order_by(merged.c.expense_id)
+    if limit is not None:
+        history = history.limit(limit)
+    return history
+
+def iter_expenses(db: Session, user_id, batch_size=1000, include_archived=False):
+    """Streams the expenses a user created in keyset chunks, like `iter_users`.
+
+    Each chunk is one `expense_page`, so sharded databases are merged per chunk.
+    """
+    return _keyset_chunks(
+        lambda after: expense_page(db, user_id, limit=batch_size, after=after, include_archived=include_archived),
+        batch_size, "expense_id",
+    )
+
+def _owed_totals(db: Session, user_id, as_of=None):
+    source = snapshots.ledger_source(user_id, as_of)
     # total amount the user owes to all other users
-    owed = db.query(func.sum(models.Splits.amount)).filter(
-        models.Splits.user_id == user.user_id,
-        models.Splits.expense_id.notin_(subquery)
+    owed = db.query(func.coalesce(func.sum(source.amount), 0.0)).filter(
+        source.debtor_id == user_id,
+        source.creditor_id != user_id
     ).scalar()
 
     # total amount other users owes to the user
-    owes = db.query(func.sum(models.Splits.amount)).filter(
-        models.Splits.expense_id.in_(subquery),
-        models.Splits.user_id != user.user_id
+    owes = db.query(func.coalesce(func.sum(source.amount), 0.0)).filter(
+        source.creditor_id == user_id,
+        source.debtor_id != user_id
     ).scalar()
+    return owed, owes
+
+def total_owed_by_the_user(db: Session, user_email, as_of=None):
+    """Net balance of the user, now or, with `as_of` (naive UTC), at that point in time."""
+    user = get_user(db, user_email)
+    totals = sharding.fan_out(db, lambda session: _owed_totals(session, user.user_id, as_of))
+    if len(totals) == 1:
+        owed, owes = totals[0]
+    else:
+        owed = sum(owed for owed, _ in totals)
+        owes = sum(owes for _, owes in totals)
 
     total = owed - owes
 
     if total < 0:
-        return {'result': f"You are owed {str(-1 * total)}"}
+        return {'result': f"You are owed {-1 * total!s}"}
     else:
-        return {'result': f"You owe {str(total)}" }
+        return {'result': f"You owe {total!s}" }
 
-def owed_to_each_user(db: Session, user_email):
+def owed_to_each_user(db: Session, user_email, by_id=False, as_of=None):
     user = get_user(db, user_email)
-    a = aliased(models.Expenses)
-    b = aliased(models.Splits)
-    results = db.query(
-        a.created_by, 
-        func.sum(b.amount).label('total_amount') 
-    ).join(
-        b, a.expense_id == b.expense_id 
+    source = snapshots.ledger_source(user.user_id, as_of)
+    results = _merge_sums(sharding.fan_out(db, lambda session: session.query(
+        source.creditor_id,
+        func.sum(source.amount).label('total_amount')
     ).filter(
-        a.created_by != user.user_id, 
-        b.user_id == user.user_id 
+        source.debtor_id == user.user_id,
+        source.creditor_id != user.user_id
     ).group_by(
-        a.created_by  
-    ).all() 
+        source.creditor_id
+    ).all()))
+    if by_id:
+        return {row[0]: row[1] for row in results}
+    users = user_loader(db).load_many(row[0] for row in results)
     final = {}
     for row in results:
-        final[get_user_by_id(db,row[0]).first_name] = row[1]
+        final[users[row[0]].first_name] = row[1]
     return final
 
-def owed_in_each_group(db: Session, user_email):
+def owed_in_each_group(db: Session, user_email, as_of=None):
     user = get_user(db, user_email)
     Group = aliased(models.Groups)
-    Expense = aliased(models.Expenses)
-    Split = aliased(models.Splits)
+    source = snapshots.ledger_source(user.user_id, as_of)
 
-    results = db.query(
-        Group.group_name, 
-        func.sum(Split.amount).label('total_amount')
-    ).join(
-        Expense, Expense.group_id == Group.group_id
+    results = _merge_sums(sharding.fan_out(db, lambda session: session.query(
+        Group.group_name,
+        func.sum(source.amount).label('total_amount')
     ).join(
-        Split, Split.expense_id == Expense.expense_id
+        Group, Group.group_id == source.group_id
     ).filter(
-        Expense.group_id.isnot(None),
-        Split.user_id == user.user_id
+        source.group_id != ledger.NO_GROUP,
+        source.debtor_id == user.user_id
     ).group_by(
         Group.group_name
-    ).distinct().all()
+    ).all()))
 
     final = {}
     for row in results:
         final[row[0]] = row[1] 
     return final
 
-def user_all_groups(db: Session, user_email):
+def user_all_groups(db: Session, user_email, as_of=None):
     user = get_user(db, user_email)
     Group = aliased(models.Groups)
     GroupMembers = aliased(models.GroupMembers)
+    as_of_filter = [GroupMembers.added_at <= as_of] if as_of is not None else []
 
     # Query
-    results = db.query(
+    results = sharding.fan_out(db, lambda session: session.query(
         Group.group_name
     ).join(
         GroupMembers, GroupMembers.groupmember_group_id == Group.group_id
     ).filter(
-        GroupMembers.groupmember_user_id == user.user_id
-    ).distinct().all()
+        GroupMembers.groupmember_user_id == user.user_id,
+        *as_of_filter
+    ).distinct().all())
+
+    final = list(dict.fromkeys(i[0] for rows in results for i in rows))
 
-    final = [i[0] for i in results]
+    return final
 
-    return final  
+def _friend_summaries(db: Session, user_ids):
+    users = user_loader(db).load_many(user_ids)
+    return [
+        schema.FriendSummary(user_id=user_id, first_name=users[user_id] and users[user_id].first_name, email=users[user_id] and users[user_id].email)
+        for user_id in user_ids
+    ]
+
+def friends_of(db: Session, user_id, limit=None, after=None):
+    """Returns the user's friends ordered by id, one keyset page at a time, from `friend_graph`.
+
+    Only the names of friends missing from the user cache are queried.
+    """
+    friend_graph.ensure_loaded(db)
+    return _friend_summaries(db, friend_graph.friends(user_id, after=after, limit=limit))
+
+def mutual_friends(db: Session, user_id, other_id):
+    friend_graph.ensure_loaded(db)
+    return _friend_summaries(db, friend_graph.mutual_friends(user_id, other_id))
+
+def friend_suggestions(db: Session, user_id, limit=10):
+    """Friends of friends the user is not friends with, most shared groups first.
+
+    Ties go to the candidate with more mutual friends. See
+    `FriendGraph.suggestions`.
+    """
+    friend_graph.ensure_loaded(db)
+    ranked = friend_graph.suggestions(user_id, limit)
+    summaries = _friend_summaries(db, [candidate for candidate, _, _ in ranked])
+    return [
+        schema.FriendSuggestion(**summary.dict(), mutual_friends=mutual, shared_groups=shared)
+        for summary, (_, mutual, shared) in zip(summaries, ranked)
+    ]
 
 def get_user(db: Session, user_email):
-    user = db.query(models.User).filter(models.User.email == user_email).first()
-    return user
+    """Looks a user up by email through the shared user cache.
+
+    Returns:
+        CachedUser | None: The user's id, first name and email, or None.
+    """
+    cached = user_cache.by_email.get(user_email)
+    if cached is not None:
+        return cached
+    user = db.query(models.User.user_id, models.User.first_name, models.User.email).filter(models.User.email == user_email).first()
+    return user_cache.store(user) if user else None
 
 def get_user_by_id(db: Session, user_id):
-    user = db.query(models.User).filter(models.User.user_id == user_id).first()
-    return user
+    cached = user_cache.by_id.get(user_id)
+    if cached is not None:
+        return cached
+    user = db.query(models.User.user_id, models.User.first_name, models.User.email).filter(models.User.user_id == user_id).first()
+    return user_cache.store(user) if user else None
+
+def warm_user_cache(db: Session, limit=1000):
+    """Caches the users behind the newest expenses, the likeliest to be asked for first.
+
+    Returns:
+        int: The number of users cached.
+    """
+    recent = sharding.fan_out(db, lambda session: [row[0] for row in session.query(
+        models.Expenses.created_by
+    ).order_by(models.Expenses.expense_id.desc()).limit(limit * 4)])
+    user_ids = list(dict.fromkeys(user_id for rows in recent for user_id in rows))[:limit]
+    if len(user_ids) < limit:
+        # a young database: fill up with the newest accounts
+        user_ids += [row[0] for row in db.query(models.User.user_id).filter(
+            models.User.user_id.notin_(user_ids)
+        ).order_by(models.User.user_id.desc()).limit(limit - len(user_ids))]
+    cached = 0
+    for start in range(0, len(user_ids), 1000):
+        for row in db.query(models.User.user_id, models.User.first_name, models.User.email).filter(
+            models.User.user_id.in_(user_ids[start:start + 1000])
+        ):
+            user_cache.store(row)
+            cached += 1
+    return cached
+
+def get_users_by_email(db: Session, user_emails):
+    """Resolves many emails at once, querying only the ones not cached.
+
+    Returns:
+        dict: {email: CachedUser} for every email that exists.
+    """
+    found = {}
+    missing = set()
+    for email in set(user_emails):
+        cached = user_cache.by_email.get(email)
+        if cached is not None:
+            found[email] = cached
+        else:
+            missing.add(email)
+    if missing:
+        rows = db.query(models.User.user_id, models.User.first_name, models.User.email).filter(models.User.email.in_(missing)).all()
+        for row in rows:
+            found[row.email] = user_cache.store(row)
+    return found
 
 def get_group(db: Session, group_id):
-    group = db.query(models.Groups).filter(models.Groups.group_id == group_id).first()
+    with sharding.group_session(db, group_id) as group_db:
+        group = group_db.query(models.Groups).filter(models.Groups.group_id == group_id).first()
     return group
 
+def _merge_sums(partials):
+    """Adds up (key, amount) rows returned by several databases, keeping first-seen order."""
+    if len(partials) == 1:
+        return partials[0]
+    merged = {}
+    for rows in partials:
+        for key, amount in rows:
+            merged[key] = merged.get(key, 0) + amount
+    return list(merged.items())
+
 
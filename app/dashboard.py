@@ -0,0 +1,132 @@
+"""The home screen's balance views, computed together.
+
+`/amount_owed/`, `/amount_owed_to_each_user/`, `/amount_owed_in_each_group/`
+and `/all_user_groups` each resolve the user and scan the ledger on their
+own. The dashboard resolves the user once, reads the user's ledger rows in a
+single query and derives every requested section from them. Group names
+come from one more query. With `as_of`, the ledger rows and memberships are
+those at that point in time (see `snapshots`).
+"""
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+import ledger
+import models
+import schema
+import sharding
+import snapshots
+from loaders import user_loader
+
+SECTIONS = ("amount_owed", "owed_to_each_user", "owed_in_each_group", "groups")
+
+
+def parse_sections(value):
+    """Turns a comma-separated `sections` parameter into a set; every section when empty.
+
+    Raises:
+        ValueError: If a name is not in SECTIONS.
+    """
+    if not value:
+        return set(SECTIONS)
+    sections = {name.strip() for name in value.split(",") if name.strip()}
+    unknown = sections - set(SECTIONS)
+    if unknown:
+        raise ValueError(", ".join(sorted(unknown)))
+    return sections
+
+
+def _read(db: Session, user_id, sections, as_of=None):
+    """Reads what `sections` need from one database.
+
+    Returns:
+        tuple: (ledger rows as (creditor_id, debtor_id, group_id, amount),
+        {group_id: name} of the user's groups, {group_id: name} of the other
+        groups the ledger rows mention).
+    """
+    rows = []
+    if sections & {"amount_owed", "owed_to_each_user", "owed_in_each_group"}:
+        source = snapshots.ledger_source(user_id, as_of)
+        # creditor rows are only needed for what others owe the user
+        involved = source.debtor_id == user_id
+        if "amount_owed" in sections:
+            involved = or_(involved, source.creditor_id == user_id)
+        rows = db.query(
+            source.creditor_id,
+            source.debtor_id,
+            source.group_id,
+            source.amount,
+        ).filter(involved).all()
+
+    member_of = {}
+    if sections & {"groups", "owed_in_each_group"}:
+        member_of = dict(db.query(models.Groups.group_id, models.Groups.group_name).join(
+            models.GroupMembers, models.GroupMembers.groupmember_group_id == models.Groups.group_id
+        ).filter(
+            models.GroupMembers.groupmember_user_id == user_id,
+            *([models.GroupMembers.added_at <= as_of] if as_of is not None else [])
+        ).distinct().all())
+
+    others = {}
+    if "owed_in_each_group" in sections:
+        missing = {group_id for _, debtor_id, group_id, _ in rows if debtor_id == user_id and group_id != ledger.NO_GROUP} - member_of.keys()
+        if missing:
+            others = dict(db.query(models.Groups.group_id, models.Groups.group_name).filter(models.Groups.group_id.in_(missing)).all())
+    return rows, member_of, others
+
+
+def build(db: Session, user, sections, as_of=None):
+    """Computes the requested sections for `user`.
+
+    Args:
+        db (Session): The SQLAlchemy session.
+        user (CachedUser): The resolved user.
+        sections (set[str]): Names from SECTIONS; the others are left as None.
+        as_of (datetime | None): Naive UTC point in time; None for now.
+
+    Returns:
+        schema.Dashboard
+    """
+    rows = []
+    member_of = {}
+    names = {}
+    for partial_rows, partial_member_of, partial_others in sharding.fan_out(db, lambda session: _read(session, user.user_id, sections, as_of)):
+        rows.extend(partial_rows)
+        member_of.update(partial_member_of)
+        names.update(partial_others)
+    names.update(member_of)
+
+    you_owe = 0.0
+    owed_to_you = 0.0
+    by_creditor = {}
+    by_group = {}
+    for creditor_id, debtor_id, group_id, amount in rows:
+        if debtor_id == user.user_id:
+            if creditor_id != user.user_id:
+                you_owe += amount
+                by_creditor[creditor_id] = by_creditor.get(creditor_id, 0.0) + amount
+            if group_id != ledger.NO_GROUP:
+                # like owed_in_each_group, this includes the user's own share
+                by_group[group_id] = by_group.get(group_id, 0.0) + amount
+        elif creditor_id == user.user_id:
+            owed_to_you += amount
+
+    dashboard = schema.Dashboard(user_id=user.user_id)
+    if "amount_owed" in sections:
+        dashboard.amount_owed = schema.AmountOwed(you_owe=you_owe, owed_to_you=owed_to_you, net=you_owe - owed_to_you)
+    if "owed_to_each_user" in sections:
+        users = user_loader(db).load_many(by_creditor)
+        dashboard.owed_to_each_user = [
+            schema.UserBalance(user_id=creditor_id, first_name=users[creditor_id].first_name if users[creditor_id] else None, amount=amount)
+            for creditor_id, amount in sorted(by_creditor.items())
+        ]
+    if "owed_in_each_group" in sections:
+        dashboard.owed_in_each_group = [
+            schema.GroupBalance(group_id=group_id, group_name=names.get(group_id), amount=amount)
+            for group_id, amount in sorted(by_group.items())
+        ]
+    if "groups" in sections:
+        dashboard.groups = [
+            schema.GroupSummary(group_id=group_id, group_name=group_name)
+            for group_id, group_name in sorted(member_of.items())
+        ]
+    return dashboard
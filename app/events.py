@@ -0,0 +1,259 @@
+"""Per-user change notifications for `/events` and `/events/poll`.
+
+Every write that touches a user publishes a small event to that user, for
+example `{"id": 41, "type": "expense_added", "user_id": 7, "version": 12}`.
+`version` is the user's `versions` counter as of that write (absent for
+writes that do not change any balance view), so a client knows its cached
+balance views are stale without fetching them.
+
+Subscribers are async consumers on the event loop, while publishers are
+usually threadpool threads. Each subscriber gets a bounded buffer. When the
+consumer falls behind, the oldest events are dropped and the next batch
+reports how many were lost, so the client can refetch instead of replaying.
+The broker also keeps the last few events per user for long-poll clients and
+for SSE reconnects with `Last-Event-ID`.
+
+The broker lives in process memory: each worker process only sees the
+writes it served.
+"""
+import asyncio
+import itertools
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+
+import metrics
+
+BUFFER_SIZE = int(os.environ.get("EVENTS_BUFFER_SIZE", "100"))
+HISTORY_SIZE = int(os.environ.get("EVENTS_HISTORY_SIZE", "50"))
+HISTORY_USERS = int(os.environ.get("EVENTS_HISTORY_USERS", "100000"))
+HEARTBEAT_SECONDS = float(os.environ.get("EVENTS_HEARTBEAT_SECONDS", "15"))
+
+published = metrics.register(metrics.Counter(
+    "events_published_total", "Events delivered to a user's feed, by type.", ("type",)))
+dropped = metrics.register(metrics.Counter(
+    "events_dropped_total", "Events discarded because a subscriber's buffer was full."))
+
+
+class Subscription:
+    """One consumer's bounded, drop-oldest buffer of events for one user."""
+
+    def __init__(self, user_id, loop, maxsize=BUFFER_SIZE):
+        self.user_id = user_id
+        self._loop = loop
+        self._buffer = deque(maxlen=maxsize)
+        self._dropped = 0
+        # a wake-up is already scheduled on the loop; pushes in between share it
+        self._signalled = False
+        self._lock = threading.Lock()
+        # future the consumer is waiting on; only touched from the loop
+        self._waiter = None
+
+    def push(self, event):
+        """Queues `event`; safe to call from any thread."""
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self._dropped += 1
+                dropped.inc()
+            self._buffer.append(event)
+            if self._signalled:
+                return
+            self._signalled = True
+        try:
+            self._loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            # the subscriber's loop is gone; it unsubscribes on its way out
+            pass
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def get(self, timeout):
+        """Waits up to `timeout` seconds for events.
+
+        Returns:
+            tuple[list[dict], int]: The buffered events, oldest first, and
+            how many were dropped before them. Empty on timeout.
+        """
+        deadline = self._loop.time() + timeout
+        # a wake-up scheduled before the previous drain can arrive with nothing buffered
+        while not self._buffer:
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                return [], 0
+            # cheaper than asyncio.wait_for, which wraps every wait in a task
+            self._waiter = self._loop.create_future()
+            timer = self._loop.call_later(remaining, self._wake)
+            try:
+                await self._waiter
+            finally:
+                timer.cancel()
+                self._waiter = None
+        with self._lock:
+            self._signalled = False
+            events = list(self._buffer)
+            self._buffer.clear()
+            lost, self._dropped = self._dropped, 0
+        return events, lost
+
+
+class Broker:
+    """In-process pub/sub keyed by user id."""
+
+    def __init__(self, history_size=HISTORY_SIZE, history_users=HISTORY_USERS):
+        self.history_size = history_size
+        self.history_users = history_users
+        self._subscribers = {}
+        self._history = OrderedDict()
+        # {user_id: id of the newest event trimmed from that user's history}
+        self._trimmed = {}
+        # newest event id among histories evicted for whole users
+        self._forgotten = 0
+        self._ids = itertools.count(1)
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id, maxsize=BUFFER_SIZE):
+        """Registers a subscription on the running event loop."""
+        subscription = Subscription(user_id, asyncio.get_running_loop(), maxsize)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def publish(self, user_ids, type, user_versions=None, **fields):
+        """Sends a `type` event to every user in `user_ids`. Call after the write commits.
+
+        `user_versions` is the {user_id: version} that `versions.bump` returned
+        for the write, if it bumped any.
+        """
+        user_versions = user_versions or {}
+        for user_id in set(user_ids):
+            with self._lock:
+                event = {"id": next(self._ids), "type": type, "user_id": user_id, **fields}
+                if user_id in user_versions:
+                    event["version"] = user_versions[user_id]
+                self._last_id = event["id"]
+                self._remember(user_id, event)
+                # pushed under the lock, so concurrent publishers cannot deliver ids out of order
+                for subscription in self._subscribers.get(user_id, ()):
+                    subscription.push(event)
+            published.inc(type)
+
+    def _remember(self, user_id, event):
+        history = self._history.get(user_id)
+        if history is None:
+            history = self._history[user_id] = deque(maxlen=self.history_size)
+            if len(self._history) > self.history_users:
+                evicted_user, evicted = self._history.popitem(last=False)
+                self._trimmed.pop(evicted_user, None)
+                if evicted:
+                    self._forgotten = max(self._forgotten, evicted[-1]["id"])
+        else:
+            self._history.move_to_end(user_id)
+        if len(history) == history.maxlen:
+            self._trimmed[user_id] = history[0]["id"]
+        history.append(event)
+
+    def since(self, user_id, after):
+        """Returns the retained events for `user_id` newer than `after`.
+
+        Returns:
+            tuple[list[dict], bool]: The events, and whether some events
+            after `after` may be missing, because they were trimmed or the
+            process restarted since the client's last event id.
+        """
+        with self._lock:
+            history = self._history.get(user_id)
+            events = [event for event in history or () if event["id"] > after]
+            if after > self._last_id:
+                return events, True
+            if history is None:
+                return events, after < self._forgotten
+            return events, after < self._trimmed.get(user_id, 0)
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+broker = Broker()
+metrics.register(metrics.Gauge("events_subscribers", "Open event feed subscriptions.", lambda: [((), broker.subscriber_count())]))
+
+
+def publish(user_ids, type, user_versions=None, **fields):
+    broker.publish(user_ids, type, user_versions, **fields)
+
+
+def sse_message(event_type, data, event_id=None):
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines += [f"event: {event_type}", f"data: {json.dumps(data, separators=(',', ':'))}"]
+    return "\n".join(lines) + "\n\n"
+
+
+async def sse_stream(user_id, last_event_id=None, heartbeat=HEARTBEAT_SECONDS):
+    """Yields server-sent events for `user_id` until the client goes away.
+
+    The subscription is opened before the history is replayed for
+    `last_event_id`, so nothing published in between is lost. An `overflow`
+    event tells the client that events were dropped and it should refetch
+    instead of relying on the feed.
+    """
+    subscription = broker.subscribe(user_id)
+    try:
+        yield "retry: 3000\n\n"
+        last = 0
+        if last_event_id is not None:
+            missed, gap = broker.since(user_id, last_event_id)
+            if gap:
+                yield sse_message("overflow", {"dropped": None})
+            for event in missed:
+                yield sse_message(event["type"], event, event["id"])
+                last = event["id"]
+        while True:
+            batch, lost = await subscription.get(heartbeat)
+            if lost:
+                yield sse_message("overflow", {"dropped": lost})
+            elif not batch:
+                yield ": keep-alive\n\n"
+            for event in batch:
+                if event["id"] > last:
+                    yield sse_message(event["type"], event, event["id"])
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def poll(user_id, after=0, timeout=25.0):
+    """Long-poll fallback: answers as soon as `user_id` has events newer than `after`.
+
+    Returns:
+        dict: `events`, `overflow` (events may have been missed, so refetch)
+        and `last_event_id` to send as `after` next time.
+    """
+    subscription = broker.subscribe(user_id)
+    try:
+        missed, gap = broker.since(user_id, after)
+        if not missed and not gap:
+            batch, lost = await subscription.get(timeout)
+            missed = [event for event in batch if event["id"] > after]
+            gap = bool(lost)
+    finally:
+        broker.unsubscribe(subscription)
+    if missed:
+        last_event_id = missed[-1]["id"]
+    else:
+        last_event_id = broker.last_id if gap else after
+    return {"events": missed, "overflow": gap, "last_event_id": last_event_id}
@@ -1,5 +1,6 @@
 from fastapi import HTTPException
 
+
 class UserAlreadyExistsException(HTTPException):
     def __init__(self):
         super().__init__(status_code=400, detail="User already exists")
@@ -10,4 +11,34 @@ class UserNotFoundException(HTTPException):
 
 class GroupNotFoundException(HTTPException):
     def __init__(self):
-        super().__init__(status_code=404, detail="Group not found")
\ No newline at end of file
+        super().__init__(status_code=404, detail="Group not found")
+
+class WriteBehindDisabledException(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=503, detail="Deferred expense submission is disabled")
+
+class WriteQueueFullException(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=503, detail="Expense queue is full, retry shortly", headers={"Retry-After": "1"})
+
+class WriteBehindStoppingException(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=503, detail="Expense queue is shutting down, retry shortly", headers={"Retry-After": "1"})
+
+class TicketNotFoundException(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=404, detail="Ticket not found")
+
+class InvalidSectionsException(HTTPException):
+    def __init__(self, sections):
+        super().__init__(status_code=422, detail=f"Unknown dashboard sections: {sections}")
+
+class BulkIngestFailedException(HTTPException):
+    def __init__(self, results):
+        super().__init__(status_code=503, detail={
+            "error": "The database failed during the import; the records in results were processed, retry the rest",
+            "results": results,
+        })
+
+class WriteRejectedException(Exception):
+    """A write the data does not allow, e.g. a duplicate friendship; carries {"error": message}."""
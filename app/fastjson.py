@@ -0,0 +1,87 @@
+"""Fast path for large list responses.
+
+With FAST_LIST_RESPONSES set, `/users/` and `/user_expenses/` select only the
+columns of their response model as tuples and encode them straight to JSON,
+skipping the ORM entities, the per-row model validation and
+`jsonable_encoder`. orjson is used when it is installed.
+
+The bytes are the same as on the default path: fields keep the model's
+order, and floats are coerced the way the model would coerce them. Floats
+outside [1e-4, 1e16) are written in exponent forms that differ between
+orjson, pydantic-core and the standard library, so a page containing one
+(or any page, without orjson) is encoded by whatever the default path uses:
+pydantic-core under pydantic v2, `JSONResponse`'s `json.dumps` under v1.
+"""
+import json
+import os
+from datetime import date
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # pydantic v2 renders response models with pydantic-core
+    from pydantic_core import to_json as pydantic_to_json
+except ImportError:
+    pydantic_to_json = None
+
+ENABLED = os.environ.get("FAST_LIST_RESPONSES", "").lower() in ("1", "true", "yes")
+
+
+def columns(entity, model):
+    """The columns of `entity` that make up `model`, in the model's field order."""
+    return [getattr(entity, field) for field in model.__fields__]
+
+
+def _float_fields(model):
+    return [index for index, field in enumerate(model.__fields__.values()) if _annotation(field) is float]
+
+
+def _annotation(field):
+    # pydantic v1 ModelField keeps the type in outer_type_, v2 FieldInfo in annotation
+    return getattr(field, "outer_type_", None) or getattr(field, "annotation", None)
+
+
+def _portable(value):
+    """True when orjson writes `value` exactly as `json.dumps` would."""
+    return value == 0 or 1e-4 <= abs(value) < 1e16
+
+
+def _default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode(model, rows):
+    """Encodes column tuples of `model` as the JSON array the response model would produce.
+
+    Returns:
+        bytes
+    """
+    fields = list(model.__fields__)
+    float_fields = _float_fields(model)
+    items = []
+    portable = orjson is not None
+    for row in rows:
+        row = list(row)
+        for index in float_fields:
+            if row[index] is not None:
+                row[index] = float(row[index])
+                if portable and not _portable(row[index]):
+                    portable = False
+        items.append(dict(zip(fields, row)))
+    if portable:
+        return orjson.dumps(items)
+    if pydantic_to_json is not None:
+        return pydantic_to_json(items)
+    # matches JSONResponse.render; allow_nan=False rejects NaN and inf like the default path
+    return json.dumps(items, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def response(model, rows, headers=None):
+    return Response(content=encode(model, rows), media_type="application/json", headers=headers)
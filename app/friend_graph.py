@@ -0,0 +1,263 @@
+"""In-process friend graph for friend lists, mutual friends and suggestions.
+
+`friends` rows are directional (`user_id`, `friend_user_id`), but a
+friendship works both ways, so the index stores each edge under both users.
+Every user's friends, and separately their groups from `groupmembers`, are
+kept as a sorted `array('i')` of ids. That costs 4 bytes per entry plus
+one small array header per user, several times less than sets of int
+objects would take. `python -m benchmarks.friend_graph` measures both at a
+million friendships.
+
+`load` builds the index at startup. `add_friendship` and `add_membership`
+keep it current after each write commits. They replace a user's array with
+an updated copy instead of changing it in place, so readers never lock and
+never see a half-written array.
+
+Like `versions`, the index lives in process memory, so a worker only sees
+the writes it served itself. Writes served by other workers or hosts, and
+those made by the archive, bulk and sharding tools, reach it through
+`refresh`. The app calls `refresh` every FRIEND_GRAPH_REFRESH_SECONDS. It
+compares the row count and high-water mark of `friends` and of every
+shard's `groupmembers` with those seen at the last load. When they differ,
+it reloads the index, so the index is at most one interval plus one load
+behind the database. Setting FRIEND_GRAPH_REFRESH_SECONDS to 0 turns the
+refresh off, which is only safe for a single process that serves every
+write.
+"""
+import heapq
+import os
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import Session
+
+import metrics
+import models
+import sharding
+
+REFRESH_SECONDS = float(os.environ.get("FRIEND_GRAPH_REFRESH_SECONDS", "30"))
+
+_EMPTY = array("i")
+
+
+def _insert(index, key, value):
+    """Adds `value` to the sorted array at `index[key]` by swapping in a copy.
+
+    Returns:
+        bool: False when `value` was already there.
+    """
+    current = index.get(key, _EMPTY)
+    position = bisect_left(current, value)
+    if position < len(current) and current[position] == value:
+        return False
+    updated = current[:position]
+    updated.append(value)
+    updated.extend(current[position:])
+    index[key] = updated
+    return True
+
+
+def _append(index, key, value):
+    ids = index.get(key)
+    if ids is None:
+        ids = index[key] = array("i")
+    ids.append(value)
+
+
+def _sort_unique(index):
+    for key, ids in index.items():
+        index[key] = array("i", sorted(set(ids)))
+
+
+def _high_water(db: Session):
+    """Row count and newest row of `friends` and of `groupmembers` on every shard."""
+    friends = db.execute(select(func.count(), func.max(models.Friends.added_at))).one()
+    members = sharding.fan_out(db, lambda session: tuple(session.execute(
+        select(func.count(), func.max(models.GroupMembers.groupmember_id))
+    ).one()))
+    return (tuple(friends), *members)
+
+
+def _load_friends(db: Session, batch_size):
+    """Friend adjacency from `friends`, read in keyset chunks of `batch_size` rows.
+
+    mysqlconnector buffers a whole result set on the client, so every chunk
+    is a bounded query of its own, as in `crud.iter_users`.
+    """
+    friends = {}
+    key = tuple_(models.Friends.user_id, models.Friends.friend_user_id)
+    query = select(models.Friends.user_id, models.Friends.friend_user_id).order_by(models.Friends.user_id, models.Friends.friend_user_id)
+    after = None
+    while True:
+        rows = db.execute((query if after is None else query.where(key > tuple_(*after))).limit(batch_size)).all()
+        for user_id, friend_id in rows:
+            if user_id != friend_id:
+                _append(friends, user_id, friend_id)
+                _append(friends, friend_id, user_id)
+        if len(rows) < batch_size:
+            break
+        after = rows[-1]
+    _sort_unique(friends)
+    return friends
+
+
+def _load_groups(db: Session, batch_size):
+    """User → groups from `groupmembers` on one database, in keyset chunks."""
+    groups = {}
+    after = 0
+    while True:
+        rows = db.execute(select(
+            models.GroupMembers.groupmember_id, models.GroupMembers.groupmember_user_id, models.GroupMembers.groupmember_group_id
+        ).where(models.GroupMembers.groupmember_id > after).order_by(models.GroupMembers.groupmember_id).limit(batch_size)).all()
+        for _, user_id, group_id in rows:
+            _append(groups, user_id, group_id)
+        if len(rows) < batch_size:
+            return groups
+        after = rows[-1][0]
+
+
+class FriendGraph:
+    """Undirected friend adjacency and user → groups membership, by user id."""
+
+    def __init__(self):
+        self._friends = {}
+        self._groups = {}
+        self._edges = 0
+        self._loaded = False
+        # `_high_water` as of the last load, for `refresh`
+        self._marks = None
+        # writes that commit while `load` reads the tables, replayed onto its result
+        self._pending = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def load(self, db: Session, batch_size=10000):
+        """Rebuilds the index from `friends` and, on every shard, `groupmembers`.
+
+        Returns:
+            tuple[int, int]: The number of friendships and group memberships.
+        """
+        with self._load_lock:
+            return self._load(db, batch_size)
+
+    def ensure_loaded(self, db: Session):
+        """Loads the index on first use, when startup did not."""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self._load(db)
+
+    def refresh(self, db: Session):
+        """Reloads the index if `friends` or `groupmembers` changed since the last load.
+
+        Returns:
+            bool: True when it reloaded.
+        """
+        with self._load_lock:
+            if self._loaded and _high_water(db) == self._marks:
+                return False
+            self._load(db)
+            return True
+
+    def _load(self, db: Session, batch_size=10000):
+        with self._lock:
+            self._pending = []
+        try:
+            # read first, so rows written during the load trigger one more refresh
+            marks = _high_water(db)
+            friends = _load_friends(db, batch_size)
+            groups = {}
+            for shard_groups in sharding.fan_out(db, lambda session: _load_groups(session, batch_size)):
+                for user_id, group_ids in shard_groups.items():
+                    groups.setdefault(user_id, array("i")).extend(group_ids)
+            _sort_unique(groups)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            edges = sum(len(ids) for ids in friends.values()) // 2
+            for kind, first, second in self._pending:
+                if kind == "friend":
+                    if _insert(friends, first, second):
+                        _insert(friends, second, first)
+                        edges += 1
+                else:
+                    _insert(groups, first, second)
+            self._friends, self._groups, self._edges = friends, groups, edges
+            self._pending = None
+            self._marks = marks
+            self._loaded = True
+        return edges, sum(len(ids) for ids in groups.values())
+
+    def add_friendship(self, user_id, friend_id):
+        """Records a friendship in both directions. Call after the write commits."""
+        if user_id == friend_id:
+            return
+        with self._lock:
+            if _insert(self._friends, user_id, friend_id):
+                _insert(self._friends, friend_id, user_id)
+                self._edges += 1
+            if self._pending is not None:
+                self._pending.append(("friend", user_id, friend_id))
+
+    def add_membership(self, user_id, group_id):
+        """Records that `user_id` joined `group_id`. Call after the write commits."""
+        with self._lock:
+            _insert(self._groups, user_id, group_id)
+            if self._pending is not None:
+                self._pending.append(("group", user_id, group_id))
+
+    def friends(self, user_id, after=None, limit=None):
+        """The user's friend ids in ascending order, one keyset page at a time."""
+        ids = self._friends.get(user_id, _EMPTY)
+        start = 0 if after is None else bisect_right(ids, after)
+        end = len(ids) if limit is None else start + limit
+        return ids[start:end].tolist()
+
+    def mutual_friends(self, user_id, other_id):
+        """Ids of the users who are friends with both, ascending."""
+        mine = self._friends.get(user_id, _EMPTY)
+        theirs = self._friends.get(other_id, _EMPTY)
+        if len(mine) > len(theirs):
+            mine, theirs = theirs, mine
+        return sorted(set(mine).intersection(theirs))
+
+    def suggestions(self, user_id, limit=10):
+        """Friends of friends who are not friends yet, best first.
+
+        Candidates rank by the number of groups they share with the user,
+        then by mutual friends, then by id.
+
+        Returns:
+            list[tuple[int, int, int]]: (user_id, mutual friends, shared groups).
+        """
+        friends = self._friends.get(user_id, _EMPTY)
+        mutual = Counter()
+        for friend_id in friends:
+            mutual.update(self._friends.get(friend_id, _EMPTY))
+        mutual.pop(user_id, None)
+        for friend_id in friends:
+            mutual.pop(friend_id, None)
+        my_groups = set(self._groups.get(user_id, _EMPTY))
+        ranked = (
+            (candidate, count, len(my_groups.intersection(self._groups.get(candidate, _EMPTY))) if my_groups else 0)
+            for candidate, count in mutual.items()
+        )
+        return heapq.nsmallest(limit, ranked, key=lambda row: (-row[2], -row[1], row[0]))
+
+    def stats(self):
+        return {"users": len(self._friends), "friendships": self._edges, "members": len(self._groups)}
+
+
+graph = FriendGraph()
+metrics.register(metrics.Gauge("friend_graph_friendships", "Friendships held by the in-process friend graph.",
+                               lambda: [((), graph.stats()["friendships"])]))
@@ -0,0 +1,222 @@
+"""Pairwise balance ledger kept in step with `splits`.
+
+Every split row means "debtor owes the expense creator `amount`". The
+`balances` table keeps the running sum of those rows per
+(creditor, debtor, group) so the balance endpoints read a handful of rows
+per user instead of aggregating the user's whole expense history.
+
+Archiving expenses (see `archive`) leaves `balances` alone and moves the
+sum of their splits into `balances_carried`, so the expected ledger is the
+aggregate of `splits` plus the carried rows.
+
+Run as a script to rebuild the table from `splits` or to check it for drift:
+
+    python ledger.py verify
+    python ledger.py rebuild
+"""
+import argparse
+import sys
+from collections import defaultdict
+
+from sqlalchemy import delete, func, insert, select, union_all, update
+from sqlalchemy.orm import Session
+
+import models
+
+# Expenses without a group are tracked under this group id.
+NO_GROUP = 0
+
+
+def expense_deltas(creditor_id, group_id, splits):
+    """Folds the splits of one expense into ledger deltas.
+
+    Args:
+        creditor_id (int): The user who paid for the expense.
+        group_id (int | None): The group of the expense, if any.
+        splits (Iterable[tuple[int, float]]): (user_id, amount) for each split.
+
+    Returns:
+        dict: {(creditor_id, debtor_id, group_id): amount}
+    """
+    deltas = defaultdict(float)
+    for debtor_id, amount in splits:
+        deltas[(creditor_id, debtor_id, group_id or NO_GROUP)] += amount
+    return deltas
+
+
+def merge_deltas(target, deltas):
+    """Adds `deltas` into `target` in place and returns it."""
+    for key, amount in deltas.items():
+        target[key] += amount
+    return target
+
+
+def apply(db: Session, deltas, model=models.Balances):
+    """Adds `deltas` to the ledger inside the caller's transaction.
+
+    Uses the dialect's native upsert where available so concurrent writers
+    touching the same pair never race on the unique key. The caller commits.
+    `model` is any table keyed like `balances`, such as `CarriedBalance`.
+    """
+    if not deltas:
+        return
+    rows = [
+        {"creditor_id": creditor_id, "debtor_id": debtor_id, "group_id": group_id, "amount": amount}
+        for (creditor_id, debtor_id, group_id), amount in deltas.items()
+    ]
+    dialect = db.get_bind(model).dialect.name
+    table = model.__table__
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(table)
+        stmt = stmt.on_duplicate_key_update(amount=table.c.amount + stmt.inserted.amount)
+        db.execute(stmt, rows)
+    elif dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as upsert_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as upsert_insert
+        stmt = upsert_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["creditor_id", "debtor_id", "group_id"],
+            set_={"amount": table.c.amount + stmt.excluded.amount},
+        )
+        db.execute(stmt, rows)
+    else:
+        _apply_portable(db, rows, model)
+
+
+def _apply_portable(db: Session, rows, model):
+    existing = set(
+        db.execute(
+            select(model.creditor_id, model.debtor_id, model.group_id)
+            .where(model.creditor_id.in_({row["creditor_id"] for row in rows}))
+            .with_for_update()
+        ).all()
+    )
+    inserts = []
+    for row in rows:
+        if (row["creditor_id"], row["debtor_id"], row["group_id"]) in existing:
+            db.execute(
+                update(model)
+                .where(
+                    model.creditor_id == row["creditor_id"],
+                    model.debtor_id == row["debtor_id"],
+                    model.group_id == row["group_id"],
+                )
+                .values(amount=model.amount + row["amount"])
+            )
+        else:
+            inserts.append(row)
+    if inserts:
+        db.execute(insert(model), inserts)
+
+
+def _aggregate_from_splits():
+    live = (
+        select(
+            models.Expenses.created_by.label("creditor_id"),
+            models.Splits.user_id.label("debtor_id"),
+            func.coalesce(models.Expenses.group_id, NO_GROUP).label("group_id"),
+            models.Splits.amount.label("amount"),
+        )
+        .join(models.Expenses, models.Expenses.expense_id == models.Splits.expense_id)
+    )
+    carried = select(
+        models.CarriedBalance.creditor_id,
+        models.CarriedBalance.debtor_id,
+        models.CarriedBalance.group_id,
+        models.CarriedBalance.amount,
+    )
+    rows = union_all(live, carried).subquery()
+    return (
+        select(rows.c.creditor_id, rows.c.debtor_id, rows.c.group_id, func.sum(rows.c.amount).label("amount"))
+        .group_by(rows.c.creditor_id, rows.c.debtor_id, rows.c.group_id)
+    )
+
+
+def rebuild(db: Session):
+    """Recomputes the whole ledger from `splits` in one transaction.
+
+    Returns:
+        int: The number of ledger rows written.
+    """
+    try:
+        db.execute(delete(models.Balances))
+        expected = _aggregate_from_splits().subquery()
+        db.execute(
+            insert(models.Balances).from_select(
+                ["creditor_id", "debtor_id", "group_id", "amount"],
+                select(expected.c.creditor_id, expected.c.debtor_id, expected.c.group_id, expected.c.amount),
+            )
+        )
+        count = db.query(func.count(models.Balances.balance_id)).scalar()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return count
+
+
+def verify(db: Session, tolerance=0.005):
+    """Compares the ledger against a fresh aggregate of `splits`.
+
+    Returns:
+        list[dict]: One entry per (creditor, debtor, group) that drifted,
+        with the ledger and expected amounts. Empty when the ledger is sound.
+    """
+    expected = {
+        (row.creditor_id, row.debtor_id, row.group_id): row.amount
+        for row in db.execute(_aggregate_from_splits())
+    }
+    actual = {
+        (row.creditor_id, row.debtor_id, row.group_id): row.amount
+        for row in db.query(models.Balances.creditor_id, models.Balances.debtor_id, models.Balances.group_id, models.Balances.amount)
+    }
+    drift = []
+    for key in expected.keys() | actual.keys():
+        if abs(expected.get(key, 0.0) - actual.get(key, 0.0)) > tolerance:
+            creditor_id, debtor_id, group_id = key
+            drift.append({
+                "creditor_id": creditor_id,
+                "debtor_id": debtor_id,
+                "group_id": group_id,
+                "ledger": actual.get(key, 0.0),
+                "expected": expected.get(key, 0.0),
+            })
+    return drift
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild or verify the balances ledger.")
+    parser.add_argument("command", choices=["rebuild", "verify"])
+    args = parser.parse_args(argv)
+
+    import sharding
+
+    # every database keeps the ledger for the expenses it holds
+    drifted = 0
+    for shard in sharding.all_shards():
+        with sharding.shard_session(shard) as db:
+            if args.command == "rebuild":
+                print(f"rebuilt {rebuild(db)} ledger rows")
+                continue
+            drift = verify(db)
+            for row in drift:
+                print(row)
+            drifted += len(drift)
+    if args.command == "rebuild":
+        import database
+        import versions
+
+        # cached balance views and settle-up plans may predate the rebuild
+        with database.SessionLocal() as db:
+            versions.bump_all(db)
+            db.commit()
+    if args.command == "verify":
+        print(f"{drifted} drifted ledger rows")
+    return 1 if drifted else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
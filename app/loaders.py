@@ -0,0 +1,63 @@
+"""Request-scoped batch loaders.
+
+A loader lives in `Session.info`, so it shares the lifetime of the session
+`get_db` opens for one request. Callers prime it with every id they will
+need and it resolves them with a single query.
+"""
+from sqlalchemy.orm import Session
+
+import models
+from cache import user_cache
+
+
+class UserLoader:
+    """Collects user ids and resolves them to `CachedUser` in one query."""
+
+    def __init__(self, db: Session):
+        self.db = db
+        self._pending = set()
+        self._loaded = {}
+
+    def prime(self, user_ids):
+        """Queues ids for the next fetch without querying yet."""
+        self._pending.update(user_id for user_id in user_ids if user_id not in self._loaded)
+
+    def load_many(self, user_ids):
+        """Resolves `user_ids` and anything already primed.
+
+        Returns:
+            dict: {user_id: CachedUser | None}
+        """
+        user_ids = list(user_ids)
+        self.prime(user_ids)
+        self._fetch()
+        return {user_id: self._loaded.get(user_id) for user_id in user_ids}
+
+    def load(self, user_id):
+        return self.load_many([user_id])[user_id]
+
+    def _fetch(self):
+        if not self._pending:
+            return
+        missing = set()
+        for user_id in self._pending:
+            cached = user_cache.by_id.get(user_id)
+            if cached is not None:
+                self._loaded[user_id] = cached
+            else:
+                missing.add(user_id)
+        self._pending.clear()
+        if missing:
+            rows = self.db.query(models.User.user_id, models.User.first_name, models.User.email).filter(models.User.user_id.in_(missing)).all()
+            for row in rows:
+                self._loaded[row.user_id] = user_cache.store(row)
+            for user_id in missing:
+                self._loaded.setdefault(user_id, None)
+
+
+def user_loader(db: Session):
+    """Returns the `UserLoader` bound to this session, creating it once."""
+    loader = db.info.get("user_loader")
+    if loader is None:
+        loader = db.info["user_loader"] = UserLoader(db)
+    return loader
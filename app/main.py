@@ -1,17 +1,56 @@
-from fastapi import FastAPI, Depends
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+
 import uvicorn
+from fastapi import APIRouter, Depends, FastAPI, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine
+
+import bulk
 import crud
+import dashboard
+import database
+import events
+import fastjson
+import metrics
 import models
 import schema
 import services
-from typing import List
+import settle
+import sharding
+import snapshots
+import versions
+import write_behind
+from budgets import query_budget
+from database import SessionLocal, engine
+from exceptions import (
+    BulkIngestFailedException,
+    GroupNotFoundException,
+    InvalidSectionsException,
+    TicketNotFoundException,
+    UserNotFoundException,
+    WriteBehindDisabledException,
+    WriteBehindStoppingException,
+    WriteQueueFullException,
+)
+from friend_graph import REFRESH_SECONDS as FRIEND_GRAPH_REFRESH_SECONDS
+from friend_graph import graph as friend_graph
+from streaming import blocking_lines, ndjson_line, next_page_headers
 
+logger = logging.getLogger(__name__)
 
-models.Base.metadata.create_all(bind=engine)
+# Creating tables at startup is for development and tests; deployments run
+# `python -m migrations upgrade` instead.
+CREATE_SCHEMA = os.environ.get("DB_CREATE_SCHEMA", "").lower() in ("1", "true", "yes")
+# Users loaded into the user cache at startup; 0 turns the warm-up off.
+USER_CACHE_WARMUP = int(os.environ.get("USER_CACHE_WARMUP", "1000"))
 
-app = FastAPI()
+router = APIRouter()
 
 def get_db():
     db = SessionLocal()
@@ -20,54 +59,351 @@ def get_db():
     finally:
         db.close()
 
-@app.post("/users/", response_model=schema.User) # what is response model?
+def read_session_for(user_email=None):
+    """Opens a read session: a replica, unless it has not caught up with the user's own writes.
+
+    A pinned user (see `database.pin_to_primary`) is served from the primary
+    until the replica shows the version their last write committed. A user
+    the replica does not know yet (a replication lag symptom) is also served
+    from the primary.
+    """
+    db = database.read_session()
+    if database.replica_engines and user_email and database.any_pinned():
+        user = crud.get_user(db, user_email)
+        version = None if user is None else database.pinned_version(user.user_id)
+        if user is None or (version and versions.user_version(db, user.user_id) < version):
+            db.close()
+            db = SessionLocal()
+    return db
+
+def get_read_db(request: Request):
+    """Session for read-only routes, chosen by `read_session_for` from the `user_email` parameter."""
+    db = read_session_for(request.query_params.get("user_email"))
+    try:
+        yield db
+    finally:
+        db.close()
+
+@router.post("/users/", response_model=schema.User) # what is response model?
+@query_budget(3)
 def create_user(user: schema.UserCreate, db: Session = Depends(get_db)): # what is depends?
     db_user = services.create_user_service(db, user)
     return db_user
 
-@app.post("/addfriend/", response_model=schema.Friend)
+@router.post("/addfriend/", response_model=schema.Friend)
+@query_budget(6)
 def add_friend(friend: schema.FriendAdd, db: Session = Depends(get_db)):
     db_friend = services.add_friend_service(db, friend)
     return db_friend
 
-@app.post("/groups/", response_model=schema.Group)
+@router.post("/groups/", response_model=schema.Group)
+@query_budget(9)
 def create_group(group: schema.GroupCreate, db: Session = Depends(get_db)):
     db_group = services.create_group_service(db, group)
     return db_group
 
-@app.post("/addmembertogroup/", response_model=schema.GroupMember)
+@router.post("/addmembertogroup/", response_model=schema.GroupMember)
+@query_budget(8)
 def add_user_to_group(group_member: schema.GroupMemberAdd, db: Session = Depends(get_db)):
     db_groupmeber = services.add_member_to_group_service(db, group_member)
     return db_groupmeber
 
-@app.post("/addexpense", response_model=schema.Expense)
+@router.post("/addexpense", response_model=schema.Expense)
+@query_budget(9)
 def add_expense(expense: schema.ExpenseCreate, db: Session = Depends(get_db)):
     db_expense = crud.add_expense(db, expense)
     return db_expense
 
-@app.get("/users/", response_model=List[schema.User])
-def get_users(db: Session = Depends(get_db)):
-    return crud.get_all_users(db)
+@router.post("/addexpense/deferred", status_code=202)
+@query_budget(0)
+def add_expense_deferred(expense: schema.ExpenseCreate):
+    """Queues an expense for the write-behind worker and returns a ticket to poll."""
+    if write_behind.writer is None:
+        raise WriteBehindDisabledException()
+    try:
+        ticket = write_behind.writer.submit(expense)
+    except write_behind.Stopping:
+        raise WriteBehindStoppingException()
+    except write_behind.QueueFull:
+        raise WriteQueueFullException()
+    return {"ticket": ticket, "status": "queued"}
+
+@router.get("/addexpense/deferred/{ticket}")
+@query_budget(0)
+def get_deferred_expense(ticket: str):
+    status = write_behind.writer.status(ticket) if write_behind.writer else None
+    if status is None:
+        raise TicketNotFoundException()
+    return status
+
+@router.post("/expenses/bulk")
+@query_budget(6)
+async def add_expenses_bulk(request: Request, batch_size: int = Query(bulk.DEFAULT_BATCH_SIZE, ge=1, le=10000), db: Session = Depends(get_db)):
+    """Imports JSONL (or text/csv) expenses from the request body, chunk by chunk."""
+    fmt = "csv" if request.headers.get("content-type", "").startswith("text/csv") else "jsonl"
+    def ingest():
+        results = []
+        try:
+            for result in bulk.ingest(db, blocking_lines(request.stream()), fmt, batch_size):
+                results.append(result)  # noqa: PERF402 - keeps the processed records if the import fails midway
+        except SQLAlchemyError:
+            logger.exception("bulk import failed after %d records", len(results))
+            raise BulkIngestFailedException(results)
+        return results
+    results = await run_in_threadpool(ingest)
+    accepted = sum(1 for result in results if result["status"] == "accepted")
+    return {"accepted": accepted, "rejected": len(results) - accepted, "results": results}
+
+def ndjson_stream(rows, model, user_email=None):
+    """Streams rows as newline-delimited JSON using a session of its own.
+
+    `get_db` may close its session before a streaming body is sent, so the
+    generator opens and closes a session for the lifetime of the stream,
+    picked by `read_session_for(user_email)` like `get_read_db` does.
+    `rows` is called with that session and must return an iterable of ORM rows.
+    """
+    def generate():
+        db = read_session_for(user_email)
+        try:
+            for row in rows(db):
+                yield ndjson_line(row, model)
+        finally:
+            db.close()
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@router.get("/users/", response_model=list[schema.User])
+@query_budget(1)
+def get_users(response: Response, limit: int | None = Query(None, ge=1), after: int | None = None, stream: bool = False, db: Session = Depends(get_read_db)):
+    if stream:
+        return ndjson_stream(crud.iter_users, schema.User)
+    if fastjson.ENABLED:
+        users = crud.get_all_users(db, limit=limit, after=after, columns=fastjson.columns(models.User, schema.User))
+        return fastjson.response(schema.User, users, headers=next_page_headers(users, limit, "user_id"))
+    users = crud.get_all_users(db, limit=limit, after=after)
+    response.headers.update(next_page_headers(users, limit, "user_id"))
+    return users
+
+@router.get("/user_expenses/", response_model=list[schema.Expense])
+@query_budget(2)
+def get_user_expenses(user_email: str, response: Response, limit: int | None = Query(None, ge=1), after: int | None = None, stream: bool = False, include_archived: bool = False, db: Session = Depends(get_read_db)):
+    user_id = get_user_or_404(db, user_email).user_id
+    if stream:
+        return ndjson_stream(lambda stream_db: crud.iter_expenses(stream_db, user_id, include_archived=include_archived), schema.Expense, user_email)
+    if fastjson.ENABLED:
+        expenses = crud.expense_page(db, user_id, limit=limit, after=after, columns=fastjson.columns(models.Expenses, schema.Expense), include_archived=include_archived)
+        return fastjson.response(schema.Expense, expenses, headers=next_page_headers(expenses, limit, "expense_id"))
+    expenses = crud.expense_page(db, user_id, limit=limit, after=after, include_archived=include_archived)
+    response.headers.update(next_page_headers(expenses, limit, "expense_id"))
+    return expenses
+
+def get_user_or_404(db: Session, user_email):
+    user = crud.get_user(db, user_email)
+    if not user:
+        raise UserNotFoundException()
+    return user
+
+# The balance views take an optional `as_of` timestamp (naive values are UTC)
+# and then answer as of that point in time; see `snapshots`.
+
+@router.get("/amount_owed/")
+@query_budget(4)
+def get_amount_owed(user_email: str, request: Request, as_of: datetime | None = None, db: Session = Depends(get_read_db)):
+    user = get_user_or_404(db, user_email)
+    as_of = snapshots.naive_utc(as_of)
+    return versions.conditional_get(request, db, snapshots.cache_key("amount_owed", as_of), user.user_id,
+                                    lambda: crud.total_owed_by_the_user(db, user_email, as_of=as_of))
+
+@router.get("/amount_owed_to_each_user/")
+@query_budget(4)
+def get_amount_owed_to_each_user(user_email: str, request: Request, by_id: bool = False, as_of: datetime | None = None, db: Session = Depends(get_read_db)):
+    user = get_user_or_404(db, user_email)
+    as_of = snapshots.naive_utc(as_of)
+    return versions.conditional_get(request, db, snapshots.cache_key(f"amount_owed_to_each_user:{int(by_id)}", as_of), user.user_id,
+                                    lambda: crud.owed_to_each_user(db, user_email, by_id=by_id, as_of=as_of))
+
+@router.get("/amount_owed_in_each_group/")
+@query_budget(3)
+def get_amount_owed_to_each_group(user_email: str, request: Request, as_of: datetime | None = None, db: Session = Depends(get_read_db)):
+    user = get_user_or_404(db, user_email)
+    as_of = snapshots.naive_utc(as_of)
+    return versions.conditional_get(request, db, snapshots.cache_key("amount_owed_in_each_group", as_of), user.user_id,
+                                    lambda: crud.owed_in_each_group(db, user_email, as_of=as_of))
 
-@app.get("/user_expenses/", response_model=List[schema.Expense])
-def get_user_expenses(user_email: str, db: Session = Depends(get_db)):
-    return crud.get_all_expenses(db, user_email)
+@router.get("/all_user_groups")
+@query_budget(3)
+def get_user_all_groups(user_email: str, request: Request, as_of: datetime | None = None, db: Session = Depends(get_read_db)):
+    user = get_user_or_404(db, user_email)
+    as_of = snapshots.naive_utc(as_of)
+    return versions.conditional_get(request, db, snapshots.cache_key("all_user_groups", as_of), user.user_id,
+                                    lambda: crud.user_all_groups(db, user_email, as_of=as_of))
+
+@router.get("/friends/", response_model=list[schema.FriendSummary])
+@query_budget(2)
+def get_friends(user_email: str, response: Response, limit: int | None = Query(None, ge=1), after: int | None = None, db: Session = Depends(get_read_db)):
+    """The user's friends from the in-process friend graph, keyset-paginated by user id."""
+    user = get_user_or_404(db, user_email)
+    friends = crud.friends_of(db, user.user_id, limit=limit, after=after)
+    response.headers.update(next_page_headers(friends, limit, "user_id"))
+    return friends
+
+@router.get("/mutual_friends/", response_model=list[schema.FriendSummary])
+@query_budget(2)
+def get_mutual_friends(user_email: str, other_email: str, db: Session = Depends(get_read_db)):
+    users = crud.get_users_by_email(db, [user_email, other_email])
+    if user_email not in users or other_email not in users:
+        raise UserNotFoundException()
+    return crud.mutual_friends(db, users[user_email].user_id, users[other_email].user_id)
+
+@router.get("/friend_suggestions/", response_model=list[schema.FriendSuggestion])
+@query_budget(2)
+def get_friend_suggestions(user_email: str, limit: int = Query(10, ge=1, le=100), db: Session = Depends(get_read_db)):
+    user = get_user_or_404(db, user_email)
+    return crud.friend_suggestions(db, user.user_id, limit=limit)
+
+@router.get("/dashboard", response_model=schema.Dashboard)
+@query_budget(5)
+def get_dashboard(user_email: str, request: Request, sections: str | None = None, as_of: datetime | None = None, db: Session = Depends(get_read_db)):
+    """Every balance view of the home screen in one round trip.
+
+    `sections` is a comma-separated subset of dashboard.SECTIONS; the
+    sections left out are returned as null.
+    """
+    try:
+        wanted = dashboard.parse_sections(sections)
+    except ValueError as e:
+        raise InvalidSectionsException(str(e))
+    user = get_user_or_404(db, user_email)
+    as_of = snapshots.naive_utc(as_of)
+    return versions.conditional_get(request, db, snapshots.cache_key(f"dashboard:{'+'.join(sorted(wanted))}", as_of), user.user_id,
+                                    lambda: dashboard.build(db, user, wanted, as_of))
+
+@router.get("/settle_up/", response_model=schema.SettlePlan)
+@query_budget(5)
+def get_settle_up(group_id: int, db: Session = Depends(get_db)):
+    if not crud.get_group(db, group_id):
+        raise GroupNotFoundException()
+    return settle.settle_up_plan(db, group_id)
+
+def resolve_user_id(user_email):
+    """Looks a user up in a session closed right away, for requests that stay open."""
+    db = read_session_for(user_email)
+    try:
+        return get_user_or_404(db, user_email).user_id
+    finally:
+        db.close()
+
+@router.get("/events")
+@query_budget(1)
+async def get_events(user_email: str, request: Request):
+    """Server-sent events for every write that affects the user."""
+    user_id = await run_in_threadpool(resolve_user_id, user_email)
+    last_event_id = request.headers.get("last-event-id")
+    return StreamingResponse(
+        events.sse_stream(user_id, int(last_event_id) if last_event_id and last_event_id.isdigit() else None),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/events/poll")
+@query_budget(1)
+async def poll_events(user_email: str, after: int = Query(0, ge=0), timeout: float = Query(25, ge=0, le=60)):
+    """Long-poll fallback for clients that cannot hold an event stream open."""
+    user_id = await run_in_threadpool(resolve_user_id, user_email)
+    return await events.poll(user_id, after, timeout)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+@query_budget(0)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def create_schema():
+    """Creates the missing tables on the primary and on every shard."""
+    models.Base.metadata.create_all(bind=engine)
+    sharding.create_shard_schemas()
+
+async def warm_up():
+    """Fills the connection pools, the user cache and the friend graph before the first request.
+
+    A database that cannot be reached yet is logged and skipped; pre-ping
+    reconnects once it is back.
+    """
+    for target in [engine] + database.replica_engines + sharding.shard_engines:
+        try:
+            await run_in_threadpool(database.warm_pool, target)
+        except Exception:
+            logger.warning("could not warm the connection pool of %s", target.url, exc_info=True)
+    if database.ASYNC_MODE:
+        try:
+            await database.warm_async_pool()
+        except Exception:
+            logger.warning("could not warm the async connection pool", exc_info=True)
+    if USER_CACHE_WARMUP:
+        def warm_user_cache():
+            with database.read_session() as db:
+                return crud.warm_user_cache(db, USER_CACHE_WARMUP)
+        try:
+            logger.info("cached %d users", await run_in_threadpool(warm_user_cache))
+        except Exception:
+            logger.warning("could not warm the user cache", exc_info=True)
+    def load_friend_graph():
+        # from the primary, so the graph cannot start behind a lagging replica
+        with SessionLocal() as db:
+            return friend_graph.load(db)
+    try:
+        logger.info("friend graph: %d friendships, %d group memberships", *await run_in_threadpool(load_friend_graph))
+    except Exception:
+        logger.warning("could not load the friend graph; it loads on first use", exc_info=True)
+
+async def refresh_friend_graph():
+    """Picks up friend graph writes served elsewhere every FRIEND_GRAPH_REFRESH_SECONDS."""
+    def refresh():
+        with SessionLocal() as db:
+            return friend_graph.refresh(db)
+    while True:
+        await asyncio.sleep(FRIEND_GRAPH_REFRESH_SECONDS)
+        try:
+            if await run_in_threadpool(refresh):
+                logger.info("friend graph reloaded: %d friendships", friend_graph.stats()["friendships"])
+        except Exception:
+            logger.warning("could not refresh the friend graph", exc_info=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if CREATE_SCHEMA:
+        await run_in_threadpool(create_schema)
+    await warm_up()
+    write_behind.start(SessionLocal)
+    refresher = asyncio.create_task(refresh_friend_graph()) if FRIEND_GRAPH_REFRESH_SECONDS > 0 else None
+    try:
+        yield
+    finally:
+        if refresher is not None:
+            refresher.cancel()
+        write_behind.stop()
+        for shard_engine in sharding.shard_engines:
+            shard_engine.dispose()
+        await database.dispose()
 
-@app.get("/amount_owed/")
-def get_amount_owed(user_email: str, db: Session = Depends(get_db)):
-    return crud.total_owed_by_the_user(db, user_email)
+def create_app():
+    """Builds the API: middleware, routes and the startup / shutdown lifespan."""
+    if database.ASYNC_MODE and sharding.ENABLED:
+        raise RuntimeError("DB_ASYNC does not support sharded group data; unset SHARD_DATABASE_URLS or DB_ASYNC")
+    for target in [engine] + database.replica_engines + sharding.shard_engines:
+        metrics.instrument(target)
 
-@app.get("/amount_owed_to_each_user/")
-def get_amount_owed_to_each_user(user_email: str, db: Session = Depends(get_db)):
-    return crud.owed_to_each_user(db, user_email)
+    app = FastAPI(lifespan=lifespan)
+    app.middleware("http")(metrics.metrics_middleware)
+    if database.ASYNC_MODE:
+        import async_routes
 
-@app.get("/amount_owed_in_each_group/")
-def get_amount_owed_to_each_group(user_email: str, db: Session = Depends(get_db)):
-    return crud.owed_in_each_group(db, user_email)
+        metrics.instrument(database.async_engine.sync_engine)
+        # included first, so these routes shadow their sync counterparts below;
+        # routes without an async version keep running on the sync session
+        app.include_router(async_routes.router)
+    app.include_router(router)
+    return app
 
-@app.get("/all_user_groups")
-def get_user_all_groups(user_email: str, db: Session = Depends(get_db)):
-    return crud.user_all_groups(db, user_email)
+app = create_app()
 
 if __name__ == "__main__":
     uvicorn.run(app, host="localhost", port=3000)
\ No newline at end of file
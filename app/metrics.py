@@ -0,0 +1,239 @@
+"""Hot-path instrumentation: per-route latency and SQL cost.
+
+`metrics_middleware` opens a `RequestStats` for every request and the engine
+hooks installed by `instrument` add each statement's count and duration to
+it, plus the rows each INSERT, UPDATE and DELETE affected. Rows a SELECT
+returns are not counted: `cursor.rowcount` is -1 for them on SQLite and on
+unbuffered cursors, and only the driver's buffer size on buffered ones.
+Once the response body has been sent, including the queries a streaming
+body runs as it goes, the totals are recorded per route and exposed in
+Prometheus text format by `render`.
+
+Set `SLOW_REQUEST_MS` to log requests slower than that, together with the
+statements they ran.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from cache import user_cache
+from versions import response_cache
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "0"))
+MAX_CAPTURED_STATEMENTS = 200
+
+
+class RequestStats:
+    """SQL work done on behalf of one request."""
+
+    __slots__ = ("captured", "db_seconds", "rows_written", "statements")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows_written = 0
+        self.captured = []
+
+
+_current = ContextVar("request_stats", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """A gauge whose value is read from `source` at render time."""
+
+    def __init__(self, name, help, source, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.source = source
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.source():
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket_labels = _labels(self.labels, labels, 'le="' + le + '"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, labels)} {count}")
+        return lines
+
+
+def _user_cache_stats():
+    for index, stats in user_cache.stats().items():
+        for field in ("hits", "misses", "evictions", "size"):
+            yield (index, field), stats[field]
+
+
+def _response_cache_stats():
+    stats = response_cache.stats()
+    for field in ("hits", "misses", "evictions", "size"):
+        yield (field,), stats[field]
+
+
+registry = []
+
+
+def register(metric):
+    registry.append(metric)
+    return metric
+
+
+requests_total = register(Counter(
+    "http_requests_total", "Requests served.", ("method", "route", "status")))
+request_seconds = register(Histogram(
+    "http_request_duration_seconds", "Request latency.", LATENCY_BUCKETS, ("method", "route")))
+request_statements = register(Histogram(
+    "http_request_sql_statements", "SQL statements executed per request.", STATEMENT_BUCKETS, ("method", "route")))
+request_db_seconds = register(Histogram(
+    "http_request_db_duration_seconds", "Time spent in the database per request.", LATENCY_BUCKETS, ("method", "route")))
+request_rows_written = register(Counter(
+    "http_request_db_rows_written_total", "Rows affected by INSERT, UPDATE and DELETE statements, as reported by the driver.", ("method", "route")))
+register(Gauge(
+    "user_cache", "User cache counters and size.", _user_cache_stats, ("index", "field")))
+register(Gauge(
+    "response_cache", "Conditional GET response cache counters and size.", _response_cache_stats, ("field",)))
+
+
+def render():
+    """Renders every registered metric in Prometheus text format."""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None or not conn.info.get("query_started"):
+        return
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats.statements += 1
+    stats.db_seconds += elapsed
+    if context is not None and (context.isinsert or context.isupdate or context.isdelete) and cursor.rowcount > 0:
+        stats.rows_written += cursor.rowcount
+    if SLOW_REQUEST_MS and len(stats.captured) < MAX_CAPTURED_STATEMENTS:
+        stats.captured.append((elapsed, " ".join(statement.split())))
+
+
+def instrument(engine):
+    """Attaches the statement hooks to `engine`; safe to call more than once."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+
+async def metrics_middleware(request, call_next):
+    stats = RequestStats()
+    token = _current.set(stats)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        _record(request, stats, 500, started)
+        raise
+    finally:
+        _current.reset(token)
+    # the body is sent after call_next returns, and a streaming one queries as it goes
+    response.body_iterator = _record_when_sent(response.body_iterator, request, stats, response.status_code, started)
+    return response
+
+
+async def _record_when_sent(body, request, stats, status, started):
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        _record(request, stats, status, started)
+
+
+def _record(request, stats, status, started):
+    elapsed = time.perf_counter() - started
+    route = request.scope.get("route")
+    path = getattr(route, "path", None) or "unmatched"
+    method = request.method
+    requests_total.inc(method, path, str(status))
+    request_seconds.observe(elapsed, method, path)
+    request_statements.observe(stats.statements, method, path)
+    request_db_seconds.observe(stats.db_seconds, method, path)
+    request_rows_written.inc(method, path, amount=stats.rows_written)
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        logger.warning(
+            "slow request %s %s: %.1fms, %d statements, %.1fms in db\n%s",
+            method, request.url.path, elapsed * 1000, stats.statements, stats.db_seconds * 1000,
+            "\n".join(f"  {duration * 1000:8.2f}ms {statement}" for duration, statement in stats.captured),
+        )
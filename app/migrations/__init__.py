@@ -0,0 +1,67 @@
+"""Versioned schema migrations.
+
+Each migration is a module named `m<version>_<slug>` that defines
+`description` and `upgrade(conn)`. Applied versions are recorded in the
+`schema_migrations` table, so `upgrade` only runs what is pending:
+
+    python -m migrations status
+    python -m migrations upgrade
+
+Migrations must describe the schema as it was when they were written, so
+they reflect tables from the connection instead of importing `models`.
+"""
+import importlib
+import pkgutil
+from datetime import UTC, datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, select
+
+metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def discover():
+    """Returns every migration module, ordered by version."""
+    found = []
+    for module in pkgutil.iter_modules(__path__):
+        if not module.name.startswith("m"):
+            continue
+        version = int(module.name[1:].split("_", 1)[0])
+        found.append((version, importlib.import_module(f"{__name__}.{module.name}")))
+    return sorted(found, key=lambda item: item[0])
+
+
+def applied_versions(conn):
+    schema_migrations.create(conn, checkfirst=True)
+    return {row.version for row in conn.execute(select(schema_migrations.c.version))}
+
+
+def pending(engine):
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    return [(version, module) for version, module in discover() if version not in done]
+
+
+def upgrade(engine):
+    """Applies pending migrations, each in its own transaction.
+
+    Returns:
+        list[int]: The versions that were applied.
+    """
+    applied = []
+    for version, module in pending(engine):
+        with engine.begin() as conn:
+            module.upgrade(conn)
+            conn.execute(schema_migrations.insert().values(
+                version=version,
+                description=module.description,
+                applied_at=datetime.now(UTC),
+            ))
+        applied.append(version)
+    return applied
@@ -0,0 +1,25 @@
+import argparse
+import sys
+
+import migrations
+from database import engine
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m migrations", description="Apply or list schema migrations.")
+    parser.add_argument("command", choices=["upgrade", "status"])
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        waiting = {version for version, _ in migrations.pending(engine)}
+        for version, module in migrations.discover():
+            state = "pending" if version in waiting else "applied"
+            print(f"{version:04d} {state:8} {module.description}")
+        return 0
+    applied = migrations.upgrade(engine)
+    print(f"applied {len(applied)} migration(s): {applied}" if applied else "schema is up to date")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
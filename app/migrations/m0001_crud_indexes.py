@@ -0,0 +1,51 @@
+"""Indexes and unique keys for the crud query patterns."""
+from sqlalchemy import Index, MetaData, Table, inspect, text
+
+description = "indexes on splits, expenses, groupmembers, friends and balances; unique group membership"
+
+INDEXES = [
+    ("splits", "ix_splits_expense_id", ["expense_id"]),
+    ("splits", "ix_splits_user_id", ["user_id", "expense_id"]),
+    ("expenses", "ix_expenses_created_by", ["created_by", "expense_id"]),
+    ("expenses", "ix_expenses_group_id", ["group_id"]),
+    ("groupmembers", "ix_groupmembers_user_id", ["groupmember_user_id"]),
+    ("friends", "ix_friends_friend_user_id", ["friend_user_id"]),
+    ("balances", "ix_balances_debtor_id", ["debtor_id", "creditor_id"]),
+]
+
+
+def _table(conn, name):
+    return Table(name, MetaData(), autoload_with=conn)
+
+
+def upgrade(conn):
+    existing_tables = set(inspect(conn).get_table_names())
+
+    for table_name, index_name, columns in INDEXES:
+        if table_name not in existing_tables:
+            continue
+        table = _table(conn, table_name)
+        Index(index_name, *(table.c[column] for column in columns)).create(conn, checkfirst=True)
+
+    if "groupmembers" in existing_tables:
+        # keep the earliest row of any duplicated membership so the unique key can be built
+        conn.execute(text(
+            "DELETE FROM groupmembers WHERE groupmember_id NOT IN ("
+            " SELECT keep_id FROM ("
+            "  SELECT MIN(groupmember_id) AS keep_id FROM groupmembers"
+            "  GROUP BY groupmember_group_id, groupmember_user_id"
+            " ) AS keep"
+            ")"
+        ))
+        table = _table(conn, "groupmembers")
+        unique_names = {uq["name"] for uq in inspect(conn).get_unique_constraints("groupmembers")}
+        index_names = {ix["name"] for ix in inspect(conn).get_indexes("groupmembers")}
+        if "uq_groupmembers_group_user" not in unique_names | index_names:
+            # a unique index is portable where ALTER TABLE ... ADD CONSTRAINT is not (SQLite)
+            Index(
+                "uq_groupmembers_group_user",
+                table.c.groupmember_group_id,
+                table.c.groupmember_user_id,
+                unique=True,
+            ).create(conn)
+
@@ -0,0 +1,11 @@
+"""Index for per-group ledger reads (settle-up plans)."""
+from sqlalchemy import Index, MetaData, Table, inspect
+
+description = "index balances by group_id"
+
+
+def upgrade(conn):
+    if "balances" not in inspect(conn).get_table_names():
+        return
+    table = Table("balances", MetaData(), autoload_with=conn)
+    Index("ix_balances_group_id", table.c.group_id).create(conn, checkfirst=True)
@@ -0,0 +1,25 @@
+"""Global tables used when group data is sharded: the group directory and hi/lo id blocks."""
+from datetime import UTC, datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+
+description = "group_shards directory and id_blocks for sharded group data"
+
+metadata = MetaData()
+Table(
+    "group_shards",
+    metadata,
+    Column("group_id", Integer, primary_key=True),
+    Column("shard", Integer, nullable=True),
+    Column("created_at", DateTime, default=lambda: datetime.now(UTC)),
+)
+Table(
+    "id_blocks",
+    metadata,
+    Column("name", String(64), primary_key=True),
+    Column("next_id", Integer, nullable=False),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn, checkfirst=True)
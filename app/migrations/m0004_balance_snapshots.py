@@ -0,0 +1,45 @@
+"""Point-in-time balance snapshots and the expenses.created_at index their replay uses."""
+from datetime import UTC, datetime
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    Table,
+    UniqueConstraint,
+    inspect,
+)
+
+description = "balance_snapshots, balance_snapshot_rows and an index on expenses.created_at"
+
+metadata = MetaData()
+Table(
+    "balance_snapshots",
+    metadata,
+    Column("taken_at", DateTime, primary_key=True),
+    Column("row_count", Integer, nullable=False, default=0),
+    Column("created_at", DateTime, default=lambda: datetime.now(UTC)),
+)
+Table(
+    "balance_snapshot_rows",
+    metadata,
+    Column("snapshot_row_id", Integer, primary_key=True),
+    Column("taken_at", DateTime, ForeignKey("balance_snapshots.taken_at"), nullable=False),
+    Column("creditor_id", Integer, nullable=False),
+    Column("debtor_id", Integer, nullable=False),
+    Column("group_id", Integer, nullable=False, default=0),
+    Column("amount", Float, nullable=False),
+    UniqueConstraint("taken_at", "creditor_id", "debtor_id", "group_id", name="uq_balance_snapshot_rows_pair"),
+    Index("ix_balance_snapshot_rows_debtor_id", "taken_at", "debtor_id"),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn, checkfirst=True)
+    if "expenses" in inspect(conn).get_table_names():
+        expenses = Table("expenses", MetaData(), autoload_with=conn)
+        Index("ix_expenses_created_at", expenses.c.created_at).create(conn, checkfirst=True)
@@ -0,0 +1,69 @@
+"""Archive tables for settled expenses and the balances carried forward for them."""
+from datetime import UTC, datetime
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    UniqueConstraint,
+    inspect,
+)
+
+description = "expenses_archive, splits_archive and balances_carried for archived expenses"
+
+
+def upgrade(conn):
+    existing = set(inspect(conn).get_table_names())
+    metadata = MetaData()
+    # the archive keeps the foreign keys of expenses and splits where their targets exist
+    for name in ("users", "bunch"):
+        if name in existing:
+            Table(name, metadata, autoload_with=conn)
+
+    def fk(target):
+        return [ForeignKey(target)] if target.split(".")[0] in metadata.tables else []
+
+    Table(
+        "expenses_archive",
+        metadata,
+        Column("expense_id", Integer, primary_key=True, autoincrement=False),
+        Column("created_by", Integer, *fk("users.user_id"), nullable=False),
+        Column("group_id", Integer, *fk("bunch.group_id"), nullable=True),
+        Column("description", String(255), nullable=False),
+        Column("amount", Float, nullable=False),
+        Column("created_at", DateTime),
+        Column("archived_at", DateTime, default=lambda: datetime.now(UTC)),
+        Index("ix_expenses_archive_created_by", "created_by", "expense_id"),
+        Index("ix_expenses_archive_group_id", "group_id"),
+        Index("ix_expenses_archive_created_at", "created_at"),
+    )
+    Table(
+        "splits_archive",
+        metadata,
+        Column("split_id", Integer, primary_key=True),
+        Column("expense_id", Integer, ForeignKey("expenses_archive.expense_id"), nullable=False),
+        Column("user_id", Integer, *fk("users.user_id"), nullable=False),
+        Column("amount", Float, nullable=False),
+        Column("created_at", DateTime),
+        Index("ix_splits_archive_expense_id", "expense_id"),
+        Index("ix_splits_archive_user_id", "user_id", "expense_id"),
+    )
+    Table(
+        "balances_carried",
+        metadata,
+        Column("balance_id", Integer, primary_key=True),
+        Column("creditor_id", Integer, *fk("users.user_id"), nullable=False),
+        Column("debtor_id", Integer, *fk("users.user_id"), nullable=False),
+        Column("group_id", Integer, nullable=False, default=0),
+        Column("amount", Float, nullable=False, default=0),
+        Column("updated_at", DateTime, default=lambda: datetime.now(UTC)),
+        UniqueConstraint("creditor_id", "debtor_id", "group_id", name="uq_balances_carried_pair"),
+        Index("ix_balances_carried_group_id", "group_id"),
+    )
+    metadata.create_all(conn, tables=[metadata.tables[name] for name in ("expenses_archive", "splits_archive", "balances_carried")], checkfirst=True)
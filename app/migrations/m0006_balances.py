@@ -0,0 +1,76 @@
+"""The pairwise balance ledger, filled from the splits already recorded."""
+from datetime import UTC, datetime
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    Table,
+    UniqueConstraint,
+    func,
+    insert,
+    inspect,
+    select,
+    union_all,
+)
+
+description = "balances ledger with uq_balances_pair, ix_balances_debtor_id and ix_balances_group_id, filled from splits"
+
+NO_GROUP = 0
+
+
+def upgrade(conn):
+    existing = set(inspect(conn).get_table_names())
+    if "balances" in existing:
+        # created by DB_CREATE_SCHEMA or table_creation.sql, and kept current by the app since
+        return
+    metadata = MetaData()
+    for name in ("users", "expenses", "splits", "balances_carried"):
+        if name in existing:
+            Table(name, metadata, autoload_with=conn)
+
+    def fk(target):
+        return [ForeignKey(target)] if target.split(".")[0] in metadata.tables else []
+
+    balances = Table(
+        "balances",
+        metadata,
+        Column("balance_id", Integer, primary_key=True),
+        Column("creditor_id", Integer, *fk("users.user_id"), nullable=False),
+        Column("debtor_id", Integer, *fk("users.user_id"), nullable=False),
+        Column("group_id", Integer, nullable=False, default=0),
+        Column("amount", Float, nullable=False, default=0),
+        Column("updated_at", DateTime, default=lambda: datetime.now(UTC)),
+        UniqueConstraint("creditor_id", "debtor_id", "group_id", name="uq_balances_pair"),
+        Index("ix_balances_debtor_id", "debtor_id", "creditor_id"),
+        Index("ix_balances_group_id", "group_id"),
+    )
+    balances.create(conn)
+
+    # the same aggregate as `ledger.rebuild`: live splits plus balances carried for archived expenses
+    parts = []
+    if "expenses" in metadata.tables and "splits" in metadata.tables:
+        expenses, splits = metadata.tables["expenses"], metadata.tables["splits"]
+        parts.append(
+            select(
+                expenses.c.created_by.label("creditor_id"),
+                splits.c.user_id.label("debtor_id"),
+                func.coalesce(expenses.c.group_id, NO_GROUP).label("group_id"),
+                splits.c.amount.label("amount"),
+            ).join(expenses, expenses.c.expense_id == splits.c.expense_id)
+        )
+    if "balances_carried" in metadata.tables:
+        carried = metadata.tables["balances_carried"]
+        parts.append(select(carried.c.creditor_id, carried.c.debtor_id, carried.c.group_id, carried.c.amount))
+    if not parts:
+        return
+    rows = (union_all(*parts) if len(parts) > 1 else parts[0]).subquery()
+    conn.execute(insert(balances).from_select(
+        ["creditor_id", "debtor_id", "group_id", "amount"],
+        select(rows.c.creditor_id, rows.c.debtor_id, rows.c.group_id, func.sum(rows.c.amount))
+        .group_by(rows.c.creditor_id, rows.c.debtor_id, rows.c.group_id),
+    ))
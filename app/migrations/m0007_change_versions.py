@@ -0,0 +1,16 @@
+"""Per-user and per-group change versions, read by ETags and the settle-up plan cache."""
+from sqlalchemy import Column, Integer, MetaData, String, Table
+
+description = "change_versions for ETags and settle-up plans"
+
+metadata = MetaData()
+Table(
+    "change_versions",
+    metadata,
+    Column("name", String(64), primary_key=True),
+    Column("version", Integer, nullable=False, default=0),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn, checkfirst=True)
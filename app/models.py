@@ -1,10 +1,20 @@
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float
-from datetime import datetime, timezone
-from sqlalchemy.orm import relationship, declarative_base
+from datetime import UTC, datetime
 
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    UniqueConstraint,
+)
+from sqlalchemy.orm import relationship
+
+from database import Base
 
-Base = declarative_base()
 
 class User(Base):
     __tablename__ = "users"
@@ -12,22 +22,23 @@ class User(Base):
     first_name = Column(String(255), nullable=False)
     last_name = Column(String(255), nullable=False)
     email = Column(String(255), nullable=False, unique=True)
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC))
 
 class Friends(Base):
     __tablename__ = "friends"
     user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
     friend_user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
-    added_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    added_at = Column(DateTime, default=lambda: datetime.now(UTC))
     user = relationship("User", foreign_keys=[user_id])
     friend = relationship("User", foreign_keys=[friend_user_id])
+    __table_args__ = (Index("ix_friends_friend_user_id", "friend_user_id"),)
 
 class Groups(Base):
     __tablename__ = "bunch"
     group_id = Column(Integer, primary_key=True, index=True)
     group_name = Column(String(255), nullable=False)
     created_by  = Column(Integer, ForeignKey("users.user_id"), nullable=False)
-    created_at   = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at   = Column(DateTime, default=lambda: datetime.now(UTC))
     user = relationship("User", foreign_keys=[created_by])
 
 class GroupMembers(Base):
@@ -36,10 +47,14 @@ class GroupMembers(Base):
     groupmember_user_id = Column(Integer, ForeignKey("users.user_id"))
     groupmember_group_id = Column(Integer, ForeignKey("bunch.group_id"))
     added_by  = Column(Integer, ForeignKey("users.user_id"), nullable=False)
-    added_at   = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    added_at   = Column(DateTime, default=lambda: datetime.now(UTC))
     groupmember = relationship("Groups", foreign_keys=[groupmember_group_id])
     user = relationship("User", foreign_keys=[groupmember_user_id])
     added = relationship("User", foreign_keys=[added_by])
+    __table_args__ = (
+        UniqueConstraint("groupmember_group_id", "groupmember_user_id", name="uq_groupmembers_group_user"),
+        Index("ix_groupmembers_user_id", "groupmember_user_id"),
+    )
 
 class Expenses(Base):
     __tablename__ = "expenses"
@@ -48,9 +63,14 @@ class Expenses(Base):
     group_id = Column(Integer, ForeignKey("bunch.group_id"), nullable=True)
     description = Column(String(255), nullable=False)
     amount = Column(Float, nullable=False)
-    created_at  = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at  = Column(DateTime, default=lambda: datetime.now(UTC))
     user = relationship("User", foreign_keys=[created_by])
     group = relationship("Groups", foreign_keys=[group_id])
+    __table_args__ = (
+        Index("ix_expenses_created_by", "created_by", "expense_id"),
+        Index("ix_expenses_group_id", "group_id"),
+        Index("ix_expenses_created_at", "created_at"),
+    )
 
 class Splits(Base):
     __tablename__ = "splits"
@@ -58,7 +78,129 @@ class Splits(Base):
     expense_id = Column(Integer, ForeignKey("expenses.expense_id"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     amount = Column(Float, nullable=False)
-    created_at   = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at   = Column(DateTime, default=lambda: datetime.now(UTC))
     expense = relationship("Expenses", foreign_keys=[expense_id])
     user = relationship("User", foreign_keys=[user_id])
+    __table_args__ = (
+        Index("ix_splits_expense_id", "expense_id"),
+        Index("ix_splits_user_id", "user_id", "expense_id"),
+    )
+
+class Balances(Base):
+    """Running total of what `debtor_id` owes `creditor_id` inside `group_id`.
+
+    Maintained by `ledger.apply` in the same transaction as the splits it is
+    derived from. Expenses outside a group are kept under group_id 0, and a
+    user's share of their own expense is kept as a creditor == debtor row so
+    per-group spend can be read without touching `splits`.
+    """
+    __tablename__ = "balances"
+    balance_id = Column(Integer, primary_key=True)
+    creditor_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    debtor_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    group_id = Column(Integer, nullable=False, default=0)
+    amount = Column(Float, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC))
+    __table_args__ = (
+        UniqueConstraint("creditor_id", "debtor_id", "group_id", name="uq_balances_pair"),
+        Index("ix_balances_debtor_id", "debtor_id", "creditor_id"),
+        Index("ix_balances_group_id", "group_id"),
+    )
+
+class ExpenseArchive(Base):
+    """An expense moved out of `expenses` by `archive`, keeping its expense_id."""
+    __tablename__ = "expenses_archive"
+    expense_id = Column(Integer, primary_key=True, autoincrement=False)
+    created_by = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    group_id = Column(Integer, ForeignKey("bunch.group_id"), nullable=True)
+    description = Column(String(255), nullable=False)
+    amount = Column(Float, nullable=False)
+    created_at = Column(DateTime)
+    archived_at = Column(DateTime, default=lambda: datetime.now(UTC))
+    __table_args__ = (
+        Index("ix_expenses_archive_created_by", "created_by", "expense_id"),
+        Index("ix_expenses_archive_group_id", "group_id"),
+        Index("ix_expenses_archive_created_at", "created_at"),
+    )
+
+class SplitArchive(Base):
+    __tablename__ = "splits_archive"
+    split_id = Column(Integer, primary_key=True)
+    expense_id = Column(Integer, ForeignKey("expenses_archive.expense_id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    amount = Column(Float, nullable=False)
+    created_at = Column(DateTime)
+    __table_args__ = (
+        Index("ix_splits_archive_expense_id", "expense_id"),
+        Index("ix_splits_archive_user_id", "user_id", "expense_id"),
+    )
+
+class CarriedBalance(Base):
+    """What the archived splits of (creditor, debtor, group) add up to.
+
+    `balances` keeps counting archived expenses, so only `ledger rebuild`
+    and `ledger verify` read these rows, in place of the splits that were
+    moved out of `splits`.
+    """
+    __tablename__ = "balances_carried"
+    balance_id = Column(Integer, primary_key=True)
+    creditor_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    debtor_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    group_id = Column(Integer, nullable=False, default=0)
+    amount = Column(Float, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC))
+    __table_args__ = (
+        UniqueConstraint("creditor_id", "debtor_id", "group_id", name="uq_balances_carried_pair"),
+        Index("ix_balances_carried_group_id", "group_id"),
+    )
+
+class BalanceSnapshot(Base):
+    """A point-in-time copy of the ledger, written by `snapshots.compact`.
+
+    It covers the splits of every expense created at or before `taken_at`.
+    """
+    __tablename__ = "balance_snapshots"
+    taken_at = Column(DateTime, primary_key=True)
+    row_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC))
+
+class BalanceSnapshotRow(Base):
+    """What `debtor_id` owed `creditor_id` inside `group_id` as of the snapshot at `taken_at`."""
+    __tablename__ = "balance_snapshot_rows"
+    snapshot_row_id = Column(Integer, primary_key=True)
+    taken_at = Column(DateTime, ForeignKey("balance_snapshots.taken_at"), nullable=False)
+    creditor_id = Column(Integer, nullable=False)
+    debtor_id = Column(Integer, nullable=False)
+    group_id = Column(Integer, nullable=False, default=0)
+    amount = Column(Float, nullable=False)
+    __table_args__ = (
+        UniqueConstraint("taken_at", "creditor_id", "debtor_id", "group_id", name="uq_balance_snapshot_rows_pair"),
+        Index("ix_balance_snapshot_rows_debtor_id", "taken_at", "debtor_id"),
+    )
+
+class GroupShard(Base):
+    """Directory of group placements when group data is sharded (see `sharding`).
+
+    Lives in the global database and hands out group ids for every shard.
+    A NULL shard means the group's rows are still in the global database.
+    """
+    __tablename__ = "group_shards"
+    group_id = Column(Integer, primary_key=True)
+    shard = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC))
+
+class IdBlock(Base):
+    """High-water mark of a hi/lo id sequence shared by the global database and every shard."""
+    __tablename__ = "id_blocks"
+    name = Column(String(64), primary_key=True)
+    next_id = Column(Integer, nullable=False)
+
+class ChangeVersion(Base):
+    """Change counter behind ETags and cached plans (see `versions`).
 
+    Lives in the global database. `name` is "user:<id>", "group:<id>" or
+    "epoch"; a missing row means version 0.
+    """
+    __tablename__ = "change_versions"
+    name = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,97 @@
+"""Checks that every crud read query is served by an index.
+
+Runs the crud read paths for one user against the configured database,
+captures the SELECT statements they issue and asks the database for each
+statement's plan. Any plan step that scans a whole table is reported and the
+script exits non-zero:
+
+    python query_plans.py --email someone@example.com
+"""
+import argparse
+import sys
+
+from sqlalchemy import event
+
+import crud
+import models
+from cache import user_cache
+from database import SessionLocal, engine
+
+
+def capture(run):
+    """Runs `run()` and returns the (statement, parameters) of every SELECT it issued."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        run()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def explain(conn, statement, parameters):
+    """Returns (plan lines, full scan lines) for one statement."""
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+        lines = [row[-1] for row in rows]
+        scans = [line for line in lines if line.startswith("SCAN") and "INDEX" not in line]
+        return lines, scans
+    rows = conn.exec_driver_sql("EXPLAIN " + statement, parameters).mappings().all()
+    lines = [f"{row['table']}: type={row['type']} key={row['key']}" for row in rows]
+    scans = [f"{row['table']}: full scan" for row in rows if row["type"] == "ALL"]
+    return lines, scans
+
+
+def crud_reads(db, user):
+    """The crud read paths whose queries must be index-backed."""
+    group = db.query(models.GroupMembers.groupmember_group_id).filter(models.GroupMembers.groupmember_user_id == user.user_id).first()
+    return [
+        ("get_user", lambda: crud.get_user(db, user.email)),
+        ("get_user_by_id", lambda: crud.get_user_by_id(db, user.user_id)),
+        ("get_group", lambda: crud.get_group(db, group[0] if group else 1)),
+        ("get_all_expenses", lambda: crud.get_all_expenses(db, user.email, limit=50, after=0)),
+        ("total_owed_by_the_user", lambda: crud.total_owed_by_the_user(db, user.email)),
+        ("owed_to_each_user", lambda: crud.owed_to_each_user(db, user.email)),
+        ("owed_in_each_group", lambda: crud.owed_in_each_group(db, user.email)),
+        ("user_all_groups", lambda: crud.user_all_groups(db, user.email)),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fail if a crud read query needs a full table scan.")
+    parser.add_argument("--email", help="user to run the queries for (defaults to the first user)")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        if args.email:
+            user = db.query(models.User).filter(models.User.email == args.email).first()
+        else:
+            user = db.query(models.User).order_by(models.User.user_id).first()
+        if user is None:
+            print("no user to run the queries for")
+            return 1
+        failures = 0
+        with engine.connect() as conn:
+            for name, run in crud_reads(db, user):
+                user_cache.clear()
+                db.info.clear()
+                for statement, parameters in capture(run):
+                    lines, scans = explain(conn, statement, parameters)
+                    print(f"[{'FULL SCAN' if scans else 'ok'}] {name}: {' '.join(statement.split())}")
+                    for line in lines:
+                        print(f"    {line}")
+                    failures += len(scans)
+        print(f"{failures} full table scan(s)")
+        return 1 if failures else 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,8 @@
-from pydantic import BaseModel
-from typing import List
 from datetime import datetime
 
+from pydantic import BaseModel
+
+
 class UserBase(BaseModel):
     first_name: str
     last_name: str
@@ -32,6 +33,15 @@ class Friend(BaseModel):
     class Config:
         orm_mode = True
 
+class FriendSummary(BaseModel):
+    user_id: int
+    first_name: str | None
+    email: str | None
+
+class FriendSuggestion(FriendSummary):
+    mutual_friends: int
+    shared_groups: int
+
 class GroupCreate(BaseModel):
     group_name: str
     created_by: str
@@ -53,7 +63,13 @@ class GroupMemberAdd(GroupMemberBase):
     added_by: str
 
 class GroupMember(GroupMemberBase):
+    """Response of POST /addmembertogroup/.
+
+    Carries groupmember_user_email as the request did, plus
+    groupmember_user_id, which was added next to it.
+    """
     groupmember_id: int
+    groupmember_user_id: int
     added_by: int
     added_at: datetime
     
@@ -67,7 +83,7 @@ class ExpenseBase(BaseModel):
 class ExpenseCreate(ExpenseBase):
     group_id: str | None
     created_by: str
-    users: List[str]
+    users: list[str]
 
 class Expense(ExpenseBase):
     group_id: int | None
@@ -92,4 +108,41 @@ class Split(SplitBase):
     created_at: datetime
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class Transfer(BaseModel):
+    from_user_id: int
+    from_name: str | None
+    to_user_id: int
+    to_name: str | None
+    amount: float
+
+class SettlePlan(BaseModel):
+    group_id: int
+    transfers: list[Transfer]
+
+class AmountOwed(BaseModel):
+    you_owe: float
+    owed_to_you: float
+    net: float
+
+class UserBalance(BaseModel):
+    user_id: int
+    first_name: str | None
+    amount: float
+
+class GroupBalance(BaseModel):
+    group_id: int
+    group_name: str | None
+    amount: float
+
+class GroupSummary(BaseModel):
+    group_id: int
+    group_name: str
+
+class Dashboard(BaseModel):
+    user_id: int
+    amount_owed: AmountOwed | None = None
+    owed_to_each_user: list[UserBalance] | None = None
+    owed_in_each_group: list[GroupBalance] | None = None
+    groups: list[GroupSummary] | None = None
@@ -0,0 +1,119 @@
+"""Debt simplification: a short list of transfers that settles a group.
+
+A member's net position is what the rest of the group owes them minus what
+they owe the rest of the group, read from the group's ledger rows (one per
+pair of members, however many expenses the group has). The plan repeatedly
+matches the largest creditor with the largest debtor, which settles at
+least one of them per transfer and so needs at most n - 1 transfers. That
+bound is not the minimum: finding the fewest transfers is NP-hard (it
+means finding the most subgroups whose debts cancel out), so the greedy
+plan can be longer than the best one.
+
+Plans are cached per group and group version (see `versions`), so adding
+an expense to the group, in any process, makes the next request compute a
+new plan.
+"""
+import heapq
+import os
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+import sharding
+import versions
+from cache import LRUCache
+from loaders import user_loader
+
+plan_cache = LRUCache(
+    maxsize=int(os.environ.get("SETTLE_CACHE_SIZE", "1000")),
+    ttl=float(os.environ.get("SETTLE_CACHE_TTL", "86400")),
+)
+
+
+def net_positions(db: Session, group_id):
+    """Returns {user_id: net amount}; positive means the group owes the user."""
+    net = {}
+    credits = db.query(models.Balances.creditor_id, func.sum(models.Balances.amount)).filter(
+        models.Balances.group_id == group_id,
+        models.Balances.creditor_id != models.Balances.debtor_id,
+    ).group_by(models.Balances.creditor_id)
+    for user_id, amount in credits:
+        net[user_id] = net.get(user_id, 0.0) + amount
+    debits = db.query(models.Balances.debtor_id, func.sum(models.Balances.amount)).filter(
+        models.Balances.group_id == group_id,
+        models.Balances.creditor_id != models.Balances.debtor_id,
+    ).group_by(models.Balances.debtor_id)
+    for user_id, amount in debits:
+        net[user_id] = net.get(user_id, 0.0) - amount
+    return net
+
+
+def minimize_transfers(net):
+    """Greedy min-cash-flow over net positions, in whole cents: at most n - 1 transfers.
+
+    The positions are rounded to cents once. Whatever rounding leaves over,
+    so that the cents no longer sum to zero, goes to the largest position,
+    so every creditor and debtor is settled exactly.
+
+    Args:
+        net (dict): {user_id: net amount}, positive for creditors.
+
+    Returns:
+        list[tuple[int, int, int]]: (from_user_id, to_user_id, cents).
+    """
+    rounded = {user_id: round(amount * 100) for user_id, amount in net.items()}
+    leftover = -sum(rounded.values())
+    if leftover and rounded:
+        largest = max(rounded, key=lambda user_id: (abs(rounded[user_id]), user_id))
+        rounded[largest] += leftover
+    creditors = []
+    debtors = []
+    for user_id, cents in rounded.items():
+        if cents > 0:
+            creditors.append((-cents, user_id))
+        elif cents < 0:
+            debtors.append((cents, user_id))
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debit, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debit)
+        transfers.append((debtor, creditor, amount))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debit > amount:
+            heapq.heappush(debtors, (debit + amount, debtor))
+    return transfers
+
+
+def settle_up_plan(db: Session, group_id):
+    """Returns the cached plan for `group_id`, computing it on a miss.
+
+    `db` is a session on the global database, where the group's version is read.
+    """
+    key = (group_id, versions.current(db, group_id=group_id))
+    plan = plan_cache.get(key)
+    if plan is not None:
+        return plan
+    with sharding.group_session(db, group_id) as group_db:
+        transfers = minimize_transfers(net_positions(group_db, group_id))
+    users = user_loader(db).load_many({user_id for debtor, creditor, _ in transfers for user_id in (debtor, creditor)})
+    plan = {
+        "group_id": group_id,
+        "transfers": [
+            {
+                "from_user_id": debtor,
+                "from_name": users[debtor].first_name if users[debtor] else None,
+                "to_user_id": creditor,
+                "to_name": users[creditor].first_name if users[creditor] else None,
+                "amount": cents / 100,
+            }
+            for debtor, creditor, cents in transfers
+        ],
+    }
+    plan_cache.set(key, plan)
+    return plan
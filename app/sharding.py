@@ -0,0 +1,415 @@
+"""Horizontal sharding of group data by group_id.
+
+`users`, `friends` and expenses outside any group always live in the global
+database (DATABASE_URL). When SHARD_DATABASE_URLS is set, every new group
+goes to one of those shard databases, along with its members, its expenses,
+their splits and its ledger rows:
+
+- `group_shards`, in the global database, is the directory. It allocates
+  group ids and records which shard holds each group. Groups created before
+  sharding are registered with a NULL shard and stay in the global database
+  until they are moved.
+- Expense ids come from a hi/lo allocator backed by `id_blocks`. This keeps
+  them unique across all databases, so keyset pages merge cleanly. The
+  allocator is used without shards too, so a batch of expenses knows its
+  ids before the INSERT and goes in as one executemany.
+- Per-user reads run on the global database and every shard in parallel
+  through `fan_out`, and the caller merges the partial results.
+
+Shards are created without foreign keys to the global tables. Moving a group
+is an offline operation, so stop the app first:
+
+    python sharding.py init
+    python sharding.py status
+    python sharding.py move-group 42 1
+
+Without SHARD_DATABASE_URLS, every session helper here falls through to the
+caller's session.
+"""
+import argparse
+import contextvars
+import itertools
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, delete, func, insert, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateTable
+
+import database
+import models
+import versions
+from cache import LRUCache
+
+# Comma-separated URLs of the shard databases; a group's shard is its index here.
+SHARD_DATABASE_URLS = [url.strip() for url in os.environ.get("SHARD_DATABASE_URLS", "").split(",") if url.strip()]
+shard_engines = [create_engine(url, **database.engine_options(url)) for url in SHARD_DATABASE_URLS]
+ENABLED = bool(shard_engines)
+
+# Tables whose rows live with their group, in insert order.
+SHARDED_TABLES = [
+    models.Groups.__table__,
+    models.GroupMembers.__table__,
+    models.Expenses.__table__,
+    models.Splits.__table__,
+    models.Balances.__table__,
+    models.BalanceSnapshotRow.__table__,
+    models.ExpenseArchive.__table__,
+    models.SplitArchive.__table__,
+    models.CarriedBalance.__table__,
+]
+
+# Tables every shard keeps for its own rows, created alongside SHARDED_TABLES.
+SHARD_LOCAL_TABLES = [
+    models.BalanceSnapshot.__table__,
+]
+
+ID_BLOCK_SIZE = int(os.environ.get("SHARD_ID_BLOCK_SIZE", "1000"))
+
+# group_id -> (shard,). Placements only change through the offline move tool.
+_directory = LRUCache(
+    maxsize=int(os.environ.get("SHARD_DIRECTORY_CACHE_SIZE", "100000")),
+    ttl=float(os.environ.get("SHARD_DIRECTORY_CACHE_TTL", "3600")),
+)
+_placement = itertools.count()
+# `fan_out` serves every request at once, so it gets a thread per connection
+# the shard pools can hand out; more threads would only wait on the pools.
+FAN_OUT_WORKERS = int(os.environ.get("SHARD_FAN_OUT_WORKERS", len(shard_engines) * (database.POOL_SIZE + database.MAX_OVERFLOW)))
+_executor = ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS, thread_name_prefix="shard") if ENABLED else None
+
+
+def create_shard_schema(engine):
+    """Creates the group tables on a shard, keeping only the foreign keys between them."""
+    tables = SHARD_LOCAL_TABLES + SHARDED_TABLES
+    local = {table.name for table in tables}
+    with engine.begin() as conn:
+        existing = set(inspect(conn).get_table_names())
+        for table in tables:
+            if table.name in existing:
+                continue
+            foreign_keys = [fk for fk in table.foreign_key_constraints if fk.referred_table.name in local]
+            conn.execute(CreateTable(table, include_foreign_key_constraints=foreign_keys))
+            for index in table.indexes:
+                index.create(conn)
+
+
+def create_shard_schemas():
+    for engine in shard_engines:
+        create_shard_schema(engine)
+
+
+@contextmanager
+def shard_session(shard):
+    """Opens a session on shard `shard`; None means the global database."""
+    session = database.SessionLocal(bind=database.engine if shard is None else shard_engines[shard])
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def shard_for(db: Session, group_id):
+    """Returns the shard holding `group_id`, or None for the global database.
+
+    Unknown groups also map to None, so lookups against the global database
+    report them as missing.
+    """
+    if not ENABLED or group_id is None:
+        return None
+    cached = _directory.get(group_id)
+    if cached is not None:
+        return cached[0]
+    row = db.query(models.GroupShard.shard).filter(models.GroupShard.group_id == group_id).first()
+    if row is None:
+        return None
+    _directory.set(group_id, (row[0],))
+    return row[0]
+
+
+@contextmanager
+def session_on(db: Session, shard):
+    """Yields `db` for the global database (shard None), or a new session on `shard`."""
+    if shard is None:
+        yield db
+        return
+    with shard_session(shard) as session:
+        yield session
+
+
+def group_session(db: Session, group_id):
+    """Returns a context manager for the session holding `group_id`'s rows; `db` unless the group is on a shard."""
+    return session_on(db, shard_for(db, group_id))
+
+
+def allocate_group(db: Session):
+    """Reserves a group id in the directory and places the group on a shard.
+
+    Returns:
+        int | None: The new group id, or None when sharding is off and the
+        group table's own autoincrement should be used.
+    """
+    if not ENABLED:
+        return None
+    entry = models.GroupShard(shard=next(_placement) % len(shard_engines))
+    db.add(entry)
+    db.flush()
+    group_id, shard = entry.group_id, entry.shard
+    db.commit()
+    _directory.set(group_id, (shard,))
+    return group_id
+
+
+def release_group(db: Session, group_id):
+    """Deletes a directory entry from `allocate_group` whose group was never written to its shard."""
+    if group_id is None:
+        return
+    db.execute(delete(models.GroupShard).where(models.GroupShard.group_id == group_id))
+    db.commit()
+    _directory.invalidate(group_id)
+
+
+def fan_out(db: Session, fn):
+    """Calls `fn(session)` on the global database and, in parallel, on every shard.
+
+    `fn` runs on `db` in the calling thread and on a session of its own for
+    each shard, so it must not touch `db` itself.
+
+    Returns:
+        list: The results, global database first, then shards in order.
+    """
+    if not ENABLED:
+        return [fn(db)]
+    futures = [
+        _executor.submit(contextvars.copy_context().run, _on_shard, shard, fn)
+        for shard in range(len(shard_engines))
+    ]
+    results = [fn(db)]
+    return results + [future.result() for future in futures]
+
+
+def _on_shard(shard, fn):
+    with shard_session(shard) as session:
+        return fn(session)
+
+
+def all_shards():
+    """Every database that may hold group data: None for the global database, then each shard."""
+    return [None] + list(range(len(shard_engines)))
+
+
+class HiLoAllocator:
+    """Hands out ids from blocks reserved in `id_blocks`, one round trip per block.
+
+    Args:
+        name (str): The sequence's row in `id_blocks`.
+        floor (Callable[[], int]): Lowest id the sequence may start at; only
+            called the first time the sequence is used.
+        block_size (int): Ids reserved per round trip.
+    """
+
+    def __init__(self, name, floor, block_size=ID_BLOCK_SIZE):
+        self.name = name
+        self.floor = floor
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def allocate(self, count):
+        ids = []
+        with self._lock:
+            while len(ids) < count:
+                if self._next >= self._end:
+                    self._next, self._end = self._reserve(max(self.block_size, count - len(ids)))
+                take = min(count - len(ids), self._end - self._next)
+                ids.extend(range(self._next, self._next + take))
+                self._next += take
+        return ids
+
+    def _reserve(self, size):
+        """Claims [start, start + size) in a transaction of its own on the global database."""
+        table = models.IdBlock.__table__
+        for attempt in range(2):
+            try:
+                with database.engine.begin() as conn:
+                    moved = conn.execute(
+                        update(table).where(table.c.name == self.name).values(next_id=table.c.next_id + size)
+                    ).rowcount
+                    if not moved:
+                        conn.execute(insert(table).values(name=self.name, next_id=self.floor() + size))
+                    end = conn.execute(select(table.c.next_id).where(table.c.name == self.name)).scalar()
+                return end - size, end
+            except IntegrityError:
+                # another process created the sequence first; the update wins on retry
+                if attempt:
+                    raise
+
+
+def _expense_floor():
+    highest = 0
+    for shard in all_shards():
+        with shard_session(shard) as session:
+            # archived expenses keep their ids, so new ones must start above those too
+            for model in (models.Expenses, models.ExpenseArchive):
+                highest = max(highest, session.query(func.coalesce(func.max(model.expense_id), 0)).scalar())
+    return highest + 1
+
+
+expense_id_allocator = HiLoAllocator("expenses", _expense_floor)
+
+
+def expense_ids(count):
+    """Returns `count` new expense ids, unique across every database."""
+    return expense_id_allocator.allocate(count)
+
+
+def register_existing_groups():
+    """Adds every group already in the global database to the directory with a NULL shard.
+
+    Returns:
+        int: The number of groups registered.
+    """
+    with database.SessionLocal() as db:
+        known = select(models.GroupShard.group_id)
+        group_ids = [row[0] for row in db.query(models.Groups.group_id).filter(models.Groups.group_id.not_in(known))]
+        if group_ids:
+            db.execute(insert(models.GroupShard), [{"group_id": group_id, "shard": None} for group_id in group_ids])
+            db.commit()
+    return len(group_ids)
+
+
+def _group_filters(group_id):
+    expense_ids = select(models.Expenses.expense_id).where(models.Expenses.group_id == group_id)
+    archived_ids = select(models.ExpenseArchive.expense_id).where(models.ExpenseArchive.group_id == group_id)
+    return {
+        "bunch": models.Groups.group_id == group_id,
+        "groupmembers": models.GroupMembers.groupmember_group_id == group_id,
+        "expenses": models.Expenses.group_id == group_id,
+        "splits": models.Splits.expense_id.in_(expense_ids),
+        "balances": models.Balances.group_id == group_id,
+        "balance_snapshot_rows": models.BalanceSnapshotRow.group_id == group_id,
+        "expenses_archive": models.ExpenseArchive.group_id == group_id,
+        "splits_archive": models.SplitArchive.expense_id.in_(archived_ids),
+        "balances_carried": models.CarriedBalance.group_id == group_id,
+    }
+
+
+# Surrogate keys that are only unique within one database and are reassigned on copy.
+_LOCAL_KEYS = {
+    "groupmembers": "groupmember_id",
+    "splits": "split_id",
+    "balances": "balance_id",
+    "balance_snapshot_rows": "snapshot_row_id",
+    "splits_archive": "split_id",
+    "balances_carried": "balance_id",
+}
+
+
+def _read_group(conn, group_id):
+    filters = _group_filters(group_id)
+    rows = {}
+    for table in SHARDED_TABLES:
+        local_key = _LOCAL_KEYS.get(table.name)
+        rows[table.name] = [
+            {key: value for key, value in row.items() if key != local_key}
+            for row in conn.execute(select(table).where(filters[table.name])).mappings()
+        ]
+    return rows
+
+
+def _delete_group(conn, group_id):
+    filters = _group_filters(group_id)
+    for table in reversed(SHARDED_TABLES):
+        conn.execute(delete(table).where(filters[table.name]))
+
+
+def _ensure_snapshots(conn, taken_at):
+    # `snapshots compact` uses one cutoff everywhere, so the headers normally exist already
+    missing = taken_at - set(conn.execute(select(models.BalanceSnapshot.taken_at)).scalars())
+    if missing:
+        conn.execute(insert(models.BalanceSnapshot), [{"taken_at": value} for value in sorted(missing)])
+
+
+def move_group(group_id, target):
+    """Moves a group's rows to shard `target` and repoints the directory.
+
+    Run it with the app stopped. Copying, deleting the source rows and
+    updating the directory each commit on their own, and every step
+    tolerates a previous interrupted run, so a failed move is fixed by
+    running it again.
+
+    Returns:
+        int: The number of rows moved.
+    """
+    with database.SessionLocal() as db:
+        entry = db.get(models.GroupShard, group_id)
+        if entry is None:
+            raise ValueError(f"group {group_id} is not in the directory; run `python sharding.py init` first")
+        source = entry.shard
+    if source == target:
+        return 0
+    source_engine = database.engine if source is None else shard_engines[source]
+    target_engine = shard_engines[target]
+
+    with source_engine.connect() as conn:
+        rows = _read_group(conn, group_id)
+    if rows["bunch"]:
+        with target_engine.begin() as conn:
+            # clears what an interrupted earlier copy may have left behind
+            _delete_group(conn, group_id)
+            _ensure_snapshots(conn, {row["taken_at"] for row in rows["balance_snapshot_rows"]})
+            for table in SHARDED_TABLES:
+                if rows[table.name]:
+                    conn.execute(insert(table), rows[table.name])
+        with source_engine.begin() as conn:
+            _delete_group(conn, group_id)
+    else:
+        with target_engine.connect() as conn:
+            if conn.execute(select(models.Groups.group_id).where(models.Groups.group_id == group_id)).first() is None:
+                raise ValueError(f"group {group_id} is on neither its directory shard nor shard {target}")
+
+    with database.SessionLocal() as db:
+        db.execute(update(models.GroupShard).where(models.GroupShard.group_id == group_id).values(shard=target))
+        # views and plans cached while the group sat on its old shard are refetched
+        versions.bump(db, {row["groupmember_user_id"] for row in rows["groupmembers"]}, [group_id])
+        db.commit()
+    _directory.invalidate(group_id)
+    return sum(len(table_rows) for table_rows in rows.values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the placement of groups on shards.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init", help="create shard schemas and register existing groups")
+    commands.add_parser("status", help="count groups per shard")
+    move = commands.add_parser("move-group", help="move a group to another shard (app must be stopped)")
+    move.add_argument("group_id", type=int)
+    move.add_argument("shard", type=int)
+    args = parser.parse_args(argv)
+
+    if not ENABLED:
+        print("SHARD_DATABASE_URLS is not set", file=sys.stderr)
+        return 1
+    if args.command == "init":
+        models.Base.metadata.create_all(bind=database.engine)
+        create_shard_schemas()
+        print(f"registered {register_existing_groups()} existing groups")
+    elif args.command == "status":
+        with database.SessionLocal() as db:
+            counts = db.query(models.GroupShard.shard, func.count()).group_by(models.GroupShard.shard).all()
+        for shard, count in sorted(counts, key=lambda row: -1 if row[0] is None else row[0]):
+            print(f"{'global' if shard is None else shard}\t{count}")
+    else:
+        if not 0 <= args.shard < len(shard_engines):
+            print(f"shard must be between 0 and {len(shard_engines) - 1}", file=sys.stderr)
+            return 1
+        print(f"moved {move_group(args.group_id, args.shard)} rows")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
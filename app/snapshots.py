@@ -0,0 +1,203 @@
+"""Point-in-time balances from periodic ledger snapshots plus replayed splits.
+
+`balances` only knows the present. To answer "what did this user owe at T",
+`compact` periodically copies the ledger as of a cutoff into
+`balance_snapshot_rows`. It builds each snapshot from the previous one plus
+the splits of expenses created after it, so a compaction reads one
+snapshot-interval of history instead of the whole `splits` table. A query
+at T then reads the user's rows of the newest snapshot at or before T and
+adds the splits of the expenses created between that snapshot and T,
+including archived ones (see `archive`).
+
+The cutoff trails the clock by `--margin-minutes`. That way an expense
+stamped before the cutoff but committed after the compaction ran cannot be
+left out of a snapshot.
+
+Run from cron, once a day or so:
+
+    python snapshots.py compact --keep 30
+    python snapshots.py list
+"""
+import argparse
+import sys
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy import DateTime, delete, func, insert, literal, select, union_all
+from sqlalchemy.orm import Session
+
+import ledger
+import models
+
+# Expenses created before the first snapshot are replayed from here.
+EPOCH = datetime(1970, 1, 1)
+
+
+def naive_utc(value):
+    """Converts an aware datetime to the naive UTC the tables store; naive values pass through."""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(UTC).replace(tzinfo=None)
+    return value
+
+
+def cache_key(endpoint, as_of):
+    """`endpoint` as a `versions.conditional_get` key, qualified by `as_of` when given."""
+    return endpoint if as_of is None else f"{endpoint}@{as_of.isoformat()}"
+
+
+def _snapshot_at(as_of):
+    """Scalar subquery: the newest snapshot taken at or before `as_of`, or EPOCH."""
+    return select(
+        func.coalesce(func.max(models.BalanceSnapshot.taken_at), literal(EPOCH, DateTime))
+    ).where(models.BalanceSnapshot.taken_at <= as_of).scalar_subquery()
+
+
+def _splits_between(after, until, user_id=None):
+    """Selects the split rows of expenses created in (after, until], live and archived.
+
+    With `user_id`, only the rows involving that user, one select per side
+    so each can use the user_id / created_by index.
+
+    Returns:
+        list[Select]: Selects of creditor_id, debtor_id, group_id, amount.
+    """
+    selects = []
+    for expenses, splits in ((models.Expenses, models.Splits), (models.ExpenseArchive, models.SplitArchive)):
+        rows = (
+            select(
+                expenses.created_by.label("creditor_id"),
+                splits.user_id.label("debtor_id"),
+                func.coalesce(expenses.group_id, ledger.NO_GROUP).label("group_id"),
+                splits.amount.label("amount"),
+            )
+            .join(expenses, expenses.expense_id == splits.expense_id)
+            .where(expenses.created_at > after, expenses.created_at <= until)
+        )
+        if user_id is None:
+            selects.append(rows)
+        else:
+            selects.append(rows.where(splits.user_id == user_id))
+            selects.append(rows.where(expenses.created_by == user_id, splits.user_id != user_id))
+    return selects
+
+
+def _snapshot_rows(taken_at, *criteria):
+    rows = models.BalanceSnapshotRow
+    return select(rows.creditor_id, rows.debtor_id, rows.group_id, rows.amount).where(rows.taken_at == taken_at, *criteria)
+
+
+def ledger_source(user_id, as_of=None):
+    """What to read `user_id`'s ledger rows from.
+
+    Args:
+        user_id (int): The user whose balances are asked for.
+        as_of (datetime | None): Naive UTC point in time; None for now.
+
+    Returns:
+        `models.Balances` when `as_of` is None. Otherwise the columns of a
+        subquery with the same creditor_id, debtor_id, group_id and amount
+        columns, holding unaggregated rows that involve `user_id` as of
+        `as_of`. Callers sum them like ledger rows.
+    """
+    if as_of is None:
+        return models.Balances
+    taken_at = _snapshot_at(as_of)
+    # one branch per side, so each can use the debtor / user_id / created_by index
+    return union_all(
+        _snapshot_rows(taken_at, models.BalanceSnapshotRow.debtor_id == user_id),
+        _snapshot_rows(taken_at, models.BalanceSnapshotRow.creditor_id == user_id, models.BalanceSnapshotRow.debtor_id != user_id),
+        *_splits_between(taken_at, as_of, user_id),
+    ).subquery("balances_as_of").c
+
+
+def compact(db: Session, taken_at):
+    """Writes the snapshot at `taken_at` from the previous snapshot and the splits since it.
+
+    Returns:
+        int | None: The number of snapshot rows written, or None when a
+        snapshot at or after `taken_at` already exists.
+    """
+    try:
+        previous = db.query(func.max(models.BalanceSnapshot.taken_at)).scalar()
+        if previous is not None and previous >= taken_at:
+            return None
+        sources = _splits_between(previous or EPOCH, taken_at)
+        if previous is not None:
+            sources.append(_snapshot_rows(previous))
+        combined = union_all(*sources).subquery()
+        db.add(models.BalanceSnapshot(taken_at=taken_at))
+        db.flush()
+        db.execute(
+            insert(models.BalanceSnapshotRow).from_select(
+                ["taken_at", "creditor_id", "debtor_id", "group_id", "amount"],
+                select(
+                    literal(taken_at, DateTime),
+                    combined.c.creditor_id,
+                    combined.c.debtor_id,
+                    combined.c.group_id,
+                    func.sum(combined.c.amount),
+                ).group_by(combined.c.creditor_id, combined.c.debtor_id, combined.c.group_id),
+            )
+        )
+        count = db.query(func.count(models.BalanceSnapshotRow.snapshot_row_id)).filter(
+            models.BalanceSnapshotRow.taken_at == taken_at
+        ).scalar()
+        db.query(models.BalanceSnapshot).filter(models.BalanceSnapshot.taken_at == taken_at).update({"row_count": count})
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return count
+
+
+def prune(db: Session, keep):
+    """Deletes all but the newest `keep` snapshots. `as_of` before the oldest kept one replays from EPOCH.
+
+    Returns:
+        int: The number of snapshots deleted.
+    """
+    stale = [row[0] for row in db.query(models.BalanceSnapshot.taken_at).order_by(
+        models.BalanceSnapshot.taken_at.desc()
+    ).offset(keep).all()]
+    if not stale:
+        return 0
+    try:
+        db.execute(delete(models.BalanceSnapshotRow).where(models.BalanceSnapshotRow.taken_at.in_(stale)))
+        db.execute(delete(models.BalanceSnapshot).where(models.BalanceSnapshot.taken_at.in_(stale)))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(stale)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write or list point-in-time balance snapshots.")
+    parser.add_argument("command", choices=["compact", "list"])
+    parser.add_argument("--margin-minutes", type=float, default=10,
+                        help="how far the cutoff trails the clock, to wait out in-flight writes")
+    parser.add_argument("--keep", type=int, default=None, help="snapshots to keep per database after compacting")
+    args = parser.parse_args(argv)
+
+    import sharding
+
+    # one cutoff for every database, so a point in time means the same everywhere
+    taken_at = datetime.now(UTC).replace(tzinfo=None) - timedelta(minutes=args.margin_minutes)
+    for shard in sharding.all_shards():
+        label = "global" if shard is None else f"shard {shard}"
+        with sharding.shard_session(shard) as db:
+            if args.command == "list":
+                for snapshot in db.query(models.BalanceSnapshot).order_by(models.BalanceSnapshot.taken_at):
+                    print(f"{label}: {snapshot.taken_at.isoformat()} {snapshot.row_count} rows")
+                continue
+            count = compact(db, taken_at)
+            if count is None:
+                print(f"{label}: a snapshot at or after {taken_at.isoformat()} already exists")
+            else:
+                print(f"{label}: snapshot {taken_at.isoformat()} with {count} rows")
+            if args.keep is not None:
+                print(f"{label}: pruned {prune(db, args.keep)} snapshots")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""List response helpers shared by the sync and async routes."""
+import codecs
+import json
+
+import anyio
+from fastapi.encoders import jsonable_encoder
+
+
+def ndjson_line(row, model):
+    """Validates an ORM row through `model` and encodes it as one NDJSON line."""
+    item = model(**{field: getattr(row, field) for field in model.__fields__})
+    return json.dumps(jsonable_encoder(item), separators=(",", ":")) + "\n"
+
+
+def next_page_headers(rows, limit, key):
+    """`X-Next-After` for a full keyset page; a shorter page is the last one."""
+    if limit is not None and len(rows) == limit:
+        return {"X-Next-After": str(getattr(rows[-1], key))}
+    return {}
+
+
+def blocking_lines(byte_stream):
+    """Iterates the lines of an async stream of bytes from a worker thread, line endings kept.
+
+    Must run in a thread started by `run_in_threadpool`. Each chunk of the
+    stream is awaited on the event loop, so a request body is still read
+    as it arrives rather than buffered whole.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = byte_stream.__aiter__()
+
+    async def next_chunk():
+        return await chunks.__anext__()
+
+    pending = ""
+    while True:
+        try:
+            data = anyio.from_thread.run(next_chunk)
+        except StopAsyncIteration:
+            break
+        pending += decoder.decode(data)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
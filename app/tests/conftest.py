@@ -0,0 +1,70 @@
+"""Shared fixtures for the API tests.
+
+The app reads its configuration from the environment when its modules are
+imported, so this file points it at a throwaway SQLite database before any
+test module imports them. Replica, shard and async setups are swapped in
+per test by the fixtures that need them.
+
+Run from the repository root:
+
+    python -m pytest -q app/tests
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+TEST_DIR = tempfile.mkdtemp(prefix="yas-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DIR, 'primary.db')}"
+for name in ("REPLICA_DATABASE_URLS", "SHARD_DATABASE_URLS", "DB_ASYNC", "DB_CREATE_SCHEMA", "WRITE_BEHIND_ENABLED"):
+    os.environ.pop(name, None)
+# the lifespan's background friend graph refresh is exercised directly instead
+os.environ["FRIEND_GRAPH_REFRESH_SECONDS"] = "0"
+
+
+def sqlite_url(name):
+    """URL of a fresh SQLite file called `name` in the test directory."""
+    path = os.path.join(TEST_DIR, name)
+    if os.path.exists(path):
+        os.remove(path)
+    return f"sqlite:///{path}"
+
+
+@pytest.fixture
+def db():
+    """A session on an empty primary database, with every in-process cache cleared."""
+    import database
+    import models
+    from benchmarks.budgets import clear_caches
+    from friend_graph import graph
+
+    database.engine.dispose()
+    models.Base.metadata.drop_all(database.engine)
+    models.Base.metadata.create_all(database.engine)
+    clear_caches()
+    session = database.SessionLocal()
+    graph.load(session)
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def client(db):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def api(client):
+    """Creates users, groups and expenses through `client`."""
+    from benchmarks.budgets import Fixture
+
+    return Fixture(client)
@@ -0,0 +1,80 @@
+"""The DB_ASYNC routes on aiosqlite, checked against the sync routes on the same database."""
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def async_client(db, monkeypatch):
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+
+    import async_routes
+    import database
+    import main
+
+    url = database.async_url(database.engine.url.render_as_string())
+    engine = create_async_engine(url, **database.engine_options(url))
+    session_factory = sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    monkeypatch.setattr(database, "ASYNC_MODE", True)
+    monkeypatch.setattr(database, "async_engine", engine)
+    monkeypatch.setattr(database, "AsyncSessionLocal", session_factory)
+    monkeypatch.setattr(async_routes, "AsyncSessionLocal", session_factory)
+    with TestClient(main.create_app()) as client:
+        yield client
+
+
+def seed(client):
+    from benchmarks.budgets import Fixture
+
+    api = Fixture(client)
+    a, b, c = api.users(3)
+    group_id = api.group(a, [b])
+    api.post("/addfriend/", json={"user_email": a, "friend_email": c})
+    api.expense(a, [b, c], group_id=group_id, amount=30)
+    api.expense(c, [a], amount=8)
+    return a, b, c, group_id
+
+
+READS = [
+    ("/amount_owed/", {}),
+    ("/amount_owed_to_each_user/", {}),
+    ("/amount_owed_to_each_user/", {"by_id": "true"}),
+    ("/amount_owed_in_each_group/", {}),
+    ("/all_user_groups", {}),
+    ("/user_expenses/", {}),
+    ("/user_expenses/", {"stream": "true"}),
+]
+
+
+def test_async_writes_and_reads_match_the_sync_routes(async_client, client):
+    users = seed(async_client)[:3]
+
+    for path, params in READS:
+        for email in users:
+            query = {"user_email": email, **params}
+            async_response = async_client.get(path, params=query)
+            assert async_response.status_code == 200, (path, params)
+            assert async_response.text == client.get(path, params=query).text, (path, params, email)
+
+
+def test_async_expense_updates_the_ledger(async_client, db):
+    import ledger
+
+    seed(async_client)
+
+    assert ledger.verify(db) == []
+
+
+def test_async_conditional_get_and_unknown_users(async_client):
+    a, b, _, group_id = seed(async_client)
+
+    first = async_client.get("/amount_owed/", params={"user_email": b})
+    assert first.json() == {"result": "You owe 10.0"}
+    assert async_client.get("/amount_owed/", params={"user_email": b}, headers={"If-None-Match": first.headers["etag"]}).status_code == 304
+    async_client.post("/addexpense", json={"description": "more", "amount": 4, "group_id": str(group_id), "created_by": a, "users": [b]})
+    second = async_client.get("/amount_owed/", params={"user_email": b}, headers={"If-None-Match": first.headers["etag"]})
+    assert second.status_code == 200
+    assert second.json() == {"result": "You owe 12.0"}
+
+    for path in ("/amount_owed/", "/user_expenses/", "/all_user_groups"):
+        assert async_client.get(path, params={"user_email": "nobody@example.test"}).status_code == 404
@@ -0,0 +1,16 @@
+def owed(client, email, **params):
+    return client.get("/amount_owed/", params={"user_email": email, **params}).json()["result"]
+
+
+def test_a_user_without_expenses_owes_a_float_zero(api, client):
+    a, = api.users(1)
+
+    assert owed(client, a) == "You owe 0.0"
+
+
+def test_net_balance_both_ways(api, client):
+    a, b = api.users(2)
+    api.expense(a, [b], amount=30)
+
+    assert owed(client, b) == "You owe 15.0"
+    assert owed(client, a) == "You are owed 15.0"
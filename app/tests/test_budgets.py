@@ -0,0 +1,12 @@
+import database
+import main
+from benchmarks import budgets as budget_check
+
+
+def test_every_route_stays_within_its_statement_budget(db):
+    report = budget_check.run(main.app, [database.engine], [1, 3, 10])
+
+    assert report["unbudgeted"] == []
+    failing = {result["scenario"]: result["problems"] for result in report["scenarios"] if result["problems"]}
+    assert failing == {}
+
@@ -0,0 +1,71 @@
+import cache
+from cache import LRUCache, UserCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_entry_is_evicted():
+    lru = LRUCache(maxsize=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c")) == (1, 3)
+    assert lru.stats() == {"size": 2, "maxsize": 2, "hits": 3, "misses": 1, "evictions": 1}
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    lru = LRUCache(maxsize=10, ttl=5)
+    lru.set("a", 1)
+
+    clock.now += 4.9
+    assert lru.peek("a") == 1
+    clock.now += 0.2
+    assert lru.peek("a") is None
+    assert lru.get("a") is None
+    assert len(lru) == 0
+
+
+def test_peek_leaves_recency_and_counters_alone():
+    lru = LRUCache(maxsize=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.peek("a") == 1
+    lru.set("c", 3)
+
+    assert lru.peek("a") is None
+    assert lru.stats()["hits"] == 0
+
+
+def test_user_cache_invalidates_both_indexes_by_email():
+    users = UserCache(maxsize=10, ttl=60)
+    users.store(cache.CachedUser(7, "Ada", "ada@example.test"))
+
+    users.invalidate(email="ada@example.test")
+
+    assert users.by_email.get("ada@example.test") is None
+    assert users.by_id.get(7) is None
+
+
+def test_evicted_responses_are_recomputed(api, client, monkeypatch):
+    import versions
+
+    monkeypatch.setattr(versions, "response_cache", LRUCache(maxsize=1, ttl=60))
+    a, b = api.users(2)
+    api.expense(a, [b], amount=30)
+
+    for _ in range(2):
+        assert client.get("/amount_owed/", params={"user_email": b}).json() == {"result": "You owe 15.0"}
+        assert client.get("/amount_owed/", params={"user_email": a}).json() == {"result": "You are owed 15.0"}
+    assert versions.response_cache.stats()["evictions"] == 3
+    assert versions.response_cache.stats()["hits"] == 0
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+
+import pytest
+
+import events
+
+USERS = 50
+SUBSCRIBERS_PER_USER = 10
+PUBLISHERS = 4
+EVENTS_PER_PUBLISHER = 10
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = events.Broker()
+    monkeypatch.setattr(events, "broker", broker)
+    return broker
+
+
+def event_id(message):
+    first = message.split("\n", 1)[0]
+    return int(first[len("id: "):]) if first.startswith("id: ") else None
+
+
+def test_many_concurrent_sse_subscribers_each_get_every_event_in_order(broker):
+    users = range(1, USERS + 1)
+    expected = PUBLISHERS * EVENTS_PER_PUBLISHER
+
+    def publisher(n):
+        for i in range(EVENTS_PER_PUBLISHER):
+            broker.publish(users, "expense_added", publisher=n, seq=i)
+
+    async def consume(stream):
+        ids = []
+        async for message in stream:
+            assert not message.startswith("event: overflow")
+            if event_id(message) is not None:
+                ids.append(event_id(message))
+                if len(ids) == expected:
+                    break
+        await stream.aclose()
+        return ids
+
+    async def run():
+        streams = [(user_id, events.sse_stream(user_id, heartbeat=5)) for user_id in users for _ in range(SUBSCRIBERS_PER_USER)]
+        # the first message is sent once the stream has subscribed
+        for _, stream in streams:
+            assert await stream.__anext__() == "retry: 3000\n\n"
+        assert broker.subscriber_count() == USERS * SUBSCRIBERS_PER_USER
+        consumers = [asyncio.ensure_future(consume(stream)) for _, stream in streams]
+        threads = [threading.Thread(target=publisher, args=(n,)) for n in range(PUBLISHERS)]
+        for thread in threads:
+            thread.start()
+        received = await asyncio.wait_for(asyncio.gather(*consumers), timeout=30)
+        for thread in threads:
+            thread.join()
+        return [(user_id, ids) for (user_id, _), ids in zip(streams, received)]
+
+    received = asyncio.run(run())
+
+    by_user = {}
+    for user_id, ids in received:
+        assert len(ids) == expected
+        assert ids == sorted(set(ids))
+        by_user.setdefault(user_id, ids)
+        assert ids == by_user[user_id]
+    # every event id went to exactly one user
+    all_ids = [event for ids in by_user.values() for event in ids]
+    assert len(all_ids) == len(set(all_ids)) == USERS * expected
+    assert broker.subscriber_count() == 0
+
+
+def test_a_slow_subscriber_drops_its_oldest_events_without_holding_up_the_others(broker):
+    async def run():
+        slow = broker.subscribe(1, maxsize=5)
+        fast = broker.subscribe(1)
+        await asyncio.get_running_loop().run_in_executor(None, lambda: [broker.publish([1], "expense_added", n=n) for n in range(12)])
+        return await slow.get(1), await fast.get(1)
+
+    (slow_events, lost), (fast_events, fast_lost) = asyncio.run(run())
+
+    assert [event["n"] for event in slow_events] == list(range(7, 12))
+    assert lost == 7
+    assert [event["n"] for event in fast_events] == list(range(12))
+    assert fast_lost == 0
+
+
+def test_one_publish_wakes_every_long_poll_waiter(broker):
+    async def run():
+        waiters = [asyncio.ensure_future(events.poll(1, after=0, timeout=10)) for _ in range(200)]
+        while broker.subscriber_count() < len(waiters):
+            await asyncio.sleep(0.01)
+        threading.Thread(target=broker.publish, args=([1], "friend_added")).start()
+        return await asyncio.wait_for(asyncio.gather(*waiters), timeout=5)
+
+    answers = asyncio.run(run())
+
+    assert all([event["type"] for event in answer["events"]] == ["friend_added"] for answer in answers)
+    assert {answer["last_event_id"] for answer in answers} == {1}
+    assert broker.subscriber_count() == 0
+
+
+def test_reconnect_replays_missed_events_from_history(broker):
+    for n in range(3):
+        broker.publish([1], "expense_added", n=n)
+
+    async def run():
+        stream = events.sse_stream(1, last_event_id=1, heartbeat=5)
+        messages = [await stream.__anext__() for _ in range(3)]
+        await stream.aclose()
+        return messages
+
+    messages = asyncio.run(run())
+
+    assert [event_id(message) for message in messages[1:]] == [2, 3]
@@ -0,0 +1,12 @@
+def test_adding_a_member_echoes_the_email_and_returns_the_user_id(api, client):
+    a, b = api.users(2)
+    group_id = api.group(a)
+    user_id = client.get("/users/").json()[1]["user_id"]
+
+    member = client.post("/addmembertogroup/", json={"groupmember_user_email": b, "groupmember_group_id": group_id, "added_by": a})
+
+    assert member.status_code == 200
+    body = member.json()
+    assert body["groupmember_user_email"] == b
+    assert body["groupmember_user_id"] == user_id
+    assert body["groupmember_group_id"] == group_id
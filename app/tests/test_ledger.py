@@ -0,0 +1,46 @@
+from sqlalchemy import update
+
+import ledger
+import models
+
+
+def test_expense_deltas_fold_splits_per_pair():
+    deltas = ledger.expense_deltas(1, None, [(2, 5.0), (3, 5.0), (2, 1.0), (1, 5.0)])
+
+    assert deltas == {(1, 2, ledger.NO_GROUP): 6.0, (1, 3, ledger.NO_GROUP): 5.0, (1, 1, ledger.NO_GROUP): 5.0}
+
+
+def test_merge_deltas_adds_in_place():
+    target = ledger.expense_deltas(1, 7, [(2, 5.0)])
+
+    merged = ledger.merge_deltas(target, ledger.expense_deltas(1, 7, [(2, 2.5), (3, 1.0)]))
+
+    assert merged is target
+    assert merged == {(1, 2, 7): 7.5, (1, 3, 7): 1.0}
+
+
+def test_api_writes_keep_the_ledger_in_step_with_splits(api, db):
+    a, b, c = api.users(3)
+    group_id = api.group(a, [b, c])
+    api.expense(a, [b, c], group_id=group_id, amount=30)
+    api.expense(b, [a], amount=8)
+    api.expense(a, [b], amount=4)
+
+    assert ledger.verify(db) == []
+    rows = {(row.creditor_id, row.debtor_id, row.group_id): row.amount for row in db.query(models.Balances)}
+    assert rows[(1, 2, group_id)] == 10.0
+    assert rows[(1, 2, ledger.NO_GROUP)] == 2.0
+    assert rows[(2, 1, ledger.NO_GROUP)] == 4.0
+
+
+def test_verify_reports_drift_and_rebuild_repairs_it(api, db):
+    a, b = api.users(2)
+    api.expense(a, [b], amount=30)
+    db.execute(update(models.Balances).where(models.Balances.debtor_id == 2).values(amount=99.0))
+    db.commit()
+
+    drift = ledger.verify(db)
+    assert [(row["creditor_id"], row["debtor_id"], row["ledger"], row["expected"]) for row in drift] == [(1, 2, 99.0, 15.0)]
+
+    ledger.rebuild(db)
+    assert ledger.verify(db) == []
@@ -0,0 +1,26 @@
+import metrics
+
+
+def statements(method, route):
+    """(requests, statements) recorded so far for the route."""
+    _, total, count = metrics.request_statements._series.get((method, route), (None, 0.0, 0))
+    return count, total
+
+
+def test_streamed_bodies_count_the_queries_they_run(api, client):
+    api.users(3)
+    requests, before = statements("GET", "/users/")
+
+    response = client.get("/users/", params={"stream": "true"})
+
+    assert len(response.text.splitlines()) == 3
+    assert statements("GET", "/users/")[0] == requests + 1
+    assert statements("GET", "/users/")[1] > before
+
+
+def test_failed_requests_are_recorded(client):
+    requests, _ = statements("GET", "/user_expenses/")
+
+    assert client.get("/user_expenses/", params={"user_email": "nobody@example.test"}).status_code == 404
+    assert statements("GET", "/user_expenses/")[0] == requests + 1
+    assert 'http_requests_total{method="GET",route="/user_expenses/",status="404"}' in client.get("/metrics").text
@@ -0,0 +1,96 @@
+import shutil
+import time
+from collections import OrderedDict
+
+import pytest
+from conftest import sqlite_url
+from sqlalchemy import create_engine, event
+
+
+@pytest.fixture
+def replica(db, monkeypatch):
+    """A second SQLite file as the only replica; calling the fixture copies the primary into it."""
+    import database
+
+    url = sqlite_url("replica.db")
+    engine = create_engine(url, **database.engine_options(url))
+    monkeypatch.setattr(database, "replica_engines", [engine])
+    monkeypatch.setattr(database, "_pins", OrderedDict())
+    monkeypatch.setattr(database, "_latest_pin", 0.0)
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    def replicate():
+        engine.dispose()
+        shutil.copy(database.engine.url.database, engine.url.database)
+
+    replicate.statements = statements
+    yield replicate
+    engine.dispose()
+
+
+def owed(client, email, **headers):
+    return client.get("/amount_owed/", params={"user_email": email}, headers=headers)
+
+
+def forget_pins():
+    import database
+
+    database._pins.clear()
+    database._latest_pin = 0.0
+
+
+def test_reads_go_to_the_replica(api, client, replica):
+    a, b = api.users(2)
+    api.expense(a, [b], amount=30)
+    replica()
+    api.expense(a, [b], amount=30)
+    forget_pins()
+
+    # the replica has not seen the second expense yet
+    assert owed(client, b).json() == {"result": "You owe 15.0"}
+    assert replica.statements
+
+
+def test_writer_reads_the_primary_until_the_replica_catches_up(api, client, replica):
+    a, b, c = api.users(3)
+    api.expense(a, [b], amount=30)
+    replica()
+    api.expense(a, [b], amount=30)
+
+    replica.statements.clear()
+    assert owed(client, b).json() == {"result": "You owe 30.0"}
+    # only the version check ran on the replica; the view itself came from the primary
+    assert len(replica.statements) == 1
+    # users without a pending write stay on the replica
+    replica.statements.clear()
+    assert owed(client, c).status_code == 200
+    assert len(replica.statements) > 1
+
+    replica()
+    replica.statements.clear()
+    assert owed(client, b).json() == {"result": "You owe 30.0"}
+    assert len(replica.statements) > 1
+
+
+def test_expired_pin_never_caches_lagging_data_under_the_new_version(api, client, replica, monkeypatch):
+    import database
+
+    monkeypatch.setattr(database, "READ_YOUR_WRITES_SECONDS", 0.2)
+    a, b = api.users(2)
+    api.expense(a, [b], amount=30)
+    replica()
+    api.expense(a, [b], amount=30)
+    fresh = owed(client, b)
+    time.sleep(0.3)
+
+    # the pin ran out before the replica caught up: a stale answer, under the replica's version
+    stale = owed(client, b)
+    assert stale.json() == {"result": "You owe 15.0"}
+    assert stale.headers["etag"] != fresh.headers["etag"]
+    assert owed(client, b, **{"If-None-Match": fresh.headers["etag"]}).status_code == 200
+
+    replica()
+    caught_up = owed(client, b)
+    assert caught_up.json() == {"result": "You owe 30.0"}
+    assert caught_up.headers["etag"] == fresh.headers["etag"]
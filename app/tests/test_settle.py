@@ -0,0 +1,53 @@
+import pytest
+
+import settle
+
+
+def settled(net, transfers):
+    """Applies `transfers` (in cents) to `net` and returns what is left, in cents."""
+    left = {user_id: round(amount * 100) for user_id, amount in net.items()}
+    for debtor, creditor, cents in transfers:
+        left[debtor] += cents
+        left[creditor] -= cents
+    return left
+
+
+@pytest.mark.parametrize("net", [
+    {},
+    {1: 10.0, 2: -10.0},
+    {1: 30.0, 2: -10.0, 3: -10.0, 4: -10.0},
+    {1: 25.0, 2: 5.0, 3: -12.5, 4: -17.5},
+    {1: 10 / 3, 2: 10 / 3, 3: -20 / 3},
+])
+def test_plan_settles_everyone_in_at_most_n_minus_one_transfers(net):
+    transfers = settle.minimize_transfers(net)
+
+    assert len(transfers) <= max(len(net) - 1, 0)
+    assert all(cents > 0 for _, _, cents in transfers)
+    left = settled(net, transfers)
+    # rounding leftovers go to the largest position, so at most one cent stays there
+    assert sum(abs(cents) for cents in left.values()) <= 1
+
+
+def test_rounding_leftover_is_absorbed_by_the_largest_position():
+    transfers = settle.minimize_transfers({1: 10 / 3, 2: 10 / 3, 3: -20 / 3})
+
+    assert sorted(transfers) == [(3, 1, 333), (3, 2, 333)]
+
+
+def test_settle_up_route_plans_the_group_and_follows_new_expenses(api, client):
+    a, b, c = api.users(3)
+    group_id = api.group(a, [b, c])
+    api.expense(a, [b, c], group_id=group_id, amount=30)
+
+    plan = client.get("/settle_up/", params={"group_id": group_id}).json()
+    assert plan["group_id"] == group_id
+    assert sorted((t["from_user_id"], t["to_user_id"], t["amount"]) for t in plan["transfers"]) == [(2, 1, 10.0), (3, 1, 10.0)]
+
+    api.expense(b, [a, c], group_id=group_id, amount=30)
+    plan = client.get("/settle_up/", params={"group_id": group_id}).json()
+    assert sorted((t["from_user_id"], t["to_user_id"], t["amount"]) for t in plan["transfers"]) == [(3, 1, 10.0), (3, 2, 10.0)]
+
+
+def test_settle_up_for_an_unknown_group_is_a_404(client):
+    assert client.get("/settle_up/", params={"group_id": 404}).status_code == 404
@@ -0,0 +1,142 @@
+"""Sharded group data on three SQLite files: the global database and two shards."""
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from conftest import sqlite_url
+from sqlalchemy import create_engine, func, select
+
+import models
+
+
+@pytest.fixture
+def shards(db, monkeypatch):
+    import database
+    import sharding
+    from cache import LRUCache
+
+    engines = []
+    for shard in range(2):
+        url = sqlite_url(f"shard{shard}.db")
+        engines.append(create_engine(url, **database.engine_options(url)))
+    executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="shard")
+    monkeypatch.setattr(sharding, "shard_engines", engines)
+    monkeypatch.setattr(sharding, "ENABLED", True)
+    monkeypatch.setattr(sharding, "_executor", executor)
+    monkeypatch.setattr(sharding, "_directory", LRUCache())
+    monkeypatch.setattr(sharding, "_placement", itertools.count())
+    monkeypatch.setattr(sharding, "expense_id_allocator", sharding.HiLoAllocator("expenses", sharding._expense_floor, block_size=3))
+    sharding.create_shard_schemas()
+    yield engines
+    executor.shutdown()
+    for engine in engines:
+        engine.dispose()
+
+
+def group_ids_on(shard):
+    import sharding
+
+    with sharding.shard_session(shard) as session:
+        return sorted(session.scalars(select(models.Groups.group_id)))
+
+
+def test_groups_are_spread_over_the_shards_through_the_directory(api, db, shards):
+    import sharding
+
+    a, = api.users(1)
+    groups = [api.group(a) for _ in range(3)]
+
+    placements = dict(db.query(models.GroupShard.group_id, models.GroupShard.shard))
+    assert placements == {groups[0]: 0, groups[1]: 1, groups[2]: 0}
+    assert group_ids_on(None) == []
+    assert group_ids_on(0) == [groups[0], groups[2]]
+    assert group_ids_on(1) == [groups[1]]
+
+    sharding._directory.clear()
+    assert [sharding.shard_for(db, group_id) for group_id in groups] == [0, 1, 0]
+    assert sharding.shard_for(db, 404) is None
+    assert sharding.shard_for(db, None) is None
+
+
+def test_expense_ids_are_unique_across_databases(api, shards):
+    import sharding
+
+    a, b = api.users(2)
+    on_shard_0, on_shard_1 = api.group(a, [b]), api.group(a, [b])
+    ids = [
+        api.expense(a, [b], group_id=group_id)["expense_id"]
+        for group_id in (on_shard_0, on_shard_1, None, on_shard_1, on_shard_0, None, on_shard_0)
+    ]
+
+    assert ids == sorted(set(ids))
+    stored = []
+    for shard in sharding.all_shards():
+        with sharding.shard_session(shard) as session:
+            stored += session.scalars(select(models.Expenses.expense_id))
+    assert sorted(stored) == ids
+
+
+def test_allocator_starts_above_every_database_and_reserves_whole_blocks(db, shards):
+    import sharding
+
+    with sharding.shard_session(1) as session:
+        session.add(models.Expenses(expense_id=50, amount=1.0, description="imported", created_by=1))
+        session.commit()
+    allocator = sharding.HiLoAllocator("expenses", sharding._expense_floor, block_size=3)
+
+    assert allocator.allocate(2) == [51, 52]
+    assert allocator.allocate(2) == [53, 54]
+    assert allocator.allocate(5) == [55, 56, 57, 58, 59]
+    assert db.get(models.IdBlock, "expenses").next_id == 60
+
+
+def test_fan_out_runs_on_every_database_in_order(api, db, shards):
+    import sharding
+
+    a, b = api.users(2)
+    for _ in range(3):
+        api.expense(a, [b], group_id=api.group(a, [b]))
+    api.expense(a, [b])
+
+    counts = sharding.fan_out(db, lambda session: session.query(func.count(models.Expenses.expense_id)).scalar())
+
+    assert counts == [1, 2, 1]
+
+
+def test_reads_merge_every_database(api, client, shards):
+    a, b = api.users(2)
+    groups = []
+    for name in ("rent", "trip"):
+        group_id = api.post("/groups/", json={"group_name": name, "created_by": a}).json()["group_id"]
+        api.post("/addmembertogroup/", json={"groupmember_user_email": b, "groupmember_group_id": group_id, "added_by": a})
+        groups.append(group_id)
+    ids = [api.expense(a, [b], group_id=group_id, amount=20)["expense_id"] for group_id in groups]
+    ids.append(api.expense(a, [b], amount=20)["expense_id"])
+
+    assert client.get("/amount_owed/", params={"user_email": b}).json() == {"result": "You owe 30.0"}
+    assert client.get("/amount_owed_in_each_group/", params={"user_email": b}).json() == {"rent": 10.0, "trip": 10.0}
+    assert sorted(client.get("/all_user_groups", params={"user_email": b}).json()) == ["rent", "trip"]
+    first = client.get("/user_expenses/", params={"user_email": a, "limit": "2"}).json()
+    rest = client.get("/user_expenses/", params={"user_email": a, "after": str(first[-1]["expense_id"])}).json()
+    assert [expense["expense_id"] for expense in first + rest] == ids
+
+
+def test_move_group_keeps_the_group_s_answers(api, client, db, shards):
+    import ledger
+    import sharding
+
+    a, b = api.users(2)
+    group_id = api.group(a, [b])
+    api.expense(a, [b], group_id=group_id, amount=20)
+    before = client.get("/settle_up/", params={"group_id": group_id}).json()
+
+    assert sharding.move_group(group_id, 1) > 0
+
+    assert group_ids_on(0) == []
+    assert group_ids_on(1) == [group_id]
+    db.expire_all()
+    assert db.get(models.GroupShard, group_id).shard == 1
+    assert client.get("/settle_up/", params={"group_id": group_id}).json() == before
+    assert client.get("/amount_owed/", params={"user_email": b}).json() == {"result": "You owe 10.0"}
+    with sharding.shard_session(1) as session:
+        assert ledger.verify(session) == []
@@ -0,0 +1,44 @@
+from datetime import UTC, datetime, timedelta, timezone
+
+import snapshots
+
+
+def now():
+    return datetime.now(UTC)
+
+
+def owed(client, email, as_of=None):
+    params = {"user_email": email}
+    if as_of is not None:
+        params["as_of"] = as_of.isoformat()
+    return client.get("/amount_owed/", params=params).json()["result"]
+
+
+def test_as_of_answers_from_snapshots_and_replayed_splits(api, client, db):
+    a, b = api.users(2)
+    before = now()
+    api.expense(a, [b], amount=30)
+    between = now()
+    api.expense(a, [b], amount=10)
+    after = now()
+
+    answers = [owed(client, b, as_of) for as_of in (before, between, after)]
+    assert answers == ["You owe 0.0", "You owe 15.0", "You owe 20.0"]
+    assert owed(client, b) == "You owe 20.0"
+
+    assert snapshots.compact(db, snapshots.naive_utc(between)) > 0
+    # a compaction at the same cutoff again is a no-op
+    assert snapshots.compact(db, snapshots.naive_utc(between)) is None
+    assert [owed(client, b, as_of) for as_of in (before, between, after)] == answers
+
+    assert snapshots.compact(db, snapshots.naive_utc(after)) > 0
+    assert snapshots.prune(db, keep=1) == 1
+    assert [owed(client, b, as_of) for as_of in (before, between, after)] == answers
+
+
+def test_naive_utc():
+    aware = datetime(2024, 5, 1, 12, 0, tzinfo=timezone(timedelta(hours=2)))
+
+    assert snapshots.naive_utc(aware) == datetime(2024, 5, 1, 10, 0)
+    assert snapshots.naive_utc(datetime(2024, 5, 1, 12, 0)) == datetime(2024, 5, 1, 12, 0)
+    assert snapshots.naive_utc(None) is None
@@ -0,0 +1,20 @@
+import pytest
+
+
+@pytest.mark.parametrize("params", [{}, {"stream": "true"}, {"include_archived": "true"}, {"limit": "1"}])
+def test_unknown_user_is_a_404(client, params):
+    response = client.get("/user_expenses/", params={"user_email": "nobody@example.test", **params})
+
+    assert response.status_code == 404
+
+
+def test_lists_the_expenses_the_user_created(api, client):
+    a, b = api.users(2)
+    first = api.expense(a, [b])
+    second = api.expense(a, [b])
+    api.expense(b, [a])
+
+    page = client.get("/user_expenses/", params={"user_email": a, "limit": "1"})
+    assert [expense["expense_id"] for expense in page.json()] == [first["expense_id"]]
+    rest = client.get("/user_expenses/", params={"user_email": a, "after": str(first["expense_id"])})
+    assert [expense["expense_id"] for expense in rest.json()] == [second["expense_id"]]
@@ -0,0 +1,45 @@
+import threading
+
+import schema
+
+
+def expense(creator, users, amount=10.0):
+    return schema.ExpenseCreate(description="deferred", amount=amount, group_id="", created_by=creator, users=users)
+
+
+def test_stop_commits_everything_that_got_a_ticket(db, api):
+    import database
+    import write_behind
+
+    a, b = api.users(2)
+    writer = write_behind.WriteBehindQueue(database.SessionLocal, batch_size=7, flush_interval=0.01)
+    writer.start()
+    tickets = [writer.submit(expense(a, [b])) for _ in range(50)]
+    writer.stop()
+
+    assert {writer.status(ticket)["status"] for ticket in tickets} == {"committed"}
+    assert writer.depth() == 0
+
+
+def test_stop_with_a_timeout_fails_the_tickets_still_queued(db, api):
+    import database
+    import write_behind
+
+    a, b = api.users(2)
+    release = threading.Event()
+
+    def stalled_session():
+        release.wait()
+        return database.SessionLocal()
+
+    writer = write_behind.WriteBehindQueue(stalled_session, batch_size=1, flush_interval=0.01)
+    writer.start()
+    worker = writer._thread
+    tickets = [writer.submit(expense(a, [b])) for _ in range(5)]
+    writer.stop(timeout=0.2)
+    assert writer.depth() == 0
+
+    # the worker held the first payload when the timeout ran out and still writes it
+    release.set()
+    worker.join(5)
+    assert [writer.status(ticket)["status"] for ticket in tickets] == ["committed"] + ["failed"] * 4
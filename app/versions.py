@@ -0,0 +1,194 @@
+"""Per-user and per-group change versions and conditional GET support.
+
+Every write that touches a user bumps that user's version, and expense
+writes also bump their group's version. Read endpoints derive an ETag from
+(endpoint, user, version): a client that sends the same tag back in
+`If-None-Match` gets a 304 without any balance query running, and repeat
+readers of an unchanged view are served from `response_cache`. The
+settle-up plan cache is keyed by the group's version the same way.
+
+Versions are rows of `change_versions` in the global database, bumped in
+the write's own transaction, so writes made by other worker processes and
+by the bulk, archive and sharding tools move them too. A view reads its
+version with the same session as its data, so a lagging replica yields the
+old version along with the old data and never files stale data under a new
+version. Every tag also carries the shared "epoch" version, which
+`bump_all` moves for tools that rewrite the data behind many users at once
+(`ledger rebuild`).
+"""
+import os
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+import models
+from cache import LRUCache
+
+EPOCH = "epoch"
+
+response_cache = LRUCache(
+    maxsize=int(os.environ.get("RESPONSE_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "300")),
+)
+
+
+def user_key(user_id):
+    return f"user:{user_id}"
+
+
+def group_key(group_id):
+    return f"group:{group_id}"
+
+
+def bump(db: Session, user_ids=(), group_ids=()):
+    """Bumps the versions of `user_ids` and `group_ids` inside the caller's transaction.
+
+    Uses the dialect's native upsert where available, like `ledger.apply`,
+    so concurrent writers never race on a missing row. The caller commits.
+
+    Returns:
+        dict: {user_id: new version} for every user in `user_ids`.
+    """
+    user_ids = set(user_ids)
+    names = sorted({user_key(user_id) for user_id in user_ids} | {group_key(group_id) for group_id in group_ids if group_id})
+    if not names:
+        return {}
+    _increment(db, names)
+    if not user_ids:
+        return {}
+    rows = db.execute(
+        select(models.ChangeVersion.name, models.ChangeVersion.version)
+        .where(models.ChangeVersion.name.in_([user_key(user_id) for user_id in user_ids]))
+    )
+    return {int(name.split(":", 1)[1]): version for name, version in rows}
+
+
+def bump_all(db: Session):
+    """Changes every tag at once by bumping the shared epoch. The caller commits."""
+    _increment(db, [EPOCH])
+
+
+def _increment(db: Session, names):
+    rows = [{"name": name, "version": 1} for name in names]
+    dialect = db.get_bind(models.ChangeVersion).dialect.name
+    table = models.ChangeVersion.__table__
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(table)
+        stmt = stmt.on_duplicate_key_update(version=table.c.version + 1)
+        db.execute(stmt, rows)
+    elif dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as upsert_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as upsert_insert
+        stmt = upsert_insert(table)
+        stmt = stmt.on_conflict_do_update(index_elements=["name"], set_={"version": table.c.version + 1})
+        db.execute(stmt, rows)
+    else:
+        existing = set(
+            db.execute(select(models.ChangeVersion.name).where(models.ChangeVersion.name.in_(names)).with_for_update()).scalars()
+        )
+        if existing:
+            db.execute(
+                update(models.ChangeVersion)
+                .where(models.ChangeVersion.name.in_(existing))
+                .values(version=models.ChangeVersion.version + 1)
+            )
+        missing = [row for row in rows if row["name"] not in existing]
+        if missing:
+            db.execute(models.ChangeVersion.__table__.insert(), missing)
+
+
+def commit(db: Session, write_db: Session, user_ids=(), group_ids=()):
+    """Commits `write_db` together with the version bumps it causes.
+
+    When `write_db` is a shard session, the shard commits first and the
+    versions in the global `db` right after, so a reader can briefly see
+    the new rows under the old version, never the old rows under the new
+    one. Either way the caller rolls `write_db` back if this raises.
+
+    Returns:
+        dict: {user_id: new version}, as `bump` does.
+    """
+    try:
+        user_versions = bump(db, user_ids, group_ids)
+        write_db.commit()
+        if db is not write_db:
+            db.commit()
+    except Exception:
+        if db is not write_db:
+            db.rollback()
+        raise
+    return user_versions
+
+
+def current(db: Session, user_id=None, group_id=None):
+    """The version of `user_id` or `group_id`, as it appears in tags and cache keys."""
+    name = user_key(user_id) if group_id is None else group_key(group_id)
+    found = dict(db.execute(
+        select(models.ChangeVersion.name, models.ChangeVersion.version)
+        .where(models.ChangeVersion.name.in_([EPOCH, name]))
+    ).all())
+    return f"{found.get(EPOCH, 0)}.{found.get(name, 0)}"
+
+
+def user_version(db: Session, user_id):
+    """The bare counter of `user_id`, as `bump` returns it."""
+    return db.execute(
+        select(models.ChangeVersion.version).where(models.ChangeVersion.name == user_key(user_id))
+    ).scalar() or 0
+
+
+def etag(endpoint, user_id, version):
+    return f'W/"{endpoint}-{user_id}-{version}"'
+
+
+def _matches(request: Request, tag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or tag in {candidate.strip() for candidate in header.split(",")}
+
+
+def _render(body):
+    return JSONResponse(jsonable_encoder(body)).body
+
+
+def conditional_get(request: Request, db: Session, endpoint, user_id, compute):
+    """Answers a GET for `user_id` from its ETag, the response cache or `compute()`.
+
+    Args:
+        request (Request): The incoming request, for `If-None-Match`.
+        db (Session): The session `compute` reads with; the version is read
+            with it first.
+        endpoint (str): Cache key for the view, including any parameters that
+            change its content.
+        user_id (int): The user whose version the view depends on.
+        compute (Callable[[], Any]): Builds the response body on a cache miss.
+    """
+    tag = etag(endpoint, user_id, current(db, user_id))
+    headers = {"ETag": tag, "Cache-Control": "no-cache"}
+    if _matches(request, tag):
+        return Response(status_code=304, headers=headers)
+    body = response_cache.get(tag)
+    if body is None:
+        body = _render(compute())
+        response_cache.set(tag, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def conditional_get_async(request: Request, db, endpoint, user_id, compute):
+    """`conditional_get` for async routes: `db` is an AsyncSession and `compute` returns an awaitable."""
+    tag = etag(endpoint, user_id, await db.run_sync(current, user_id))
+    headers = {"ETag": tag, "Cache-Control": "no-cache"}
+    if _matches(request, tag):
+        return Response(status_code=304, headers=headers)
+    body = response_cache.get(tag)
+    if body is None:
+        body = _render(await compute())
+        response_cache.set(tag, body)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,230 @@
+"""Write-behind queue that group-commits bursts of expenses.
+
+With WRITE_BEHIND_ENABLED set, `POST /addexpense/deferred` validates the
+payload, puts it on a bounded in-process queue and answers with a ticket.
+A background thread drains the queue and writes up to
+WRITE_BEHIND_BATCH_SIZE expenses per transaction through
+`bulk.ingest_chunk`, flushing at least every WRITE_BEHIND_FLUSH_INTERVAL
+seconds. When the queue holds WRITE_BEHIND_QUEUE_DEPTH payloads, new
+submissions are refused so callers back off instead of piling up memory.
+
+Queued payloads live only in memory: anything not yet committed is lost if
+the process dies, which is the trade for not committing per request. On a
+clean shutdown `stop` closes the queue to new submissions first, waits for
+submissions already past that check, and only then lets the worker drain
+and exit, so every payload that got a ticket is committed or rejected. A
+`stop` given a timeout marks whatever is still queued when it runs out as
+failed instead.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+import bulk
+import metrics
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("WRITE_BEHIND_ENABLED", "").lower() in ("1", "true", "yes")
+BATCH_SIZE = int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", "200"))
+FLUSH_INTERVAL = float(os.environ.get("WRITE_BEHIND_FLUSH_INTERVAL", "0.05"))
+QUEUE_DEPTH = int(os.environ.get("WRITE_BEHIND_QUEUE_DEPTH", "10000"))
+SUBMIT_TIMEOUT = float(os.environ.get("WRITE_BEHIND_SUBMIT_TIMEOUT", "0.05"))
+
+batch_sizes = metrics.register(metrics.Histogram(
+    "write_behind_batch_size", "Expenses committed per write-behind transaction.",
+    (1, 5, 10, 25, 50, 100, 200, 500, 1000)))
+flush_intervals = metrics.register(metrics.Histogram(
+    "write_behind_flush_interval_seconds", "Time between consecutive write-behind commits.", metrics.LATENCY_BUCKETS))
+commit_seconds = metrics.register(metrics.Histogram(
+    "write_behind_commit_duration_seconds", "Time spent writing one write-behind batch.", metrics.LATENCY_BUCKETS))
+end_to_end_seconds = metrics.register(metrics.Histogram(
+    "write_behind_latency_seconds", "Time from submission to commit or rejection.", metrics.LATENCY_BUCKETS))
+submissions = metrics.register(metrics.Counter(
+    "write_behind_submissions_total", "Deferred expense submissions by outcome.", ("outcome",)))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Stopping(Exception):
+    pass
+
+
+class WriteBehindQueue:
+    """Bounded queue of `schema.ExpenseCreate` payloads drained by one worker thread.
+
+    Args:
+        session_factory (Callable[[], Session]): Opens the session for each batch.
+        batch_size (int): Most expenses committed in one transaction.
+        flush_interval (float): Longest a batch waits to fill before committing.
+        max_depth (int): Payloads held before submissions are refused.
+    """
+
+    def __init__(self, session_factory, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, max_depth=QUEUE_DEPTH):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._tickets = LRUCache(maxsize=max(max_depth * 10, 1000), ttl=3600)
+        self._stopping = threading.Event()
+        # `_closed` and `_submitting` are guarded by `_submit_lock`; `stop` sets
+        # `_stopping` for the worker only once no submission is in flight
+        self._submit_lock = threading.Condition()
+        self._closed = False
+        self._submitting = 0
+        self._thread = None
+        self._last_flush = None
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        if self._thread is None:
+            with self._submit_lock:
+                self._closed = False
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Refuses new submissions, then returns once everything queued is committed or rejected.
+
+        Args:
+            timeout (float | None): Longest to wait for the worker. Payloads
+                it has not taken off the queue by then are removed and their
+                tickets marked failed, so none stays queued with nobody left
+                to write it. None waits until the queue is drained.
+        """
+        with self._submit_lock:
+            self._closed = True
+            self._submit_lock.wait_for(lambda: self._submitting == 0)
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                self._fail_pending()
+            self._thread = None
+
+    def _fail_pending(self):
+        while True:
+            try:
+                ticket, _, queued_at = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self._tickets.set(ticket, {
+                "ticket": ticket,
+                "status": "failed",
+                "error": "the server stopped before this expense was written; submit it again",
+            })
+            end_to_end_seconds.observe(time.perf_counter() - queued_at)
+            submissions.inc("failed")
+
+    def submit(self, expense, timeout=SUBMIT_TIMEOUT):
+        """Queues `expense` and returns its ticket.
+
+        Raises:
+            Stopping: If `stop` has begun.
+            QueueFull: If the queue stayed full for `timeout` seconds.
+        """
+        with self._submit_lock:
+            if self._closed:
+                submissions.inc("refused")
+                raise Stopping()
+            self._submitting += 1
+        try:
+            ticket = uuid.uuid4().hex
+            self._tickets.set(ticket, {"ticket": ticket, "status": "queued"})
+            try:
+                self._queue.put((ticket, dict(expense), time.perf_counter()), timeout=timeout)
+            except queue.Full:
+                self._tickets.invalidate(ticket)
+                submissions.inc("refused")
+                raise QueueFull()
+        finally:
+            with self._submit_lock:
+                self._submitting -= 1
+                self._submit_lock.notify_all()
+        submissions.inc("queued")
+        return ticket
+
+    def status(self, ticket):
+        return self._tickets.get(ticket)
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._commit(batch)
+
+    def _commit(self, batch):
+        started = time.perf_counter()
+        db = self.session_factory()
+        try:
+            results = bulk.ingest_chunk(db, [(index, payload) for index, (_, payload, _) in enumerate(batch)])
+        except Exception as e:
+            logger.exception("write-behind batch of %d failed", len(batch))
+            results = [{"status": "rejected", "error": str(e)} for _ in batch]
+        finally:
+            db.close()
+        finished = time.perf_counter()
+
+        for (ticket, _, queued_at), result in zip(batch, results):
+            status = {"ticket": ticket, "status": "committed" if result["status"] == "accepted" else "rejected"}
+            if "expense_id" in result:
+                status["expense_id"] = result["expense_id"]
+            if "error" in result:
+                status["error"] = result["error"]
+            self._tickets.set(ticket, status)
+            end_to_end_seconds.observe(finished - queued_at)
+            submissions.inc(status["status"])
+        batch_sizes.observe(len(batch))
+        commit_seconds.observe(finished - started)
+        if self._last_flush is not None:
+            flush_intervals.observe(started - self._last_flush)
+        self._last_flush = started
+
+
+writer = None
+
+
+def _depth():
+    yield (), writer.depth() if writer else 0
+
+
+metrics.register(metrics.Gauge("write_behind_queue_depth", "Payloads waiting in the write-behind queue.", _depth))
+
+
+def start(session_factory):
+    """Starts the module-level writer when WRITE_BEHIND_ENABLED is set."""
+    global writer
+    if ENABLED and writer is None:
+        writer = WriteBehindQueue(session_factory)
+        writer.start()
+    return writer
+
+
+def stop():
+    global writer
+    if writer is not None:
+        writer.stop()
+        writer = None
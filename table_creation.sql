@@ -2,12 +2,14 @@ create database yet_another_split;
 
 use yet_another_split;
 
+-- mirrors models.py; keep in step with app/migrations
+
 create table users (
 
 user_id int primary key auto_increment,
 first_name varchar(255) not null,
 last_name varchar(255) not null,
-email varchar(255) not null,
+email varchar(255) not null unique,
 created_at datetime default current_timestamp
 
 );
@@ -17,29 +19,187 @@ create table friends (
 user_id int not null,
 friend_user_id int not null,
 added_at datetime default current_timestamp,
+primary key (user_id, friend_user_id),
 foreign key (user_id) references users(user_id),
-foreign key (friend_user_id) references users(user_id)	
+foreign key (friend_user_id) references users(user_id),
+index ix_friends_friend_user_id (friend_user_id)
+
+);
+
+create table bunch (
 
+group_id int primary key auto_increment,
+group_name varchar(255) not null,
+created_by int not null,
+created_at datetime default current_timestamp,
+foreign key (created_by) references users(user_id)
+
+);
+
+create table groupmembers (
+
+groupmember_id int primary key auto_increment,
+groupmember_user_id int,
+groupmember_group_id int,
+added_by int not null,
+added_at datetime default current_timestamp,
+foreign key (groupmember_user_id) references users(user_id),
+foreign key (groupmember_group_id) references bunch(group_id),
+foreign key (added_by) references users(user_id),
+unique key uq_groupmembers_group_user (groupmember_group_id, groupmember_user_id),
+index ix_groupmembers_user_id (groupmember_user_id)
 
 );
 
 create table expenses (
 
 expense_id int primary key auto_increment,
-added_by int not null,
-expense_description varchar(255) not null,
-amount decimal(10, 2) not null,
-foreign key (added_by) references users(user_id)
+created_by int not null,
+group_id int,
+description varchar(255) not null,
+amount float not null,
+created_at datetime default current_timestamp,
+foreign key (created_by) references users(user_id),
+foreign key (group_id) references bunch(group_id),
+index ix_expenses_created_by (created_by, expense_id),
+index ix_expenses_group_id (group_id),
+index ix_expenses_created_at (created_at)
 
 );
 
-create table splits(
+create table splits (
 
+split_id int primary key auto_increment,
 expense_id int not null,
 user_id int not null,
-amountper_person decimal(10, 2) not null,
+amount float not null,
+created_at datetime default current_timestamp,
 foreign key (expense_id) references expenses(expense_id),
-foreign key (user_id) references users(user_id)
+foreign key (user_id) references users(user_id),
+index ix_splits_expense_id (expense_id),
+index ix_splits_user_id (user_id, expense_id)
+
+);
+
+create table balances (
 
+balance_id int primary key auto_increment,
+creditor_id int not null,
+debtor_id int not null,
+group_id int not null default 0,
+amount float not null default 0,
+updated_at datetime default current_timestamp,
+foreign key (creditor_id) references users(user_id),
+foreign key (debtor_id) references users(user_id),
+unique key uq_balances_pair (creditor_id, debtor_id, group_id),
+index ix_balances_debtor_id (debtor_id, creditor_id),
+index ix_balances_group_id (group_id)
 
 );
+
+create table expenses_archive (
+
+expense_id int primary key,
+created_by int not null,
+group_id int,
+description varchar(255) not null,
+amount float not null,
+created_at datetime,
+archived_at datetime default current_timestamp,
+foreign key (created_by) references users(user_id),
+foreign key (group_id) references bunch(group_id),
+index ix_expenses_archive_created_by (created_by, expense_id),
+index ix_expenses_archive_group_id (group_id),
+index ix_expenses_archive_created_at (created_at)
+
+);
+
+create table splits_archive (
+
+split_id int primary key auto_increment,
+expense_id int not null,
+user_id int not null,
+amount float not null,
+created_at datetime,
+foreign key (expense_id) references expenses_archive(expense_id),
+foreign key (user_id) references users(user_id),
+index ix_splits_archive_expense_id (expense_id),
+index ix_splits_archive_user_id (user_id, expense_id)
+
+);
+
+create table balances_carried (
+
+balance_id int primary key auto_increment,
+creditor_id int not null,
+debtor_id int not null,
+group_id int not null default 0,
+amount float not null default 0,
+updated_at datetime default current_timestamp,
+foreign key (creditor_id) references users(user_id),
+foreign key (debtor_id) references users(user_id),
+unique key uq_balances_carried_pair (creditor_id, debtor_id, group_id),
+index ix_balances_carried_group_id (group_id)
+
+);
+
+create table balance_snapshots (
+
+taken_at datetime(6) primary key,
+row_count int not null default 0,
+created_at datetime default current_timestamp
+
+);
+
+create table balance_snapshot_rows (
+
+snapshot_row_id int primary key auto_increment,
+taken_at datetime(6) not null,
+creditor_id int not null,
+debtor_id int not null,
+group_id int not null default 0,
+amount float not null,
+foreign key (taken_at) references balance_snapshots(taken_at),
+unique key uq_balance_snapshot_rows_pair (taken_at, creditor_id, debtor_id, group_id),
+index ix_balance_snapshot_rows_debtor_id (taken_at, debtor_id)
+
+);
+
+create table group_shards (
+
+group_id int primary key auto_increment,
+shard int,
+created_at datetime default current_timestamp
+
+);
+
+create table id_blocks (
+
+name varchar(64) primary key,
+next_id int not null
+
+);
+
+create table change_versions (
+
+name varchar(64) primary key,
+version int not null default 0
+
+);
+
+create table schema_migrations (
+
+version int primary key,
+description varchar(255) not null,
+applied_at datetime not null
+
+);
+
+insert into schema_migrations (version, description, applied_at) values
+(1, 'indexes on splits, expenses, groupmembers, friends and balances; unique group membership', current_timestamp),
+(2, 'index balances by group_id', current_timestamp),
+(3, 'group_shards directory and id_blocks for sharded group data', current_timestamp),
+(4, 'balance_snapshots, balance_snapshot_rows and an index on expenses.created_at', current_timestamp),
+(5, 'expenses_archive, splits_archive and balances_carried for archived expenses', current_timestamp),
+(6, 'balances ledger with uq_balances_pair, ix_balances_debtor_id and ix_balances_group_id, filled from splits', current_timestamp),
+(7, 'change_versions for ETags and settle-up plans', current_timestamp);